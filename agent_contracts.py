@@ -0,0 +1,323 @@
+"""
+Output contracts for the agent steps: compiled validators, a cheap repair pass
+and a cache of parsed outputs.
+
+Every agent function is asked for one JSON object of a documented shape: the
+claim shape is INSURANCE_CLAIM_SCHEMA v1.0 (notebook 02), the rebuttal, judge and
+appeal shapes are the ones spelled out in the prompts (the FN_PROMPT functions
+in notebooks 03-06). Each shape is compiled once into a flat list of field checks,
+so validating a response is one pass over it with no schema interpretation.
+
+check_output() decodes a response, falling back to repair_json() (strip code
+fences and prose around the object, drop trailing commas, close a truncated
+string/array/object), normalises near-misses (enum case, numbers sent as
+strings, a single string where a list is expected) and runs the checks. Results
+are memoised by response text, so Streamlit reruns and the parse_* helpers in
+claims_orchestration never decode the same response twice; treat AgentOutput.data
+as read-only.
+
+A response that still breaks its contract is not fatal on its own:
+claims_orchestration re-asks only that step, once, with correction_prompt()
+listing what was wrong (CompletionBackend.complete_with_correction).
+"""
+import json
+import re
+from functools import lru_cache
+
+# INSURANCE_CLAIM_SCHEMA v1.0 (notebook 02): field types are taken from the example values
+CLAIM_SCHEMA_V1 = {
+    "claim_header": {
+        "claim_id": "CLM-YYYY-XXXXXX", "claim_date": "YYYY-MM-DD", "patient_id": "PAT_XXX",
+        "provider_npi": "1234567890", "insurance_provider": "Cigna", "policy_number": "string",
+        "group_number": "string",
+    },
+    "patient_info": {
+        "first_name": "string", "last_name": "string", "date_of_birth": "YYYY-MM-DD", "gender": "Male/Female",
+        "medical_history": "string", "allergies": "string", "current_medications": "string",
+    },
+    "claim_details": {
+        "procedure_codes": ["85025", "80053"], "diagnosis_codes": ["I10", "E785"], "service_date": "YYYY-MM-DD",
+        "place_of_service": "11", "clinical_notes": "string", "medical_necessity_statement": "string",
+    },
+    "billing_info": {
+        "total_charges": 150.00,
+        "line_items": [{
+            "procedure_code": "85025", "description": "Complete Blood Count", "quantity": 1,
+            "unit_charge": 75.00, "total_charge": 75.00, "modifiers": [],
+        }],
+    },
+    "supporting_documentation": {
+        "physician_notes": "string", "prior_authorization_number": "string or null",
+        "referral_information": "string or null", "additional_documentation": "string",
+    },
+}
+
+# Documented output shapes; "A|B" strings are enums, numbers are numeric fields
+OUTPUT_SHAPES = {
+    "BUILDER_AGENT": CLAIM_SCHEMA_V1,
+    "BUILDER_AGENT_OPTIMIZE": CLAIM_SCHEMA_V1,
+    "INSURANCE_AGENT_WITH_POLICY": {
+        "rebuttal_summary": "string", "denial_reasons": ["string"], "strength_score": 0.5,
+        "policy_citations": ["string"],
+    },
+    "AI_JUDGE_DECISION": {
+        "final_decision": "APPROVED|DENIED", "reasoning": "string", "key_factors": ["string"], "confidence": 0.5,
+    },
+    "DOCTOR_APPEAL_GENERATOR": {
+        "appeal_summary": "string", "medical_justification": "string", "additional_evidence": ["string"],
+    },
+    "INSURANCE_COUNTER_APPEAL": {
+        "counter_response": "string", "position_change": "MAINTAINED|SOFTENED|REVERSED",
+        "new_strength_score": 0.5, "final_recommendation": "APPROVE|DENY|REQUEST_MORE_INFO",
+    },
+}
+
+# Fields each step must return (everything else is checked only when present)
+REQUIRED_FIELDS = {
+    "BUILDER_AGENT": [
+        "claim_header", "patient_info", "claim_details", "claim_details.procedure_codes", "billing_info",
+    ],
+    "BUILDER_AGENT_OPTIMIZE": ["claim_header", "claim_details", "claim_details.procedure_codes"],
+    "INSURANCE_AGENT_WITH_POLICY": ["rebuttal_summary", "denial_reasons", "strength_score"],
+    "AI_JUDGE_DECISION": ["final_decision", "reasoning"],
+    "DOCTOR_APPEAL_GENERATOR": ["appeal_summary", "medical_justification"],
+    "INSURANCE_COUNTER_APPEAL": ["counter_response", "position_change", "new_strength_score", "final_recommendation"],
+}
+
+# Scores on a 0.0-1.0 scale
+UNIT_INTERVAL_FIELDS = {"strength_score", "new_strength_score", "confidence"}
+
+ENUM_PATTERN = re.compile(r"^[A-Z_]+(?:\|[A-Z_]+)+$")
+FENCE_PATTERN = re.compile(r"```[A-Za-z]*\s*(.*?)(?:```|$)", re.DOTALL)
+TRAILING_COMMA_PATTERN = re.compile(r",\s*([}\]])")
+MAX_TRUNCATION_CUTS = 8
+PARSED_CACHE_SIZE = 1024
+
+
+class ContractViolation(ValueError):
+    """An agent response that is not a usable JSON object of its step's shape"""
+
+    def __init__(self, function_name, errors, text=None):
+        self.function_name = function_name
+        self.errors = list(errors)
+        self.text = text
+        super().__init__(f"{function_name} output failed validation: {'; '.join(self.errors)}")
+
+
+def compile_shape(shape, required=(), prefix=()):
+    """Flatten a shape template into (path, kind, required, nullable, options) checks"""
+    required = set(required)
+    checks = []
+    for key, example in shape.items():
+        path = prefix + (key,)
+        dotted = ".".join(path)
+        is_required = dotted in required
+        if isinstance(example, dict):
+            checks.append((path, 'object', is_required, False, None))
+            checks.extend(compile_shape(example, required, path))
+        elif isinstance(example, list):
+            item = example[0] if example else None
+            item_kind = 'object' if isinstance(item, dict) else 'scalar' if item is not None else None
+            checks.append((path, 'list', is_required, False, item_kind))
+        elif isinstance(example, bool):
+            checks.append((path, 'boolean', is_required, False, None))
+        elif isinstance(example, (int, float)):
+            bounds = (0.0, 1.0) if key in UNIT_INTERVAL_FIELDS else None
+            checks.append((path, 'number', is_required, False, bounds))
+        elif isinstance(example, str) and ENUM_PATTERN.match(example):
+            checks.append((path, 'enum', is_required, False, frozenset(example.split("|"))))
+        else:
+            checks.append((path, 'string', is_required, 'null' in str(example), None))
+    return checks
+
+
+CONTRACTS = {
+    function_name: compile_shape(shape, REQUIRED_FIELDS.get(function_name, ()))
+    for function_name, shape in OUTPUT_SHAPES.items()
+}
+
+
+def _strip_wrapping(text):
+    """Code fence contents if fenced, else the text itself"""
+    fence = FENCE_PATTERN.search(text)
+    if fence and fence.group(1).strip():
+        return fence.group(1).strip(), True
+    return text, False
+
+
+def _close_truncated(body):
+    """Candidate completions of a JSON object cut off mid-stream, most complete first"""
+    stack, in_string, escaped, cuts = [], False, False, []
+    for index, char in enumerate(body):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]" and stack:
+            stack.pop()
+        elif char == ",":
+            cuts.append((index, list(stack)))
+    closers = lambda pending: "".join(reversed(pending))
+    tail = body + ('"' if in_string else "")
+    yield tail.rstrip().rstrip(",") + closers(stack)
+    for index, pending in reversed(cuts[-MAX_TRUNCATION_CUTS:]):
+        yield body[:index] + closers(pending)
+
+
+def repair_json(text):
+    """Decode the JSON object in an LLM response; returns (data, repairs) or raises ValueError"""
+    repairs = []
+    body, fenced = _strip_wrapping(text.strip())
+    if fenced:
+        repairs.append("stripped code fence")
+    start = body.find("{")
+    if start < 0:
+        raise ValueError("no JSON object in response")
+    if start > 0:
+        repairs.append("dropped text before the JSON object")
+    decoder = json.JSONDecoder()
+    try:
+        data, end = decoder.raw_decode(body, start)
+        if body[end:].strip():
+            repairs.append("dropped text after the JSON object")
+        return data, repairs
+    except json.JSONDecodeError:
+        pass
+    body = body[start:]
+    cleaned = TRAILING_COMMA_PATTERN.sub(r"\1", body)
+    if cleaned != body:
+        try:
+            data, end = decoder.raw_decode(cleaned)
+            return data, repairs + ["removed trailing commas"]
+        except json.JSONDecodeError:
+            body = cleaned
+            repairs.append("removed trailing commas")
+    for candidate in _close_truncated(body):
+        try:
+            return json.loads(candidate), repairs + ["closed truncated JSON"]
+        except json.JSONDecodeError:
+            continue
+    raise ValueError("response is not valid JSON and could not be repaired")
+
+
+def _validate(checks, data):
+    """Run compiled checks on data in place; returns (errors, normalisations)"""
+    errors, fixes = [], []
+    for path, kind, required, nullable, options in checks:
+        parent = data
+        for key in path[:-1]:
+            parent = parent.get(key) if isinstance(parent, dict) else None
+        if not isinstance(parent, dict):
+            continue  # reported on the parent object
+        dotted, key = ".".join(path), path[-1]
+        value = parent.get(key)
+        if value is None:
+            if required and not (nullable and key in parent):
+                errors.append(f"missing {dotted}")
+            continue
+        if kind == 'object':
+            if not isinstance(value, dict):
+                errors.append(f"{dotted} must be an object")
+        elif kind == 'list':
+            if isinstance(value, str):
+                parent[key] = value = [value]
+                fixes.append(f"wrapped {dotted} in a list")
+            if not isinstance(value, list):
+                errors.append(f"{dotted} must be a list")
+            elif options == 'scalar' and any(isinstance(item, (dict, list)) for item in value):
+                errors.append(f"{dotted} must be a list of strings")
+            elif options == 'object' and not all(isinstance(item, dict) for item in value):
+                errors.append(f"{dotted} must be a list of objects")
+        elif kind == 'number':
+            if isinstance(value, str):
+                try:
+                    parent[key] = value = float(value.strip().rstrip("%"))
+                    fixes.append(f"parsed {dotted} as a number")
+                except ValueError:
+                    errors.append(f"{dotted} must be a number")
+                    continue
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                errors.append(f"{dotted} must be a number")
+            elif options and not options[0] <= value <= options[1]:
+                errors.append(f"{dotted} must be between {options[0]} and {options[1]}")
+        elif kind == 'enum':
+            normalised = str(value).strip().upper().replace(" ", "_")
+            if normalised not in options:
+                errors.append(f"{dotted} must be one of {'|'.join(sorted(options))}")
+            elif normalised != value:
+                parent[key] = normalised
+                fixes.append(f"normalised {dotted}")
+        elif kind == 'boolean':
+            if not isinstance(value, bool):
+                errors.append(f"{dotted} must be true or false")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            parent[key] = str(value)
+            fixes.append(f"converted {dotted} to text")
+        elif not isinstance(value, str):
+            errors.append(f"{dotted} must be a string")
+    return errors, fixes
+
+
+class AgentOutput:
+    """One checked agent response: canonical text, parsed object, repairs applied and contract errors"""
+
+    def __init__(self, function_name, text, data, repairs, errors):
+        self.function_name = function_name
+        self.text = text
+        self.data = data
+        self.repairs = repairs
+        self.errors = errors
+
+    @property
+    def valid(self):
+        return self.data is not None and not self.errors
+
+    def require(self):
+        """The output itself, or ContractViolation if it breaks the contract"""
+        if not self.valid:
+            raise ContractViolation(self.function_name, self.errors, self.text)
+        return self
+
+
+@lru_cache(maxsize=PARSED_CACHE_SIZE)
+def check_output(function_name, text):
+    """Decode, repair and validate one response (memoised by function and text)"""
+    if not isinstance(text, str):
+        return AgentOutput(function_name, text, None, [], ["response is empty"])
+    try:
+        data = json.loads(text)
+        repairs = []
+    except json.JSONDecodeError:
+        try:
+            data, repairs = repair_json(text)
+        except ValueError as e:
+            return AgentOutput(function_name, text, None, [], [str(e)])
+    if not isinstance(data, dict):
+        return AgentOutput(function_name, text, None, repairs, ["response must be a JSON object"])
+    errors, fixes = _validate(CONTRACTS.get(function_name, []), data)
+    repairs = repairs + fixes
+    return AgentOutput(function_name, json.dumps(data) if repairs else text, data, repairs, errors)
+
+
+def parsed(function_name, text):
+    """Parsed JSON object of a response (repaired if needed), or None"""
+    return check_output(function_name, text).data
+
+
+def correction_prompt(function_name, output):
+    """Instruction appended to a step's prompt when its previous response broke the contract"""
+    shape = OUTPUT_SHAPES.get(function_name)
+    required = ", ".join(REQUIRED_FIELDS.get(function_name, []))
+    return (
+        f"Your previous response could not be used: {'; '.join(output.errors)}. "
+        f"Respond again with ONLY one complete JSON object of this shape: {json.dumps(shape, separators=(',', ':'))}. "
+        f"Required fields: {required}. Scores are numbers between 0 and 1. "
+        "No explanations, no markdown, no code fences."
+    )
@@ -0,0 +1,169 @@
+"""
+Offline copies of the agent prompts, for size estimates.
+
+The prompts themselves live in SQL: every agent function in notebooks 03-06 is
+COMPLETE over its FN_PROMPT function, and CortexBackend fetches FN_PROMPT when it
+needs the text (streaming, contract corrections), so nothing sent to a model is
+built here. These builders mirror the FN_PROMPT functions character for character
+so telemetry, the benchmark and the appeal-digest savings can count prompt tokens
+without a query; change both together.
+"""
+import json
+import math
+
+from claims_orchestration import AGENT_SCHEMA
+
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(char_count):
+    """Rough token count for English/JSON text (about 4 characters per token)"""
+    return math.ceil(char_count / CHARS_PER_TOKEN) if char_count else 0
+
+
+def policy_section(session, procedure_code):
+    """Rank-1 policy section for a procedure code (POLICY_CODE_INDEX point lookup)"""
+    if session is None:
+        return ""
+    rows = session.sql(f"""
+        SELECT SECTION_CONTENT FROM {AGENT_SCHEMA}.POLICY_CODE_INDEX
+        WHERE PROCEDURE_CODE = UPPER(TRIM(?))
+          AND SOURCE_TYPE = 'DOCUMENT' AND MATCH_RANK = 1
+    """, params=[procedure_code]).collect()
+    return rows[0]['SECTION_CONTENT'] if rows and rows[0]['SECTION_CONTENT'] else ""
+
+
+def patient_context(session, patient_id):
+    """Medical history and medications line the optimize function adds to its prompt"""
+    if session is None:
+        return ""
+    rows = session.sql(f"""
+        SELECT 'Medical History: ' || MEDICAL_HISTORY_SUMMARY || ', Medications: ' || CURRENT_MEDICATIONS as CONTEXT
+        FROM {AGENT_SCHEMA}.PATIENTS WHERE PATIENT_ID = ? LIMIT 1
+    """, params=[patient_id]).collect()
+    return rows[0]['CONTEXT'] if rows and rows[0]['CONTEXT'] else ""
+
+
+def builder_prompt(patient_id, procedure_code, clinical_notes):
+    return (
+        f"You are a Builder Agent for Cigna insurance claims. Generate ONLY valid JSON for patient {patient_id} "
+        f"requesting procedure {procedure_code}. Clinical notes: {clinical_notes}. Use this schema: "
+        f'{{"claim_header":{{"claim_id":"CLM-2024-001","patient_id":"{patient_id}","insurance_provider":"Cigna"}},'
+        f'"patient_info":{{"first_name":"string","last_name":"string"}},'
+        f'"claim_details":{{"procedure_codes":["{procedure_code}"]}},"billing_info":{{"total_charges":75.00}}}}. '
+        "Return ONLY JSON."
+    )
+
+
+def _minified_json(text):
+    """TO_JSON(TRY_PARSE_JSON(text)), falling back to the text itself"""
+    try:
+        return json.dumps(json.loads(text), separators=(",", ":"), sort_keys=True)
+    except (json.JSONDecodeError, TypeError):
+        return text
+
+
+def rebuttal_digest_text(insurance_rebuttal):
+    """Python copy of the REBUTTAL_DIGEST SQL function (notebook 06): summary, reasons, citations, score"""
+    try:
+        rebuttal = json.loads(insurance_rebuttal)
+    except (json.JSONDecodeError, TypeError):
+        rebuttal = None
+    if rebuttal is None:
+        return (insurance_rebuttal or "")[:400]
+    if not isinstance(rebuttal, dict):
+        return json.dumps({}, separators=(",", ":"))
+    summary = rebuttal.get('rebuttal_summary')
+    digest = {
+        'rebuttal_summary': summary[:400] if isinstance(summary, str) else summary,
+        'denial_reasons': rebuttal.get('denial_reasons'),
+        'policy_citations': rebuttal.get('policy_citations'),
+        'strength_score': rebuttal.get('strength_score'),
+    }
+    # OBJECT_CONSTRUCT drops NULL values
+    return json.dumps({key: value for key, value in digest.items() if value is not None},
+                      separators=(",", ":"), sort_keys=True)
+
+
+def builder_optimize_prompt(original_claim, insurance_rebuttal, policy_text="", patient_text=""):
+    return (
+        "You are a Builder Agent optimizing a Cigna insurance claim. Improve the claim based on this feedback."
+        f"\n\nORIGINAL CLAIM: {_minified_json(original_claim)}"
+        f"\n\nINSURANCE AGENT REBUTTAL: {rebuttal_digest_text(insurance_rebuttal)}"
+        f"\n\nRELEVANT POLICY: {policy_text[:1500]}"
+        f"\n\nPATIENT CONTEXT: {patient_text}"
+        "\n\nOUTPUT: Return ONLY improved JSON claim addressing all rebuttal issues. Include better medical "
+        "necessity justification, proper documentation, and policy compliance."
+    )
+
+
+def insurance_prompt(claim_json, procedure_code, policy_text=""):
+    return (
+        f"You are an Insurance Agent for Cigna. Analyze this claim: {claim_json}"
+        f"\n\nRELEVANT CIGNA POLICY: {policy_text}"
+        "\n\nYour goal: Deny claims when possible while following Cigna policies. Generate JSON: "
+        '{"rebuttal_summary":"string","denial_reasons":["string"],"strength_score":number,"policy_citations":["string"]}. '
+        "Be strict. ONLY JSON."
+    )
+
+
+def judge_prompt(claim_json, insurance_rebuttal, patient_id, procedure_code):
+    return (
+        "You are an impartial AI Judge arbitrating a Cigna insurance claim dispute between a provider's "
+        f"Builder Agent and the Insurance Agent for patient {patient_id}, procedure {procedure_code}."
+        f"\n\nCLAIM: {claim_json}"
+        f"\n\nINSURANCE REBUTTAL: {insurance_rebuttal}"
+        "\n\nWeigh medical necessity, documentation and policy compliance. Generate JSON: "
+        '{"final_decision":"APPROVED|DENIED","reasoning":"string","key_factors":["string"],"confidence":number}. '
+        "ONLY JSON."
+    )
+
+
+def doctor_appeal_prompt(claim_json, insurance_rebuttal, judge_decision, round_num):
+    return (
+        f"You are the treating physician filing appeal round {round_num} for a denied Cigna claim."
+        f"\n\nORIGINAL CLAIM: {claim_json}"
+        f"\n\nINSURANCE ANALYSIS: {insurance_rebuttal}"
+        f"\n\nJUDGE DECISION: {judge_decision}"
+        "\n\nAddress every denial reason with clinical evidence. Generate JSON: "
+        '{"appeal_summary":"string","medical_justification":"string","additional_evidence":["string"]}. '
+        "ONLY JSON."
+    )
+
+
+def insurance_counter_prompt(doctor_appeal, insurance_rebuttal, round_num):
+    return (
+        f"You are the Cigna Insurance Agent responding to appeal round {round_num}."
+        f"\n\nDOCTOR APPEAL: {doctor_appeal}"
+        f"\n\nORIGINAL ANALYSIS: {insurance_rebuttal}"
+        "\n\nReconsider your position against Cigna policy. Generate JSON: "
+        '{"counter_response":"string","position_change":"MAINTAINED|SOFTENED|REVERSED",'
+        '"new_strength_score":number,"final_recommendation":"APPROVE|DENY|REQUEST_MORE_INFO"}. '
+        "ONLY JSON."
+    )
+
+
+def build_prompt(function_name, args, session=None):
+    """Prompt for one agent function call, given the same args the SQL function takes.
+
+    With a session, database context (policy sections) is looked up the same way
+    the SQL functions do; without one the prompt is built offline.
+    """
+    if function_name == "BUILDER_AGENT":
+        return builder_prompt(*args)
+    if function_name == "BUILDER_AGENT_OPTIMIZE":
+        original_claim, insurance_rebuttal, patient_id, procedure_code = args
+        return builder_optimize_prompt(
+            original_claim, insurance_rebuttal,
+            policy_section(session, procedure_code), patient_context(session, patient_id)
+        )
+    if function_name == "INSURANCE_AGENT_WITH_POLICY":
+        claim_json, procedure_code = args
+        return insurance_prompt(claim_json, procedure_code, policy_section(session, procedure_code))
+    if function_name == "AI_JUDGE_DECISION":
+        return judge_prompt(*args)
+    if function_name == "DOCTOR_APPEAL_GENERATOR":
+        return doctor_appeal_prompt(*args)
+    if function_name == "INSURANCE_COUNTER_APPEAL":
+        return insurance_counter_prompt(*args)
+    raise ValueError(f"No prompt template for agent function {function_name}")
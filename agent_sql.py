@@ -0,0 +1,164 @@
+"""
+Bind-parameter statements for the agent functions.
+
+Agent calls used to inline the claim JSON, rebuttals and notes into the SQL
+text, so every statement was unique (no reuse of compiled plans), multi-KB
+literals inflated the query text and escaping slips broke whole runs. Here each
+agent function has exactly one statement shape, SELECT FN(?, ?, ...), and the
+arguments travel as bind parameters. The same statement with one more argument
+calls the function's model overload (a step routed to another model), and
+FN_PROMPT(?, ...) returns the prompt the function sends, for streaming and
+contract-correction retries.
+
+Every call is tagged with a unique QUERY_TAG (CLAIMS_AGENT|<function>|<call id>)
+through statement parameters, which costs no extra round trip. statement_timings()
+resolves a batch of tags against the session's query history in one query and
+splits each call's time into compilation, queueing and execution;
+compile_execute_summary() does the same per function over a time window.
+"""
+import threading
+import time
+import uuid
+from collections import deque
+from functools import lru_cache
+
+from claims_orchestration import AGENT_SCHEMA
+
+QUERY_TAG_PREFIX = "CLAIMS_AGENT"
+RESPONSE_ALIAS = "RESPONSE"
+PROMPT_SUFFIX = "_PROMPT"
+DEFAULT_LOG_SIZE = 2000
+
+
+@lru_cache(maxsize=None)
+def agent_statement(function_name, arg_count, alias=RESPONSE_ALIAS):
+    """The one SQL text used for every call of an agent function"""
+    placeholders = ", ".join("?" for _ in range(arg_count))
+    return f"SELECT {AGENT_SCHEMA}.{function_name}({placeholders}) as {alias}"
+
+
+def complete_statement(alias=RESPONSE_ALIAS):
+    """SQL text for a prompt sent to Cortex directly (model, prompt bound)"""
+    return f"SELECT SNOWFLAKE.CORTEX.COMPLETE(?, ?) as {alias}"
+
+
+def query_tag(function_name):
+    return f"{QUERY_TAG_PREFIX}|{function_name}|{uuid.uuid4().hex[:16]}"
+
+
+class AgentStatements:
+    """Runs agent functions with bind parameters and remembers each call's query tag"""
+
+    def __init__(self, session, alias=RESPONSE_ALIAS, log_size=DEFAULT_LOG_SIZE):
+        self.session = session
+        self.alias = alias
+        self.calls = deque(maxlen=log_size)
+        self._lock = threading.Lock()
+
+    def _dataframe(self, function_name, args):
+        return self.session.sql(agent_statement(function_name, len(args), self.alias), params=list(args))
+
+    def _log(self, function_name, tag, started, wall_ms=None):
+        call = {'function_name': function_name, 'query_tag': tag, 'started': started, 'wall_ms': wall_ms}
+        with self._lock:
+            self.calls.append(call)
+        return call
+
+    def _collect(self, function_name, dataframe):
+        tag = query_tag(function_name)
+        started = time.perf_counter()
+        rows = dataframe.collect(statement_params={"QUERY_TAG": tag})
+        self._log(function_name, tag, started, (time.perf_counter() - started) * 1000)
+        return rows[0][self.alias]
+
+    def run(self, function_name, args):
+        """Blocking call; returns the function's text output"""
+        return self._collect(function_name, self._dataframe(function_name, args))
+
+    def run_model(self, function_name, args, model_name):
+        """Blocking call of the function's overload that takes the model as its last argument"""
+        return self.run(function_name, [*args, model_name])
+
+    def prompt(self, function_name, args):
+        """The prompt text the function sends to COMPLETE (FN_PROMPT; no LLM call)"""
+        return self.run(f"{function_name}{PROMPT_SUFFIX}", args)
+
+    def complete_prompt(self, function_name, model_name, prompt):
+        """Blocking COMPLETE call with a given prompt, tagged as function_name"""
+        return self._collect(function_name, self.session.sql(complete_statement(self.alias), params=[model_name, prompt]))
+
+    def _collect_nowait(self, function_name, dataframe):
+        tag = query_tag(function_name)
+        job = dataframe.collect_nowait(statement_params={"QUERY_TAG": tag})
+        self._log(function_name, tag, time.perf_counter())
+        return job
+
+    def submit(self, function_name, args):
+        """Async call; returns the Snowpark AsyncJob (wall time is not known here)"""
+        return self._collect_nowait(function_name, self._dataframe(function_name, args))
+
+    def submit_model(self, function_name, args, model_name):
+        """Async call of the function's model overload; returns the Snowpark AsyncJob"""
+        return self.submit(function_name, [*args, model_name])
+
+    def recent_calls(self, since=None):
+        """Logged calls, optionally only those started at or after a perf_counter() mark"""
+        with self._lock:
+            calls = list(self.calls)
+        return [call for call in calls if since is None or call['started'] >= since]
+
+    def timings(self, since=None):
+        """Logged calls joined with their compile/queue/execute times from query history"""
+        calls = self.recent_calls(since)
+        by_tag = statement_timings(self.session, [call['query_tag'] for call in calls])
+        return [{**call, **by_tag.get(call['query_tag'], {})} for call in calls]
+
+
+def statement_timings(session, tags):
+    """{query tag: compile/queue/execute/total ms} for finished queries of this session"""
+    if not tags:
+        return {}
+    placeholders = ", ".join("?" for _ in tags)
+    rows = session.sql(f"""
+        SELECT QUERY_TAG, QUERY_ID, EXECUTION_STATUS,
+               COMPILATION_TIME as COMPILE_MS,
+               QUEUED_PROVISIONING_TIME + QUEUED_OVERLOAD_TIME + QUEUED_REPAIR_TIME as QUEUED_MS,
+               EXECUTION_TIME as EXECUTE_MS,
+               TOTAL_ELAPSED_TIME as TOTAL_MS
+        FROM TABLE(INFORMATION_SCHEMA.QUERY_HISTORY_BY_SESSION(RESULT_LIMIT => 10000))
+        WHERE QUERY_TAG IN ({placeholders})
+    """, params=list(tags)).collect()
+    return {
+        row['QUERY_TAG']: {
+            'query_id': row['QUERY_ID'],
+            'status': row['EXECUTION_STATUS'],
+            'compile_ms': row['COMPILE_MS'],
+            'queued_ms': row['QUEUED_MS'],
+            'execute_ms': row['EXECUTE_MS'],
+            'total_ms': row['TOTAL_MS'],
+        }
+        for row in rows
+    }
+
+
+def compile_execute_summary(session, hours=24):
+    """Per agent function: calls, avg/p95 compile and execute ms and compile share of total"""
+    return session.sql(f"""
+        SELECT
+            SPLIT_PART(QUERY_TAG, '|', 2) as FUNCTION_NAME,
+            COUNT(*) as CALLS,
+            COUNT(DISTINCT HASH(QUERY_TEXT)) as STATEMENT_SHAPES,
+            ROUND(AVG(COMPILATION_TIME)) as AVG_COMPILE_MS,
+            ROUND(PERCENTILE_CONT(0.95) WITHIN GROUP (ORDER BY COMPILATION_TIME)) as P95_COMPILE_MS,
+            ROUND(AVG(EXECUTION_TIME)) as AVG_EXECUTE_MS,
+            ROUND(PERCENTILE_CONT(0.95) WITHIN GROUP (ORDER BY EXECUTION_TIME)) as P95_EXECUTE_MS,
+            ROUND(SUM(COMPILATION_TIME) / NULLIF(SUM(TOTAL_ELAPSED_TIME), 0), 4) as COMPILE_SHARE
+        FROM TABLE(INFORMATION_SCHEMA.QUERY_HISTORY(
+            END_TIME_RANGE_START => DATEADD(hour, -{int(hours)}, CURRENT_TIMESTAMP()),
+            RESULT_LIMIT => 10000
+        ))
+        WHERE STARTSWITH(QUERY_TAG, ?)
+          AND EXECUTION_STATUS = 'SUCCESS'
+        GROUP BY 1
+        ORDER BY AVG_EXECUTE_MS DESC
+    """, params=[f"{QUERY_TAG_PREFIX}|"]).to_pandas()
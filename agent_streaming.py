@@ -0,0 +1,79 @@
+"""
+Streaming agent completions for the Streamlit UI.
+
+Instead of blocking on the SQL agent function until the whole completion is back,
+the step runs through CompletionBackend.stream() (completion_backends.py), so
+tokens can be rendered as they arrive. CortexBackend fetches the function's prompt
+(its FN_PROMPT SQL function) and sends it to the streaming Cortex completion API; StubBackend replays
+canned agent responses in small chunks, so the streaming UI can be exercised
+offline:
+
+    python agent_streaming.py
+"""
+import json
+import time
+
+from claims_orchestration import cached_response, conforming_response
+from completion_backends import StubBackend
+
+DEFAULT_MODEL = "snowflake-arctic"
+RENDER_INTERVAL_SECONDS = 0.05
+
+
+def stream_agent(backend, function_name, args, on_token=None, cache=None,
+                 render_interval=RENDER_INTERVAL_SECONDS):
+    """Stream one agent step and return the full completion text.
+
+    on_token(text_so_far) is called as chunks arrive (at most every render_interval
+    seconds, plus once at the end) so the caller can redraw a placeholder. Cached
+    responses are rendered in one go; fresh ones are checked against the step's
+    output contract (repaired or re-asked once) and stored once the stream ends.
+    """
+    model_name = backend.model_for(function_name) or DEFAULT_MODEL
+    cached = cached_response(backend, function_name, args, cache)
+    if cached is not None:
+        if on_token:
+            on_token(cached)
+        return cached
+
+    chunks = []
+    last_render = 0.0
+    for chunk in backend.stream(function_name, args):
+        chunks.append(chunk)
+        now = time.monotonic()
+        if on_token and now - last_render >= render_interval:
+            on_token("".join(chunks))
+            last_render = now
+    text = conforming_response(backend, function_name, args, "".join(chunks).strip())
+    if on_token:
+        on_token(text)
+    if cache is not None:
+        cache.put(function_name, model_name, args, text)
+    return text
+
+
+def main():
+    """Stream every agent step from the stub backend and report time to first token"""
+    backend = StubBackend(latency_seconds=1.0)
+    steps = [
+        ("BUILDER_AGENT", ["PAT_001", "85025", "Diabetes monitoring, fatigue"]),
+        ("INSURANCE_AGENT_WITH_POLICY", ["{claim}", "85025"]),
+        ("AI_JUDGE_DECISION", ["{claim}", "{rebuttal}", "PAT_001", "85025"]),
+        ("DOCTOR_APPEAL_GENERATOR", ["{claim}", "{rebuttal}", "{judge}", 1]),
+        ("INSURANCE_COUNTER_APPEAL", ["{appeal}", "{rebuttal}", 1]),
+    ]
+    for function_name, args in steps:
+        started = time.perf_counter()
+        first_token = {}
+
+        def on_token(text):
+            first_token.setdefault('at', time.perf_counter() - started)
+
+        text = stream_agent(backend, function_name, args, on_token=on_token)
+        json.loads(text)
+        print(f"{function_name:<28} first token {first_token['at'] * 1000:6.0f} ms   "
+              f"complete {(time.perf_counter() - started) * 1000:6.0f} ms   {len(text)} chars")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,361 @@
+"""
+Per-step telemetry for agent calls, written to CLAIMS_DEMO.PUBLIC.AGENT_INTERACTIONS.
+
+InstrumentedBackend wraps any CompletionBackend and records one row per agent
+call (Builder, Insurance, Judge and each appeal round): wall time, prompt and
+response size in characters and estimated tokens, model, cache hit and
+SUCCESS/ERROR status. Rows are queued in memory and written by a background
+thread in batches, so instrumentation never adds a round trip to the claim
+workflow. The query helpers at the bottom feed the Agent Latency dashboard page.
+"""
+import atexit
+import json
+import logging
+import threading
+import time
+import uuid
+
+from snowflake.snowpark.types import BooleanType, FloatType, IntegerType, StringType, StructField, StructType
+
+import agent_prompts
+from agent_prompts import estimate_tokens
+from claims_orchestration import AGENT_MODELS, AGENT_SCHEMA
+from completion_backends import CompletionBackend, ObservedJob
+
+INTERACTIONS_TABLE = f"{AGENT_SCHEMA}.AGENT_INTERACTIONS"
+
+DEFAULT_FLUSH_INTERVAL_SECONDS = 5.0
+DEFAULT_BATCH_SIZE = 200
+DEFAULT_MAX_PENDING = 10000
+
+AGENT_TYPES = {
+    "BUILDER_AGENT": "BUILDER",
+    "BUILDER_AGENT_OPTIMIZE": "BUILDER_OPTIMIZE",
+    "INSURANCE_AGENT_WITH_POLICY": "INSURANCE",
+    "AI_JUDGE_DECISION": "JUDGE",
+    "DOCTOR_APPEAL_GENERATOR": "DOCTOR_APPEAL",
+    "INSURANCE_COUNTER_APPEAL": "INSURANCE_COUNTER",
+}
+
+# Position of the round number in each appeal function's arguments
+APPEAL_ROUND_ARG = {
+    "DOCTOR_APPEAL_GENERATOR": 3,
+    "INSURANCE_COUNTER_APPEAL": 2,
+}
+
+INTERACTION_STAGING_SCHEMA = StructType([
+    StructField("INTERACTION_ID", StringType()),
+    StructField("SESSION_ID", StringType()),
+    StructField("AGENT_TYPE", StringType()),
+    StructField("FUNCTION_NAME", StringType()),
+    StructField("MODEL_NAME", StringType()),
+    StructField("APPEAL_ROUND", IntegerType()),
+    StructField("INPUT_TEXT", StringType()),
+    StructField("OUTPUT_TEXT", StringType()),
+    StructField("AGE_MS", FloatType()),
+    StructField("PROCESSING_STATUS", StringType()),
+    StructField("ERROR_MESSAGE", StringType()),
+    StructField("WALL_TIME_MS", FloatType()),
+    StructField("PROMPT_CHARS", IntegerType()),
+    StructField("RESPONSE_CHARS", IntegerType()),
+    StructField("PROMPT_TOKENS", IntegerType()),
+    StructField("RESPONSE_TOKENS", IntegerType()),
+    StructField("CACHE_HIT", BooleanType()),
+])
+
+logger = logging.getLogger("agent_telemetry")
+
+
+def prompt_chars(function_name, args):
+    """Size of the agent prompt, excluding policy context the SQL function looks up itself"""
+    try:
+        return len(agent_prompts.build_prompt(function_name, args))
+    except (ValueError, TypeError):
+        return len(json.dumps(args, default=str))
+
+
+def appeal_round(function_name, args):
+    position = APPEAL_ROUND_ARG.get(function_name)
+    if position is None or len(args) <= position:
+        return None
+    try:
+        return int(args[position])
+    except (TypeError, ValueError):
+        return None
+
+
+class AgentTelemetry:
+    """Buffers interaction rows and appends them to AGENT_INTERACTIONS in batches.
+
+    A daemon thread flushes every flush_interval_seconds, or sooner once
+    batch_size rows are waiting. If writes fall behind, the oldest rows beyond
+    max_pending are dropped (and counted) rather than growing without bound.
+    """
+
+    def __init__(self, session, flush_interval_seconds=DEFAULT_FLUSH_INTERVAL_SECONDS,
+                 batch_size=DEFAULT_BATCH_SIZE, max_pending=DEFAULT_MAX_PENDING,
+                 capture_payloads=True, enabled=True):
+        self.session = session
+        self.flush_interval_seconds = flush_interval_seconds
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.capture_payloads = capture_payloads
+        self.enabled = enabled
+        self.recorded = 0
+        self.written = 0
+        self.dropped = 0
+        self.write_errors = 0
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._writer = None
+        atexit.register(self.close)
+
+    def _ensure_writer(self):
+        with self._lock:
+            if self._writer is not None or self._stopped.is_set():
+                return
+            self._writer = threading.Thread(target=self._run, name="agent-telemetry", daemon=True)
+        self._writer.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_interval_seconds)
+            self._wake.clear()
+            self.flush()
+
+    def record(self, function_name, args, response=None, error=None, elapsed_seconds=None,
+               cache_hit=False, session_id=None, model_name=None):
+        """Queue one agent call; never blocks on Snowflake. model_name defaults to the step's SQL function model"""
+        if not self.enabled:
+            return
+        response_text = response or ""
+        prompt_size = prompt_chars(function_name, args)
+        row = {
+            'INTERACTION_ID': f"INT_{uuid.uuid4().hex}",
+            'SESSION_ID': session_id,
+            'AGENT_TYPE': AGENT_TYPES.get(function_name, function_name[:20]),
+            'FUNCTION_NAME': function_name,
+            'MODEL_NAME': model_name or AGENT_MODELS.get(function_name),
+            'APPEAL_ROUND': appeal_round(function_name, args),
+            'INPUT_TEXT': json.dumps({'function': function_name, 'args': args}, default=str) if self.capture_payloads else None,
+            'OUTPUT_TEXT': response_text if self.capture_payloads and response_text else None,
+            'RECORDED_AT': time.monotonic(),
+            'PROCESSING_STATUS': 'ERROR' if error is not None else 'SUCCESS',
+            'ERROR_MESSAGE': str(error)[:4000] if error is not None else None,
+            'WALL_TIME_MS': elapsed_seconds * 1000 if elapsed_seconds is not None else None,
+            'PROMPT_CHARS': prompt_size,
+            'RESPONSE_CHARS': len(response_text),
+            'PROMPT_TOKENS': estimate_tokens(prompt_size),
+            'RESPONSE_TOKENS': estimate_tokens(len(response_text)),
+            'CACHE_HIT': bool(cache_hit),
+        }
+        with self._lock:
+            self._pending.append(row)
+            self.recorded += 1
+            overflow = len(self._pending) - self.max_pending
+            if overflow > 0:
+                del self._pending[:overflow]
+                self.dropped += overflow
+            wake = len(self._pending) >= self.batch_size
+        self._ensure_writer()
+        if wake:
+            self._wake.set()
+
+    def flush(self):
+        """Write everything queued so far; returns the number of rows written"""
+        written = 0
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    batch = self._pending[:self.batch_size]
+                    del self._pending[:self.batch_size]
+                if not batch:
+                    return written
+                try:
+                    self._write(batch)
+                    written += len(batch)
+                    with self._lock:
+                        self.written += len(batch)
+                except Exception as e:
+                    with self._lock:
+                        self.write_errors += 1
+                        self.dropped += len(batch)
+                    logger.warning("Could not write %d agent interactions: %s", len(batch), e)
+
+    def _write(self, batch):
+        now = time.monotonic()
+        rows = [
+            [
+                row['INTERACTION_ID'], row['SESSION_ID'], row['AGENT_TYPE'], row['FUNCTION_NAME'],
+                row['MODEL_NAME'], row['APPEAL_ROUND'], row['INPUT_TEXT'], row['OUTPUT_TEXT'],
+                (now - row['RECORDED_AT']) * 1000, row['PROCESSING_STATUS'], row['ERROR_MESSAGE'],
+                row['WALL_TIME_MS'], row['PROMPT_CHARS'], row['RESPONSE_CHARS'],
+                row['PROMPT_TOKENS'], row['RESPONSE_TOKENS'], row['CACHE_HIT'],
+            ]
+            for row in batch
+        ]
+        staged = self.session.create_dataframe(rows, schema=INTERACTION_STAGING_SCHEMA)
+        # Timestamps are taken when the call finished, not when the batch is written
+        staged.select_expr(
+            "INTERACTION_ID", "SESSION_ID", "AGENT_TYPE", "FUNCTION_NAME", "MODEL_NAME", "APPEAL_ROUND",
+            "PARSE_JSON(INPUT_TEXT) AS INPUT_DATA",
+            "COALESCE(TRY_PARSE_JSON(OUTPUT_TEXT), TO_VARIANT(OUTPUT_TEXT)) AS OUTPUT_DATA",
+            "DATEADD(millisecond, -ROUND(AGE_MS), CURRENT_TIMESTAMP())::TIMESTAMP_NTZ AS INTERACTION_TIMESTAMP",
+            "PROCESSING_STATUS", "ERROR_MESSAGE", "WALL_TIME_MS",
+            "PROMPT_CHARS", "RESPONSE_CHARS", "PROMPT_TOKENS", "RESPONSE_TOKENS", "CACHE_HIT",
+        ).write.save_as_table(INTERACTIONS_TABLE, mode="append", column_order="name")
+
+    def close(self):
+        """Stop the writer thread and flush what is left"""
+        self._stopped.set()
+        self._wake.set()
+        if self._writer is not None and self._writer is not threading.current_thread():
+            self._writer.join(timeout=self.flush_interval_seconds + 1)
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'recorded': self.recorded,
+                'written': self.written,
+                'pending': len(self._pending),
+                'dropped': self.dropped,
+                'write_errors': self.write_errors,
+            }
+
+
+class InstrumentedBackend(CompletionBackend):
+    """CompletionBackend wrapper that records every agent call to AgentTelemetry"""
+
+    def __init__(self, backend, telemetry, session_id=None):
+        self.backend = backend
+        self.telemetry = telemetry
+        self.session_id = session_id
+        self.name = getattr(backend, "name", "backend")
+        self.session = getattr(backend, "session", None)
+
+    def _record(self, function_name, args, response, error, elapsed, cache_hit=False, model=None):
+        self.telemetry.record(function_name, args, response=response, error=error, elapsed_seconds=elapsed,
+                              cache_hit=cache_hit, session_id=self.session_id, model_name=model)
+
+    def _timed(self, function_name, args, call, model=None):
+        started = time.perf_counter()
+        try:
+            response = call()
+        except Exception as e:
+            self._record(function_name, args, None, e, time.perf_counter() - started, model=model)
+            raise
+        self._record(function_name, args, response, None, time.perf_counter() - started, model=model)
+        return response
+
+    def _observed(self, function_name, args, job, started, model=None):
+        return ObservedJob(
+            job,
+            lambda response, error, elapsed: self._record(function_name, args, response, error, elapsed, model=model),
+            started
+        )
+
+    def _streamed(self, function_name, args, open_stream, model=None):
+        started = time.perf_counter()
+        chunks = []
+        try:
+            for chunk in open_stream():
+                chunks.append(chunk)
+                yield chunk
+        except Exception as e:
+            self._record(function_name, args, "".join(chunks), e, time.perf_counter() - started, model=model)
+            raise
+        self._record(function_name, args, "".join(chunks), None, time.perf_counter() - started, model=model)
+
+    def model_for(self, function_name):
+        return self.backend.model_for(function_name)
+
+    def complete(self, function_name, args):
+        return self._timed(function_name, args, lambda: self.backend.complete(function_name, args))
+
+    def complete_model(self, function_name, args, model):
+        return self._timed(function_name, args, lambda: self.backend.complete_model(function_name, args, model), model)
+
+    def complete_with_correction(self, function_name, args, correction, model=None):
+        return self._timed(
+            function_name, args,
+            lambda: self.backend.complete_with_correction(function_name, args, correction, model=model), model
+        )
+
+    def submit(self, function_name, args):
+        started = time.perf_counter()
+        return self._observed(function_name, args, self.backend.submit(function_name, args), started)
+
+    def submit_model(self, function_name, args, model):
+        started = time.perf_counter()
+        return self._observed(function_name, args, self.backend.submit_model(function_name, args, model), started, model)
+
+    def stream(self, function_name, args):
+        return self._streamed(function_name, args, lambda: self.backend.stream(function_name, args))
+
+    def stream_model(self, function_name, args, model):
+        return self._streamed(function_name, args, lambda: self.backend.stream_model(function_name, args, model), model)
+
+    def on_cache_hit(self, function_name, args, response, model=None):
+        self._record(function_name, args, response, None, 0.0, cache_hit=True,
+                     model=model or self.model_for(function_name))
+
+
+# ---------------------------------------------------------------------------
+# Dashboard queries
+# ---------------------------------------------------------------------------
+
+def _window(hours):
+    return f"INTERACTION_TIMESTAMP >= DATEADD(hour, -{int(hours)}, CURRENT_TIMESTAMP()) AND WALL_TIME_MS IS NOT NULL"
+
+
+def step_latency_summary(session, hours=24):
+    """Per agent step: calls, latency percentiles (cache hits excluded), share of total time, tokens, cache and error rates"""
+    return session.sql(f"""
+        SELECT
+            AGENT_TYPE,
+            COUNT(*) as CALLS,
+            PERCENTILE_CONT(0.50) WITHIN GROUP (ORDER BY IFF(CACHE_HIT, NULL, WALL_TIME_MS)) as P50_MS,
+            PERCENTILE_CONT(0.95) WITHIN GROUP (ORDER BY IFF(CACHE_HIT, NULL, WALL_TIME_MS)) as P95_MS,
+            PERCENTILE_CONT(0.99) WITHIN GROUP (ORDER BY IFF(CACHE_HIT, NULL, WALL_TIME_MS)) as P99_MS,
+            SUM(WALL_TIME_MS) / 1000 as TOTAL_SECONDS,
+            RATIO_TO_REPORT(SUM(WALL_TIME_MS)) OVER () as SHARE_OF_TIME,
+            SUM(IFF(CACHE_HIT, 0, PROMPT_TOKENS + RESPONSE_TOKENS)) as CORTEX_TOKENS,
+            AVG(IFF(CACHE_HIT, 1, 0)) as CACHE_HIT_RATE,
+            AVG(IFF(PROCESSING_STATUS = 'ERROR', 1, 0)) as FAILURE_RATE
+        FROM {INTERACTIONS_TABLE}
+        WHERE {_window(hours)}
+        GROUP BY AGENT_TYPE
+        ORDER BY TOTAL_SECONDS DESC
+    """).to_pandas()
+
+
+def latency_over_time(session, hours=24):
+    """Hourly calls, p95 latency and failure rate per agent step"""
+    return session.sql(f"""
+        SELECT
+            DATE_TRUNC('hour', INTERACTION_TIMESTAMP) as HOUR,
+            AGENT_TYPE,
+            COUNT(*) as CALLS,
+            PERCENTILE_CONT(0.95) WITHIN GROUP (ORDER BY IFF(CACHE_HIT, NULL, WALL_TIME_MS)) as P95_MS,
+            AVG(IFF(PROCESSING_STATUS = 'ERROR', 1, 0)) as FAILURE_RATE
+        FROM {INTERACTIONS_TABLE}
+        WHERE {_window(hours)}
+        GROUP BY 1, 2
+        ORDER BY 1, 2
+    """).to_pandas()
+
+
+def slowest_calls(session, hours=24, limit=20):
+    """The slowest individual agent calls in the window"""
+    return session.sql(f"""
+        SELECT INTERACTION_TIMESTAMP, SESSION_ID, AGENT_TYPE, APPEAL_ROUND, MODEL_NAME,
+               WALL_TIME_MS, PROMPT_TOKENS, RESPONSE_TOKENS, PROCESSING_STATUS, ERROR_MESSAGE
+        FROM {INTERACTIONS_TABLE}
+        WHERE {_window(hours)} AND NOT CACHE_HIT
+        ORDER BY WALL_TIME_MS DESC
+        LIMIT {int(limit)}
+    """).to_pandas()
@@ -0,0 +1,308 @@
+"""
+Historical backtest of the Insurance Agent and AI Judge against marketplace remits.
+
+Samples historical claims from CLAIMS_HOSPITAL_CLAIMS__REMITS_DATA (claim, CPT and
+diagnosis detail plus the EOB outcome), rebuilds each one as a claim JSON, and
+runs INSURANCE_AGENT_WITH_POLICY and AI_JUDGE_DECISION over it set-based: every
+chunk is one Snowpark DataFrame write, so Snowflake fans the UDF calls out over
+the warehouse instead of Python calling them row by row. Several chunks run at
+once as async jobs.
+
+Predicted vs. actual denial outcomes go to BACKTEST_RESULTS and per-chunk
+throughput to BACKTEST_CHUNKS (tables in notebook 06). The sample and its chunk
+assignment are materialized in BACKTEST_CLAIMS when the run is created, so
+--resume picks up exactly the chunks that have not completed, and claims already
+scored are never sent to Cortex again.
+
+Usage:
+    python backtest.py --sample-size 20000 --chunk-size 500 --parallel-chunks 4
+    python backtest.py --resume BT_1A2B3C4D5E6F
+    python backtest.py --report BT_1A2B3C4D5E6F
+"""
+import argparse
+import logging
+import time
+import uuid
+
+from snowflake.snowpark.functions import col
+
+import claims_orchestration as orchestration
+from claims_orchestration import AGENT_SCHEMA
+
+REMITS_SCHEMA = "CLAIMS_HOSPITAL_CLAIMS__REMITS_DATA.ISTG"
+RUNS_TABLE = f"{AGENT_SCHEMA}.BACKTEST_RUNS"
+CLAIMS_TABLE = f"{AGENT_SCHEMA}.BACKTEST_CLAIMS"
+RESULTS_TABLE = f"{AGENT_SCHEMA}.BACKTEST_RESULTS"
+CHUNKS_TABLE = f"{AGENT_SCHEMA}.BACKTEST_CHUNKS"
+
+DEFAULT_SAMPLE_SIZE = 1000
+DEFAULT_CHUNK_SIZE = 250
+DEFAULT_PARALLEL_CHUNKS = 4
+POLL_SECONDS = 2.0
+
+logger = logging.getLogger("backtest")
+
+
+def create_run(session, sample_size=DEFAULT_SAMPLE_SIZE, chunk_size=DEFAULT_CHUNK_SIZE, seed=42,
+               balanced=False, payer_like=None):
+    """Sample historical claims into BACKTEST_CLAIMS with fixed chunk IDs; returns the run ID.
+
+    The sample is a stable hash order over CLAIMID (reproducible for a seed).
+    balanced takes half denied and half paid claims, since denials are the
+    minority outcome in the remits.
+    """
+    run_id = f"BT_{uuid.uuid4().hex[:12].upper()}"
+    sample_filter = (
+        f"QUALIFY ROW_NUMBER() OVER (PARTITION BY ACTUAL_DENIED ORDER BY SAMPLE_HASH) <= {int(sample_size) // 2}"
+        if balanced else ""
+    )
+    session.sql(f"""
+        INSERT INTO {RUNS_TABLE} (RUN_ID, SAMPLE_SIZE, CHUNK_SIZE, SEED, BALANCED, PAYER_FILTER, STATUS)
+        SELECT ?, ?, ?, ?, ?, ?, 'CREATED'
+    """, params=[run_id, int(sample_size), int(chunk_size), int(seed), bool(balanced), payer_like]).collect()
+    session.sql(f"""
+        INSERT INTO {CLAIMS_TABLE}
+            (RUN_ID, CHUNK_ID, CLAIMID, PROCEDURE_CODE, CLAIM_JSON, PAYER_NAME, BILLED_AMOUNT,
+             ACTUAL_DENIED, ACTUAL_DENIED_AMOUNT, ACTUAL_DENIAL_CATEGORY)
+        WITH outcomes AS (
+            SELECT
+                CLAIMID,
+                ANY_VALUE(EOBPAYERNAME) as PAYER_NAME,
+                SUM(BILLEDAMOUNT) as BILLED_AMOUNT,
+                SUM(DENIEDADJUSTMENT) as DENIED_AMOUNT,
+                MAX_BY(DENIALCATEGORYID, DENIEDADJUSTMENT) as DENIAL_CATEGORY,
+                SUM(DENIEDADJUSTMENT) > 0 as ACTUAL_DENIED,
+                HASH(CLAIMID, {int(seed)}) as SAMPLE_HASH
+            FROM {REMITS_SCHEMA}.EOBDETAIL
+            WHERE BILLEDAMOUNT > 0
+              AND (? IS NULL OR UPPER(EOBPAYERNAME) LIKE UPPER(?))
+            GROUP BY CLAIMID
+        ),
+        sampled AS (
+            SELECT * FROM outcomes
+            WHERE CLAIMID IN (SELECT CLAIMID FROM {REMITS_SCHEMA}.CPTDETAIL)
+            {sample_filter}
+            ORDER BY SAMPLE_HASH
+            LIMIT {int(sample_size)}
+        ),
+        procedures AS (
+            SELECT
+                c.CLAIMID,
+                MIN_BY(c.CPTCODE, c.SEQUENCE) as PRIMARY_CODE,
+                ARRAY_AGG(DISTINCT c.CPTCODE) as PROCEDURE_CODES
+            FROM {REMITS_SCHEMA}.CPTDETAIL c
+            JOIN sampled s ON s.CLAIMID = c.CLAIMID
+            WHERE c.CPTCODE IS NOT NULL
+            GROUP BY c.CLAIMID
+        ),
+        diagnoses AS (
+            SELECT d.CLAIMID, ARRAY_AGG(DISTINCT d.DIAGCODE) as DIAGNOSIS_CODES
+            FROM {REMITS_SCHEMA}.DIAGNOSISDETAIL d
+            JOIN sampled s ON s.CLAIMID = d.CLAIMID
+            WHERE d.DIAGCODE IS NOT NULL
+            GROUP BY d.CLAIMID
+        ),
+        charges AS (
+            SELECT
+                ch.CLAIMID,
+                SUM(ch.CHARGES) as TOTAL_CHARGES,
+                ANY_VALUE(ch.PLACEOFSERVICECODE) as PLACE_OF_SERVICE
+            FROM {REMITS_SCHEMA}.CLAIMCHARGEDETAIL ch
+            JOIN sampled s ON s.CLAIMID = ch.CLAIMID
+            GROUP BY ch.CLAIMID
+        )
+        SELECT
+            ?,
+            FLOOR((ROW_NUMBER() OVER (ORDER BY s.SAMPLE_HASH) - 1) / {int(chunk_size)}),
+            s.CLAIMID,
+            p.PRIMARY_CODE,
+            TO_JSON(OBJECT_CONSTRUCT(
+                'claim_header', OBJECT_CONSTRUCT('claim_id', s.CLAIMID::STRING, 'insurance_provider', s.PAYER_NAME),
+                'claim_details', OBJECT_CONSTRUCT(
+                    'procedure_codes', p.PROCEDURE_CODES,
+                    'diagnosis_codes', COALESCE(d.DIAGNOSIS_CODES, ARRAY_CONSTRUCT()),
+                    'place_of_service', ch.PLACE_OF_SERVICE
+                ),
+                'billing_info', OBJECT_CONSTRUCT('total_charges', COALESCE(ch.TOTAL_CHARGES, s.BILLED_AMOUNT))
+            )),
+            s.PAYER_NAME,
+            s.BILLED_AMOUNT,
+            s.ACTUAL_DENIED,
+            s.DENIED_AMOUNT,
+            s.DENIAL_CATEGORY
+        FROM sampled s
+        JOIN procedures p ON p.CLAIMID = s.CLAIMID
+        LEFT JOIN diagnoses d ON d.CLAIMID = s.CLAIMID
+        LEFT JOIN charges ch ON ch.CLAIMID = s.CLAIMID
+    """, params=[payer_like, payer_like, run_id]).collect()
+    return run_id
+
+
+def pending_chunks(session, run_id):
+    """[(chunk_id, claims)] not yet marked COMPLETED in BACKTEST_CHUNKS"""
+    rows = session.sql(f"""
+        SELECT c.CHUNK_ID, COUNT(*) as CLAIMS
+        FROM {CLAIMS_TABLE} c
+        WHERE c.RUN_ID = ?
+          AND c.CHUNK_ID NOT IN (
+              SELECT CHUNK_ID FROM {CHUNKS_TABLE} WHERE RUN_ID = ? AND STATUS = 'COMPLETED'
+          )
+        GROUP BY c.CHUNK_ID
+        ORDER BY c.CHUNK_ID
+    """, params=[run_id, run_id]).collect()
+    return [(row['CHUNK_ID'], row['CLAIMS']) for row in rows]
+
+
+def chunk_frame(session, run_id, chunk_id):
+    """Set-based Insurance Agent + Judge scoring for one chunk's unscored claims"""
+    claims = session.table(CLAIMS_TABLE).filter((col("RUN_ID") == run_id) & (col("CHUNK_ID") == int(chunk_id)))
+    scored = session.table(RESULTS_TABLE).filter(col("RUN_ID") == run_id).select("CLAIMID")
+    todo = claims.join(scored, on="CLAIMID", how="leftanti")
+    rebutted = todo.select_expr(
+        "*",
+        f"{AGENT_SCHEMA}.INSURANCE_AGENT_WITH_POLICY(CLAIM_JSON, PROCEDURE_CODE) AS INSURANCE_REBUTTAL_TEXT",
+    )
+    judged = rebutted.select_expr(
+        "*",
+        f"{AGENT_SCHEMA}.AI_JUDGE_DECISION(CLAIM_JSON, INSURANCE_REBUTTAL_TEXT, CLAIMID::STRING, PROCEDURE_CODE) AS JUDGE_DECISION_TEXT",
+    )
+    return judged.select_expr(
+        "RUN_ID", "CHUNK_ID", "CLAIMID", "PROCEDURE_CODE", "PAYER_NAME", "BILLED_AMOUNT",
+        "ACTUAL_DENIED", "ACTUAL_DENIED_AMOUNT", "ACTUAL_DENIAL_CATEGORY",
+        "COALESCE(TRY_PARSE_JSON(INSURANCE_REBUTTAL_TEXT), TO_VARIANT(INSURANCE_REBUTTAL_TEXT)) AS INSURANCE_REBUTTAL",
+        "TRY_PARSE_JSON(INSURANCE_REBUTTAL_TEXT):strength_score::FLOAT AS STRENGTH_SCORE",
+        "COALESCE(TRY_PARSE_JSON(JUDGE_DECISION_TEXT), TO_VARIANT(JUDGE_DECISION_TEXT)) AS JUDGE_DECISION",
+        "COALESCE(UPPER(TRY_PARSE_JSON(JUDGE_DECISION_TEXT):final_decision::STRING), 'UNPARSEABLE') AS PREDICTED_DECISION",
+        "UPPER(TRY_PARSE_JSON(JUDGE_DECISION_TEXT):final_decision::STRING) = 'DENIED' AS PREDICTED_DENIED",
+    )
+
+
+def record_chunk(session, run_id, chunk_id, claims, elapsed, error=None):
+    # Bound, not inlined: exception text often carries backslashes (paths, escaped JSON)
+    session.sql(f"""
+        INSERT INTO {CHUNKS_TABLE} (RUN_ID, CHUNK_ID, CLAIMS, STATUS, ELAPSED_SECONDS, CLAIMS_PER_SECOND, LAST_ERROR)
+        SELECT ?, ?, ?, ?, ?, ?, ?
+    """, params=[
+        run_id, int(chunk_id), int(claims), 'FAILED' if error else 'COMPLETED',
+        round(elapsed, 3), round(claims / elapsed, 3) if elapsed and not error else 0.0,
+        str(error)[:4000] if error else None,
+    ]).collect()
+
+
+def set_run_status(session, run_id, status):
+    session.sql(f"""
+        UPDATE {RUNS_TABLE} SET STATUS = ?, LAST_UPDATED = CURRENT_TIMESTAMP()
+        WHERE RUN_ID = ?
+    """, params=[status, run_id]).collect()
+
+
+def run_backtest(session, run_id, parallel_chunks=DEFAULT_PARALLEL_CHUNKS, max_chunks=None):
+    """Score the run's pending chunks, up to parallel_chunks async writes at a time.
+
+    A failed chunk is logged as FAILED and left for the next --resume; the run is
+    marked COMPLETED only when every chunk has completed.
+    """
+    chunks = pending_chunks(session, run_id)
+    if max_chunks is not None:
+        chunks = chunks[:max_chunks]
+    set_run_status(session, run_id, 'RUNNING')
+    totals = {'chunks': 0, 'failed_chunks': 0, 'claims': 0}
+    started = time.perf_counter()
+    in_flight = {}
+
+    while chunks or in_flight:
+        while chunks and len(in_flight) < parallel_chunks:
+            chunk_id, claims = chunks.pop(0)
+            job = chunk_frame(session, run_id, chunk_id).write.save_as_table(
+                RESULTS_TABLE, mode="append", column_order="name", block=False
+            )
+            in_flight[chunk_id] = (job, claims, time.perf_counter())
+
+        time.sleep(POLL_SECONDS)
+        for chunk_id in [c for c, (job, _, _) in in_flight.items() if job.is_done()]:
+            job, claims, chunk_started = in_flight.pop(chunk_id)
+            elapsed = time.perf_counter() - chunk_started
+            try:
+                job.result()
+                error = None
+            except Exception as e:
+                error = e
+            record_chunk(session, run_id, chunk_id, claims, elapsed, error)
+            if error:
+                totals['failed_chunks'] += 1
+                logger.warning("Chunk %s failed after %.1fs: %s", chunk_id, elapsed, error)
+            else:
+                totals['chunks'] += 1
+                totals['claims'] += claims
+                logger.info("Chunk %s: %d claims in %.1fs (%.2f claims/sec)", chunk_id, claims, elapsed, claims / elapsed)
+
+    if not pending_chunks(session, run_id):
+        set_run_status(session, run_id, 'COMPLETED')
+    totals['elapsed_seconds'] = time.perf_counter() - started
+    totals['claims_per_second'] = totals['claims'] / totals['elapsed_seconds'] if totals['elapsed_seconds'] else 0.0
+    return totals
+
+
+def score_run(session, run_id):
+    """Confusion matrix and precision/recall of predicted vs. actual denials"""
+    row = session.sql(f"""
+        SELECT
+            COUNT(*) as SCORED_CLAIMS,
+            COUNT_IF(PREDICTED_DENIED AND ACTUAL_DENIED) as TRUE_DENIALS,
+            COUNT_IF(PREDICTED_DENIED AND NOT ACTUAL_DENIED) as FALSE_DENIALS,
+            COUNT_IF(NOT PREDICTED_DENIED AND ACTUAL_DENIED) as MISSED_DENIALS,
+            COUNT_IF(NOT PREDICTED_DENIED AND NOT ACTUAL_DENIED) as TRUE_APPROVALS,
+            COUNT_IF(PREDICTED_DENIED IS NULL) as UNPARSEABLE,
+            COUNT_IF(ACTUAL_DENIED) / NULLIF(COUNT(*), 0) as ACTUAL_DENIAL_RATE,
+            COUNT_IF(PREDICTED_DENIED) / NULLIF(COUNT_IF(PREDICTED_DENIED IS NOT NULL), 0) as PREDICTED_DENIAL_RATE,
+            TRUE_DENIALS / NULLIF(TRUE_DENIALS + FALSE_DENIALS, 0) as PRECISION,
+            TRUE_DENIALS / NULLIF(TRUE_DENIALS + MISSED_DENIALS, 0) as RECALL,
+            (TRUE_DENIALS + TRUE_APPROVALS) / NULLIF(COUNT_IF(PREDICTED_DENIED IS NOT NULL), 0) as ACCURACY
+        FROM {RESULTS_TABLE}
+        WHERE RUN_ID = ?
+    """, params=[run_id]).collect()[0]
+    return row.as_dict()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backtest agent denial predictions against marketplace remits")
+    parser.add_argument("--config-file", default="config.toml")
+    parser.add_argument("--connection", default="healthcare_claims_demo")
+    parser.add_argument("--sample-size", type=int, default=DEFAULT_SAMPLE_SIZE,
+                        help="Historical claims to sample for a new run")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="Claims scored per set-based write (the unit of resume and throughput logging)")
+    parser.add_argument("--parallel-chunks", type=int, default=DEFAULT_PARALLEL_CHUNKS,
+                        help="Chunks scored at the same time as async jobs")
+    parser.add_argument("--seed", type=int, default=42, help="Sampling seed (same seed, same sample)")
+    parser.add_argument("--balanced", action="store_true",
+                        help="Sample half denied and half paid claims")
+    parser.add_argument("--payer-like", default=None,
+                        help="Only sample claims whose EOB payer name matches this LIKE pattern, e.g. %%CIGNA%%")
+    parser.add_argument("--max-chunks", type=int, default=None,
+                        help="Stop after this many chunks (resume later with --resume)")
+    parser.add_argument("--resume", default=None, metavar="RUN_ID",
+                        help="Continue a partially finished run instead of sampling a new one")
+    parser.add_argument("--report", default=None, metavar="RUN_ID",
+                        help="Only print the prediction scores of a run")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    session = orchestration.create_session(args.config_file, args.connection)
+    try:
+        if args.report:
+            logger.info("Backtest %s: %s", args.report, score_run(session, args.report))
+            return
+        run_id = args.resume or create_run(
+            session, args.sample_size, args.chunk_size, args.seed, args.balanced, args.payer_like
+        )
+        logger.info("Backtest run %s", run_id)
+        totals = run_backtest(session, run_id, args.parallel_chunks, args.max_chunks)
+        logger.info("Run %s finished: %s", run_id, totals)
+        logger.info("Scores: %s", score_run(session, run_id))
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    main()
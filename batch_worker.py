@@ -0,0 +1,335 @@
+"""
+Headless bulk claims worker.
+
+Pulls pending claim requests from CLAIMS_DEMO.PUBLIC.CLAIM_REQUEST_QUEUE (same shape
+as BUILDER_AGENT_TEST_INPUT, see notebook 06), runs the full Builder -> Insurance ->
+Judge -> Appeals orchestration for many claims at once with bounded parallelism,
+and bulk-writes results to OPTIMIZATION_SESSIONS.
+
+Usage:
+    python batch_worker.py --concurrency 16 --batch-size 200
+
+Throughput scales with warehouse size: each in-flight claim keeps one Cortex call
+running (up to three during appeals), so raise --concurrency together with the
+warehouse size / MAX_CONCURRENCY_LEVEL.
+"""
+import argparse
+import json
+import logging
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from snowflake.snowpark.types import FloatType, IntegerType, StringType, StructField, StructType
+
+import claims_orchestration as orchestration
+from agent_telemetry import AgentTelemetry, InstrumentedBackend
+from completion_backends import CortexBackend, StubBackend
+from llm_cache import LLMResponseCache
+from model_router import ModelRouter, RoutedBackend
+from policy_rules import PolicyRuleEngine
+
+QUEUE_TABLE = "CLAIMS_DEMO.PUBLIC.CLAIM_REQUEST_QUEUE"
+RESULTS_TABLE = "CLAIMS_DEMO.PUBLIC.OPTIMIZATION_SESSIONS"
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_MAX_ATTEMPTS = 3
+# IN_PROGRESS rows untouched this long belong to a worker that died; keep it above a batch's runtime
+DEFAULT_STALE_AFTER_SECONDS = 3600
+
+RESULT_STAGING_SCHEMA = StructType([
+    StructField("SESSION_ID", StringType()),
+    StructField("PATIENT_ID", StringType()),
+    StructField("PROCEDURE_CODE", StringType()),
+    StructField("CLINICAL_NOTES", StringType()),
+    StructField("ITERATION_NUMBER", IntegerType()),
+    StructField("BUILDER_CLAIM_TEXT", StringType()),
+    StructField("INSURANCE_REBUTTAL_TEXT", StringType()),
+    StructField("STRENGTH_SCORE", FloatType()),
+    StructField("OPTIMIZATION_STATUS", StringType()),
+    StructField("FINAL_RECOMMENDATION", StringType()),
+    StructField("JUDGE_DECISION_TEXT", StringType()),
+    StructField("APPEAL_HISTORY_TEXT", StringType()),
+    StructField("APPEAL_STOP_REASON", StringType()),
+])
+
+QUEUE_UPDATE_SCHEMA = StructType([
+    StructField("SESSION_ID", StringType()),
+    StructField("STATUS", StringType()),
+    StructField("LAST_ERROR", StringType()),
+])
+
+logger = logging.getLogger("batch_worker")
+
+
+def claim_pending_requests(session, worker_id, batch_size, max_attempts=DEFAULT_MAX_ATTEMPTS,
+                           stale_after_seconds=DEFAULT_STALE_AFTER_SECONDS):
+    """Mark up to batch_size pending requests as owned by this worker and return them.
+
+    Requests left IN_PROGRESS for stale_after_seconds by a worker that crashed are
+    claimed again, or marked FAILED once they have used up max_attempts.
+    """
+    stale = f"STATUS = 'IN_PROGRESS' AND LAST_UPDATED < DATEADD(second, -{int(stale_after_seconds)}, CURRENT_TIMESTAMP())"
+    session.sql(f"""
+        UPDATE {QUEUE_TABLE}
+        SET STATUS = 'FAILED',
+            LAST_ERROR = 'Worker ' || COALESCE(WORKER_ID, '') || ' stopped before finishing the request',
+            LAST_UPDATED = CURRENT_TIMESTAMP()
+        WHERE {stale} AND ATTEMPTS >= ?
+    """, params=[int(max_attempts)]).collect()
+    session.sql(f"""
+        UPDATE {QUEUE_TABLE}
+        SET STATUS = 'IN_PROGRESS',
+            WORKER_ID = ?,
+            ATTEMPTS = ATTEMPTS + 1,
+            LAST_UPDATED = CURRENT_TIMESTAMP()
+        WHERE SESSION_ID IN (
+            SELECT SESSION_ID FROM {QUEUE_TABLE}
+            WHERE STATUS = 'PENDING' OR ({stale})
+            ORDER BY REQUEST_TIMESTAMP
+            LIMIT {int(batch_size)}
+        )
+    """, params=[worker_id]).collect()
+    rows = session.sql(f"""
+        SELECT SESSION_ID, PATIENT_ID, PROCEDURE_REQUESTED, CLINICAL_NOTES, ATTEMPTS
+        FROM {QUEUE_TABLE}
+        WHERE STATUS = 'IN_PROGRESS' AND WORKER_ID = ?
+        ORDER BY REQUEST_TIMESTAMP
+    """, params=[worker_id]).collect()
+    return [row.as_dict() for row in rows]
+
+
+def process_request(backend, request, concurrent_appeals, retries, cache=None, telemetry=None,
+                    compact_context=True, adaptive_appeals=True, rule_engine=None, router=None):
+    """Run one claim request in isolation; failures are returned, never raised"""
+    started = time.perf_counter()
+    if telemetry is not None:
+        backend = InstrumentedBackend(backend, telemetry, session_id=request['SESSION_ID'])
+    if router is not None:
+        backend = RoutedBackend(backend, router)
+    try:
+        result = orchestration.run_orchestration(
+            backend,
+            request['PATIENT_ID'],
+            request['PROCEDURE_REQUESTED'],
+            request['CLINICAL_NOTES'],
+            concurrent_appeals=concurrent_appeals,
+            retries=retries,
+            cache=cache,
+            compact_context=compact_context,
+            adaptive_appeals=adaptive_appeals,
+            rule_engine=rule_engine,
+        )
+        return {'request': request, 'result': result, 'error': None,
+                'elapsed': time.perf_counter() - started}
+    except Exception as e:
+        return {'request': request, 'result': None, 'error': str(e),
+                'elapsed': time.perf_counter() - started}
+
+
+def write_results(session, outcomes):
+    """Bulk-append completed claims to OPTIMIZATION_SESSIONS"""
+    rows = []
+    for outcome in outcomes:
+        if outcome['error']:
+            continue
+        request, result = outcome['request'], outcome['result']
+        rows.append([
+            request['SESSION_ID'],
+            request['PATIENT_ID'],
+            request['PROCEDURE_REQUESTED'],
+            request['CLINICAL_NOTES'],
+            1,
+            result['generated_claim'],
+            result['insurance_rebuttal'],
+            orchestration.parse_strength_score(result['insurance_rebuttal']),
+            'COMPLETED',
+            result['final_decision'],
+            result['judge_decision'],
+            json.dumps(result['appeal_history']),
+            result['appeal_stop_reason'],
+        ])
+    if not rows:
+        return 0
+
+    staged = session.create_dataframe(rows, schema=RESULT_STAGING_SCHEMA)
+    staged.select_expr(
+        "SESSION_ID", "PATIENT_ID", "PROCEDURE_CODE", "CLINICAL_NOTES", "ITERATION_NUMBER",
+        "COALESCE(TRY_PARSE_JSON(BUILDER_CLAIM_TEXT), TO_VARIANT(BUILDER_CLAIM_TEXT)) AS BUILDER_CLAIM",
+        "COALESCE(TRY_PARSE_JSON(INSURANCE_REBUTTAL_TEXT), TO_VARIANT(INSURANCE_REBUTTAL_TEXT)) AS INSURANCE_REBUTTAL",
+        "STRENGTH_SCORE", "OPTIMIZATION_STATUS", "FINAL_RECOMMENDATION",
+        "COALESCE(TRY_PARSE_JSON(JUDGE_DECISION_TEXT), TO_VARIANT(JUDGE_DECISION_TEXT)) AS JUDGE_DECISION",
+        "PARSE_JSON(APPEAL_HISTORY_TEXT) AS APPEAL_HISTORY", "APPEAL_STOP_REASON",
+    ).write.save_as_table(RESULTS_TABLE, mode="append", column_order="name")
+    return len(rows)
+
+
+def update_queue(session, outcomes, max_attempts):
+    """Bulk-update queue status: done, back to pending for retry, or failed"""
+    rows = []
+    for outcome in outcomes:
+        request = outcome['request']
+        if not outcome['error']:
+            status = 'COMPLETED'
+        elif request['ATTEMPTS'] < max_attempts:
+            status = 'PENDING'
+        else:
+            status = 'FAILED'
+        rows.append([request['SESSION_ID'], status, (outcome['error'] or '')[:4000] or None])
+    if not rows:
+        return
+
+    session.create_dataframe(rows, schema=QUEUE_UPDATE_SCHEMA) \
+        .write.save_as_table("QUEUE_STATUS_UPDATES", mode="overwrite", table_type="temporary")
+    session.sql(f"""
+        MERGE INTO {QUEUE_TABLE} q
+        USING QUEUE_STATUS_UPDATES u ON q.SESSION_ID = u.SESSION_ID
+        WHEN MATCHED THEN UPDATE SET
+            STATUS = u.STATUS,
+            LAST_ERROR = u.LAST_ERROR,
+            WORKER_ID = IFF(u.STATUS = 'PENDING', NULL, q.WORKER_ID),
+            LAST_UPDATED = CURRENT_TIMESTAMP()
+    """).collect()
+
+
+def run_batch(session, concurrency=DEFAULT_CONCURRENCY, batch_size=DEFAULT_BATCH_SIZE,
+              max_claims=None, max_attempts=DEFAULT_MAX_ATTEMPTS,
+              concurrent_appeals=True, retries=orchestration.DEFAULT_RETRIES, cache=None, backend=None,
+              telemetry=None, compact_context=True, adaptive_appeals=True, rule_engine=None, router=None,
+              stale_after_seconds=DEFAULT_STALE_AFTER_SECONDS):
+    """Drain the queue batch by batch until it is empty or max_claims is reached.
+
+    Agent steps run on backend (default: Cortex through this session); queue reads
+    and result writes always use the session. With telemetry, every agent call is
+    logged to AGENT_INTERACTIONS under the claim's SESSION_ID. With a rule_engine,
+    clear-cut claims are decided by the policy pre-screen without agent calls.
+    With a router (model_router.py), each agent step runs on its routed model.
+    """
+    backend = backend or CortexBackend(session)
+    worker_id = f"WORKER_{uuid.uuid4().hex[:12]}"
+    totals = {'processed': 0, 'completed': 0, 'failed': 0, 'context_tokens_saved': 0, 'pre_screened': 0}
+    started = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        while max_claims is None or totals['processed'] < max_claims:
+            limit = batch_size if max_claims is None else min(batch_size, max_claims - totals['processed'])
+            requests = claim_pending_requests(session, worker_id, limit, max_attempts, stale_after_seconds)
+            if not requests:
+                break
+
+            futures = [
+                pool.submit(process_request, backend, request, concurrent_appeals, retries, cache, telemetry,
+                            compact_context, adaptive_appeals, rule_engine, router)
+                for request in requests
+            ]
+            outcomes = []
+            for future in as_completed(futures):
+                outcome = future.result()
+                outcomes.append(outcome)
+                if outcome['result']:
+                    totals['context_tokens_saved'] += sum(
+                        r['saved_tokens'] for r in outcome['result']['context_savings']
+                    )
+                    pre_screen = outcome['result']['pre_screen']
+                    if pre_screen and pre_screen['outcome'] != 'REVIEW':
+                        totals['pre_screened'] += 1
+                if outcome['error']:
+                    logger.warning("Claim %s failed after %.1fs: %s",
+                                   outcome['request']['SESSION_ID'], outcome['elapsed'], outcome['error'])
+
+            written = write_results(session, outcomes)
+            update_queue(session, outcomes, max_attempts)
+
+            totals['processed'] += len(outcomes)
+            totals['completed'] += written
+            totals['failed'] += len(outcomes) - written
+            elapsed = time.perf_counter() - started
+            logger.info("Processed %d claims (%d completed, %d failed) - %.2f claims/sec",
+                        totals['processed'], totals['completed'], totals['failed'],
+                        totals['processed'] / elapsed if elapsed else 0.0)
+            if cache is not None:
+                logger.info("Response cache: %s", cache.stats())
+            if telemetry is not None:
+                logger.info("Telemetry: %s", telemetry.stats())
+
+    totals['elapsed_seconds'] = time.perf_counter() - started
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk claims orchestration worker")
+    parser.add_argument("--config-file", default="config.toml")
+    parser.add_argument("--connection", default="healthcare_claims_demo")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help="Maximum claims orchestrated at the same time")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Claims pulled from the queue and written back per batch")
+    parser.add_argument("--max-claims", type=int, default=None,
+                        help="Stop after this many claims (default: drain the queue)")
+    parser.add_argument("--max-attempts", type=int, default=DEFAULT_MAX_ATTEMPTS,
+                        help="Times a failing claim is re-queued before it is marked FAILED")
+    parser.add_argument("--stale-after", type=int, default=DEFAULT_STALE_AFTER_SECONDS,
+                        help="Seconds after which requests left IN_PROGRESS by a crashed worker are picked up again")
+    parser.add_argument("--retries", type=int, default=orchestration.DEFAULT_RETRIES,
+                        help="Retries with exponential backoff for each failed Cortex call")
+    parser.add_argument("--sequential-appeals", action="store_true",
+                        help="Run appeal rounds one call at a time instead of as async jobs")
+    parser.add_argument("--all-appeal-rounds", action="store_true",
+                        help="Always run every appeal round instead of stopping once the dispute converges")
+    parser.add_argument("--full-context", action="store_true",
+                        help="Send appeal rounds the full claim, rebuttal and judge decision instead of a compact digest")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Bypass LLM_RESPONSE_CACHE and call Cortex for every agent step")
+    parser.add_argument("--stub-backend", action="store_true",
+                        help="Answer agent steps from the offline stub (canned JSON) to load-test the queue without Cortex")
+    parser.add_argument("--no-telemetry", action="store_true",
+                        help="Do not log per-call timing and sizes to AGENT_INTERACTIONS")
+    parser.add_argument("--no-prescreen", action="store_true",
+                        help="Send every claim to the Insurance Agent and Judge instead of deciding clear-cut claims with the policy rules")
+    parser.add_argument("--no-model-routing", action="store_true",
+                        help="Run every agent step on its SQL function's model instead of the registry's per-step routes")
+    parser.add_argument("--auto-approve", action="store_true",
+                        help="Also approve claims the policy pre-screen finds no issues with, without calling the agents")
+    parser.add_argument("--cache-ttl", type=int, default=None,
+                        help="Seconds a cached agent response stays valid (default: 24h)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    session = orchestration.create_session(args.config_file, args.connection)
+    cache = None
+    # Stub responses must never land in the shared response cache
+    if not args.no_cache and not args.stub_backend:
+        cache = LLMResponseCache(session) if args.cache_ttl is None else LLMResponseCache(session, ttl_seconds=args.cache_ttl)
+    telemetry = None if args.no_telemetry or args.stub_backend else AgentTelemetry(session)
+    rule_engine = None if args.no_prescreen else PolicyRuleEngine.load(session, auto_approve=args.auto_approve)
+    router = None if args.no_model_routing else ModelRouter.load(session)
+    try:
+        totals = run_batch(
+            session,
+            concurrency=args.concurrency,
+            batch_size=args.batch_size,
+            max_claims=args.max_claims,
+            max_attempts=args.max_attempts,
+            stale_after_seconds=args.stale_after,
+            concurrent_appeals=not args.sequential_appeals,
+            retries=args.retries,
+            cache=cache,
+            backend=StubBackend() if args.stub_backend else None,
+            telemetry=telemetry,
+            compact_context=not args.full_context,
+            adaptive_appeals=not args.all_appeal_rounds,
+            rule_engine=rule_engine,
+            router=router,
+        )
+        logger.info("Batch finished: %s", totals)
+        if router is not None:
+            logger.info("Model routing: %s", router.summary())
+    finally:
+        if telemetry is not None:
+            telemetry.close()
+        session.close()
+
+
+if __name__ == "__main__":
+    main()
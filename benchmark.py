@@ -0,0 +1,252 @@
+"""
+End-to-end latency benchmark for the claims orchestration loop.
+
+Runs the full Builder -> Insurance -> Judge -> Appeals flow for a number of
+synthetic claim requests at several concurrency levels and reports, per level:
+
+  - p50 / p95 latency of every agent step (as seen by the orchestration, i.e.
+    including async-job polling) and of the whole claim
+  - agent calls per claim and estimated prompt tokens per claim
+  - claims/sec
+
+By default it runs against the offline StubBackend (completion_backends.py), so
+the numbers measure the orchestration itself: how well calls overlap, how many
+are made, and how much polling overhead is added on top of the model latency.
+Pass --backend cortex to benchmark against a live account instead.
+
+Usage:
+    python benchmark.py --claims 20 --concurrency 1 4 8 --output baseline.json
+    python benchmark.py --claims 20 --concurrency 1 4 8 --baseline baseline.json
+
+With --baseline the run exits non-zero if claims/sec dropped, or p95 claim
+latency, calls per claim or prompt tokens per claim rose, by more than
+--tolerance (default 20%).
+"""
+import argparse
+import json
+import math
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import claims_orchestration as orchestration
+from agent_prompts import build_prompt, estimate_tokens
+from completion_backends import CompletionBackend, ObservedJob, StubBackend
+
+DEFAULT_CLAIMS = 16
+DEFAULT_CONCURRENCY_LEVELS = [1, 4, 8]
+DEFAULT_STUB_LATENCY_SECONDS = 0.2
+DEFAULT_TOLERANCE = 0.2
+
+SAMPLE_REQUESTS = [
+    ("PAT_001", "85025", "Type 2 diabetes monitoring, fatigue, suspected anemia"),
+    ("PAT_002", "80053", "Hypertension follow-up, metabolic panel on ACE inhibitor"),
+    ("PAT_003", "93000", "Chest discomfort on exertion, baseline ECG"),
+    ("PAT_004", "71046", "Persistent cough for three weeks, rule out pneumonia"),
+]
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers (None if empty)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class LatencyRecorder:
+    """Thread-safe collection of per-step latencies and call counts"""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.prompt_tokens = 0
+        self._lock = threading.Lock()
+
+    def record(self, step, seconds):
+        with self._lock:
+            self.samples[step].append(seconds)
+
+    def add_prompt(self, function_name, args):
+        tokens = estimate_tokens(len(build_prompt(function_name, args)))
+        with self._lock:
+            self.prompt_tokens += tokens
+
+    def calls(self):
+        with self._lock:
+            return sum(len(values) for values in self.samples.values())
+
+    def summary(self):
+        with self._lock:
+            return {
+                step: {
+                    'calls': len(values),
+                    'p50_ms': percentile(values, 50) * 1000,
+                    'p95_ms': percentile(values, 95) * 1000,
+                }
+                for step, values in sorted(self.samples.items())
+            }
+
+
+class TimedBackend(CompletionBackend):
+    """CompletionBackend wrapper that records the latency of every agent call"""
+
+    def __init__(self, backend, recorder):
+        self.backend = backend
+        self.recorder = recorder
+        self.name = getattr(backend, "name", "backend")
+        self.session = getattr(backend, "session", None)
+
+    def complete(self, function_name, args):
+        self.recorder.add_prompt(function_name, args)
+        started = time.perf_counter()
+        try:
+            return self.backend.complete(function_name, args)
+        finally:
+            self.recorder.record(function_name, time.perf_counter() - started)
+
+    def complete_with_correction(self, function_name, args, correction, model=None):
+        started = time.perf_counter()
+        try:
+            return self.backend.complete_with_correction(function_name, args, correction, model=model)
+        finally:
+            self.recorder.record(function_name, time.perf_counter() - started)
+
+    def submit(self, function_name, args):
+        self.recorder.add_prompt(function_name, args)
+        started = time.perf_counter()
+        return ObservedJob(
+            self.backend.submit(function_name, args),
+            lambda response, error, elapsed: self.recorder.record(function_name, elapsed),
+            started
+        )
+
+    def stream(self, function_name, args):
+        return self.backend.stream(function_name, args)
+
+
+def run_level(backend, concurrency, claims, concurrent_appeals=True, compact_context=True, adaptive_appeals=True):
+    """Orchestrate `claims` requests with at most `concurrency` in flight; return the level's metrics"""
+    recorder = LatencyRecorder()
+    timed = TimedBackend(backend, recorder)
+    requests = [SAMPLE_REQUESTS[i % len(SAMPLE_REQUESTS)] for i in range(claims)]
+
+    def run_one(request):
+        started = time.perf_counter()
+        orchestration.run_orchestration(timed, *request, concurrent_appeals=concurrent_appeals, retries=0,
+                                        compact_context=compact_context, adaptive_appeals=adaptive_appeals)
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        claim_latencies = list(pool.map(run_one, requests))
+    elapsed = time.perf_counter() - started
+
+    return {
+        'concurrency': concurrency,
+        'claims': claims,
+        'elapsed_seconds': elapsed,
+        'claims_per_sec': claims / elapsed if elapsed else 0.0,
+        'calls_per_claim': recorder.calls() / claims if claims else 0.0,
+        'prompt_tokens_per_claim': recorder.prompt_tokens / claims if claims else 0.0,
+        'claim_p50_ms': percentile(claim_latencies, 50) * 1000,
+        'claim_p95_ms': percentile(claim_latencies, 95) * 1000,
+        'steps': recorder.summary(),
+    }
+
+
+def print_level(level):
+    print(f"\nconcurrency={level['concurrency']}  claims={level['claims']}  "
+          f"{level['claims_per_sec']:.2f} claims/sec  {level['calls_per_claim']:.1f} calls/claim  "
+          f"~{level['prompt_tokens_per_claim']:.0f} prompt tokens/claim  "
+          f"claim p50 {level['claim_p50_ms']:.0f} ms  p95 {level['claim_p95_ms']:.0f} ms")
+    print(f"  {'step':<28} {'calls':>6} {'p50 ms':>9} {'p95 ms':>9}")
+    for step, stats in level['steps'].items():
+        print(f"  {step:<28} {stats['calls']:>6} {stats['p50_ms']:>9.0f} {stats['p95_ms']:>9.0f}")
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """Return a list of regression messages (empty when within tolerance)"""
+    previous = {level['concurrency']: level for level in baseline['levels']}
+    regressions = []
+    for level in results['levels']:
+        before = previous.get(level['concurrency'])
+        if before is None:
+            continue
+        label = f"concurrency={level['concurrency']}"
+        if level['claims_per_sec'] < before['claims_per_sec'] * (1 - tolerance):
+            regressions.append(f"{label}: claims/sec {before['claims_per_sec']:.2f} -> {level['claims_per_sec']:.2f}")
+        if level['claim_p95_ms'] > before['claim_p95_ms'] * (1 + tolerance):
+            regressions.append(f"{label}: claim p95 {before['claim_p95_ms']:.0f} ms -> {level['claim_p95_ms']:.0f} ms")
+        if level['calls_per_claim'] > before['calls_per_claim'] * (1 + tolerance):
+            regressions.append(f"{label}: calls/claim {before['calls_per_claim']:.1f} -> {level['calls_per_claim']:.1f}")
+        before_tokens = before.get('prompt_tokens_per_claim')
+        if before_tokens and level['prompt_tokens_per_claim'] > before_tokens * (1 + tolerance):
+            regressions.append(f"{label}: prompt tokens/claim {before_tokens:.0f} -> {level['prompt_tokens_per_claim']:.0f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Claims orchestration latency benchmark")
+    parser.add_argument("--backend", choices=["stub", "cortex"], default="stub")
+    parser.add_argument("--config-file", default="config.toml")
+    parser.add_argument("--connection", default="healthcare_claims_demo")
+    parser.add_argument("--claims", type=int, default=DEFAULT_CLAIMS,
+                        help="Claims orchestrated at each concurrency level")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=DEFAULT_CONCURRENCY_LEVELS,
+                        help="Concurrency levels to measure")
+    parser.add_argument("--stub-latency", type=float, default=DEFAULT_STUB_LATENCY_SECONDS,
+                        help="Seconds each stub agent call takes")
+    parser.add_argument("--stub-jitter", type=float, default=0.1,
+                        help="Random +/- fraction applied to stub latency (seeded, reproducible)")
+    parser.add_argument("--sequential-appeals", action="store_true",
+                        help="Run appeal rounds one call at a time instead of as async jobs")
+    parser.add_argument("--all-appeal-rounds", action="store_true",
+                        help="Always run every appeal round instead of stopping once the dispute converges")
+    parser.add_argument("--full-context", action="store_true",
+                        help="Send appeal rounds the full agent outputs instead of the compact digest")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--baseline", help="Compare against a previous --output file and fail on regression")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Allowed relative slowdown before a metric counts as a regression")
+    args = parser.parse_args()
+
+    session = None
+    if args.backend == "cortex":
+        session = orchestration.create_session(args.config_file, args.connection)
+        backend = orchestration.as_backend(session)
+    else:
+        backend = StubBackend(latency_seconds=args.stub_latency, jitter=args.stub_jitter)
+
+    results = {'backend': args.backend, 'sequential_appeals': args.sequential_appeals,
+               'compact_context': not args.full_context, 'adaptive_appeals': not args.all_appeal_rounds,
+               'levels': []}
+    try:
+        for concurrency in args.concurrency:
+            level = run_level(backend, concurrency, args.claims, concurrent_appeals=not args.sequential_appeals,
+                              compact_context=not args.full_context, adaptive_appeals=not args.all_appeal_rounds)
+            results['levels'].append(level)
+            print_level(level)
+    finally:
+        if session is not None:
+            session.close()
+
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as fh:
+            regressions = compare_to_baseline(results, json.load(fh), args.tolerance)
+        if regressions:
+            print("\nPerformance regressions:")
+            for message in regressions:
+                print(f"  {message}")
+            sys.exit(1)
+        print("\nNo regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,538 @@
+"""
+HTTP API for the claims agents, for programmatic (EHR) integrations.
+
+Serves the two endpoints documented in BUILDER_AGENT_API (notebook 02) plus
+insurance analysis, judgment and the full orchestration:
+
+    POST /api/v1/builder/generate-claim     {patient_id, procedure_code, clinical_notes}
+    POST /api/v1/builder/optimize-claim     {original_claim, rebuttal_feedback, strength_score,
+                                             [patient_id], [procedure_code]}
+    POST /api/v1/insurance/analyze-claim    {claim, [procedure_code]}
+    POST /api/v1/judge/decide               {claim, insurance_rebuttal, [patient_id], [procedure_code]}
+    POST /api/v1/claims/orchestrate         {patient_id, procedure_code, clinical_notes,
+                                             [concurrent_appeals], [adaptive_appeals], [compact_context]}
+    GET  /health                            pool status (503 once requests are being shed)
+    GET  /metrics                           request counts, rejections, timeouts, p50/p95 per route,
+                                            per-step model routing (model_router.py)
+
+The server is a small asyncio HTTP/1.1 server (keep-alive, JSON only), so it
+needs nothing beyond the app's own requirements. Agent calls are blocking
+Snowpark queries: every request borrows one backend from a bounded SessionPool
+(one Snowpark session per backend, created on first use and reused) and runs on
+a worker thread, while the event loop keeps accepting and shedding load.
+
+  - Backpressure: at most --pool-size requests run at once and at most --max-queue
+    wait (up to --acquire-timeout seconds) for a session; anything beyond that is
+    answered 503 with Retry-After immediately instead of piling up.
+  - Timeouts: a request that runs longer than --request-timeout gets 504. Its
+    session's queries are cancelled, and the session returns to the pool only
+    when its worker thread has finished, so two requests never share one.
+  - Agent outputs go through the same contracts as the app (agent_contracts.py);
+    one that still fails after its corrected retry is reported as 502.
+
+Usage:
+    python claims_api.py --port 8080 --pool-size 8
+    python claims_api.py --stub-backend --port 8080    # offline: canned agent responses
+
+ClaimsApi.handle() takes (method, path, body) and returns (status, payload,
+headers), so the routes can also be exercised in-process against a pool of
+StubBackends without opening a socket.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+import uuid
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+import agent_contracts
+import claims_orchestration as orchestration
+from benchmark import percentile
+from completion_backends import CortexBackend, StubBackend
+from model_router import ModelRouter, RoutedBackend
+
+API_PREFIX = "/api/v1"
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8080
+DEFAULT_POOL_SIZE = 8
+DEFAULT_MAX_QUEUE = 32
+DEFAULT_ACQUIRE_TIMEOUT_SECONDS = 5.0
+DEFAULT_REQUEST_TIMEOUT_SECONDS = 180.0
+DEFAULT_STUB_LATENCY_SECONDS = 0.2
+KEEPALIVE_TIMEOUT_SECONDS = 15.0
+MAX_BODY_BYTES = 1024 * 1024
+RETRY_AFTER_SECONDS = 2
+LATENCY_WINDOW = 1000
+
+logger = logging.getLogger("claims_api")
+
+
+class ApiError(Exception):
+    """An error answered with a specific HTTP status"""
+
+    def __init__(self, status, message, headers=None, details=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+        self.details = details
+
+
+def _overloaded(message):
+    return ApiError(503, message, headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+
+
+class SessionPool:
+    """Bounded pool of reusable completion backends (one Snowpark session each).
+
+    factory() builds one backend and may block (session login), so it runs on a
+    thread. acquire() hands out an idle backend, creates one while fewer than
+    size exist, or waits up to acquire_timeout; with max_queue requests already
+    waiting it fails straight away.
+    """
+
+    def __init__(self, factory, size=DEFAULT_POOL_SIZE, max_queue=DEFAULT_MAX_QUEUE,
+                 acquire_timeout=DEFAULT_ACQUIRE_TIMEOUT_SECONDS):
+        self.factory = factory
+        self.size = size
+        self.max_queue = max_queue
+        self.acquire_timeout = acquire_timeout
+        self.created = 0
+        self.in_use = 0
+        self.waiting = 0
+        self._backends = []
+        self._idle = asyncio.Queue()
+
+    @property
+    def saturated(self):
+        return self.waiting >= self.max_queue
+
+    async def _create(self):
+        self.created += 1
+        try:
+            backend = await asyncio.get_running_loop().run_in_executor(None, self.factory)
+        except Exception:
+            self.created -= 1
+            raise
+        self._backends.append(backend)
+        return backend
+
+    async def acquire(self):
+        if not self._idle.empty():
+            backend = self._idle.get_nowait()
+        elif self.created < self.size:
+            backend = await self._create()
+        elif self.saturated:
+            raise _overloaded(f"All {self.size} sessions are busy and {self.waiting} requests are queued")
+        else:
+            self.waiting += 1
+            try:
+                backend = await asyncio.wait_for(self._idle.get(), self.acquire_timeout)
+            except asyncio.TimeoutError:
+                raise _overloaded(f"No session became free within {self.acquire_timeout:g}s")
+            finally:
+                self.waiting -= 1
+        self.in_use += 1
+        return backend
+
+    def release(self, backend):
+        self.in_use -= 1
+        self._idle.put_nowait(backend)
+
+    async def warm(self, count):
+        """Create up to count sessions ahead of the first requests"""
+        while self.created < min(count, self.size):
+            self._idle.put_nowait(await self._create())
+
+    def close(self):
+        for backend in self._backends:
+            session = getattr(backend, "session", None)
+            if session is not None:
+                try:
+                    session.close()
+                except Exception as e:
+                    logger.warning("Could not close pooled session: %s", e)
+
+    def stats(self):
+        return {
+            'size': self.size,
+            'created': self.created,
+            'in_use': self.in_use,
+            'idle': self._idle.qsize(),
+            'waiting': self.waiting,
+            'max_queue': self.max_queue,
+        }
+
+
+class ApiMetrics:
+    """Request counts by route and status, plus a rolling latency window per route"""
+
+    def __init__(self):
+        self.started = time.time()
+        self.in_flight = 0
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.latencies = defaultdict(lambda: deque(maxlen=LATENCY_WINDOW))
+
+    def record(self, route, status, seconds):
+        self.statuses[route][status] += 1
+        self.latencies[route].append(seconds)
+
+    def snapshot(self):
+        routes = {}
+        for route, statuses in sorted(self.statuses.items()):
+            values = list(self.latencies[route])
+            routes[route] = {
+                'requests': sum(statuses.values()),
+                'by_status': dict(sorted(statuses.items())),
+                'p50_ms': round(percentile(values, 50) * 1000, 1) if values else None,
+                'p95_ms': round(percentile(values, 95) * 1000, 1) if values else None,
+            }
+        totals = defaultdict(int)
+        for statuses in self.statuses.values():
+            for status, count in statuses.items():
+                totals[status] += count
+        return {
+            'uptime_seconds': round(time.time() - self.started, 1),
+            'in_flight': self.in_flight,
+            'requests': sum(totals.values()),
+            'rejected': totals[503],
+            'timeouts': totals[504],
+            'errors': sum(count for status, count in totals.items() if status >= 500),
+            'routes': routes,
+        }
+
+
+# ---------------------------------------------------------------------------
+# Route handlers: run on a worker thread with one pooled backend
+# ---------------------------------------------------------------------------
+
+def _text(value):
+    """Request field as the JSON text the agent functions take"""
+    return value if isinstance(value, str) else json.dumps(value)
+
+
+def _require(body, *fields):
+    missing = [field for field in fields if body.get(field) in (None, "")]
+    if missing:
+        raise ApiError(400, f"Missing required field(s): {', '.join(missing)}")
+
+
+def _claim_field(claim_text, section, field):
+    claim = agent_contracts.parsed("BUILDER_AGENT", claim_text) or {}
+    value = (claim.get(section) or {}).get(field)
+    return value[0] if isinstance(value, list) and value else value
+
+
+class ClaimsApi:
+    """Routes, pool, timeouts and metrics for the claims HTTP API"""
+
+    def __init__(self, pool, request_timeout=DEFAULT_REQUEST_TIMEOUT_SECONDS, retries=orchestration.DEFAULT_RETRIES,
+                 cache=None, rule_engine=None, telemetry=None, router=None):
+        self.pool = pool
+        self.request_timeout = request_timeout
+        self.retries = retries
+        self.cache = cache
+        self.rule_engine = rule_engine
+        self.telemetry = telemetry
+        self.router = router
+        self.metrics = ApiMetrics()
+        self.executor = ThreadPoolExecutor(max_workers=pool.size, thread_name_prefix="claims-api")
+        self.routes = {
+            f"{API_PREFIX}/builder/generate-claim": (self.generate_claim, ("patient_id", "procedure_code", "clinical_notes")),
+            f"{API_PREFIX}/builder/optimize-claim": (self.optimize_claim, ("original_claim", "rebuttal_feedback")),
+            f"{API_PREFIX}/insurance/analyze-claim": (self.analyze_claim, ("claim",)),
+            f"{API_PREFIX}/judge/decide": (self.judge_claim, ("claim", "insurance_rebuttal")),
+            f"{API_PREFIX}/claims/orchestrate": (self.orchestrate, ("patient_id", "procedure_code", "clinical_notes")),
+        }
+
+    def _backend(self, backend):
+        if self.telemetry is not None:
+            from agent_telemetry import InstrumentedBackend
+            backend = InstrumentedBackend(backend, self.telemetry, session_id=f"API_{uuid.uuid4().hex[:12]}")
+        if self.router is not None:
+            backend = RoutedBackend(backend, self.router)
+        return backend
+
+    def generate_claim(self, backend, body):
+        claim = orchestration.generate_claim(
+            backend, body['patient_id'], body['procedure_code'], body['clinical_notes'], self.retries, self.cache
+        )
+        return {'claim': agent_contracts.parsed("BUILDER_AGENT", claim)}
+
+    def optimize_claim(self, backend, body):
+        original_claim = _text(body['original_claim'])
+        patient_id = body.get('patient_id') or _claim_field(original_claim, 'claim_header', 'patient_id')
+        procedure_code = body.get('procedure_code') or _claim_field(original_claim, 'claim_details', 'procedure_codes')
+        if not patient_id or not procedure_code:
+            raise ApiError(400, "patient_id and procedure_code are required when the claim does not contain them")
+        feedback = body['rebuttal_feedback']
+        if isinstance(feedback, str) and agent_contracts.parsed("INSURANCE_AGENT_WITH_POLICY", feedback) is None:
+            # Free-text feedback is sent in the rebuttal shape the optimize prompt digests
+            feedback = {'rebuttal_summary': feedback, 'denial_reasons': [], 'strength_score': body.get('strength_score')}
+        claim = orchestration.optimize_claim(
+            backend, original_claim, _text(feedback), patient_id, procedure_code, self.retries, self.cache
+        )
+        return {'claim': agent_contracts.parsed("BUILDER_AGENT_OPTIMIZE", claim)}
+
+    def analyze_claim(self, backend, body):
+        claim = _text(body['claim'])
+        procedure_code = body.get('procedure_code') or _claim_field(claim, 'claim_details', 'procedure_codes')
+        if not procedure_code:
+            raise ApiError(400, "procedure_code is required when the claim does not contain one")
+        rebuttal = orchestration.analyze_claim(backend, claim, procedure_code, self.retries, self.cache)
+        return {
+            'insurance_rebuttal': agent_contracts.parsed("INSURANCE_AGENT_WITH_POLICY", rebuttal),
+            'strength_score': orchestration.parse_strength_score(rebuttal),
+        }
+
+    def judge_claim(self, backend, body):
+        claim = _text(body['claim'])
+        patient_id = body.get('patient_id') or _claim_field(claim, 'claim_header', 'patient_id')
+        procedure_code = body.get('procedure_code') or _claim_field(claim, 'claim_details', 'procedure_codes')
+        decision = orchestration.judge_claim(
+            backend, claim, _text(body['insurance_rebuttal']), patient_id, procedure_code, self.retries, self.cache
+        )
+        return {
+            'judge_decision': agent_contracts.parsed("AI_JUDGE_DECISION", decision),
+            'final_decision': orchestration.parse_final_decision(decision),
+        }
+
+    def orchestrate(self, backend, body):
+        result = orchestration.run_orchestration(
+            backend, body['patient_id'], body['procedure_code'], body['clinical_notes'],
+            concurrent_appeals=body.get('concurrent_appeals', True), retries=self.retries, cache=self.cache,
+            compact_context=body.get('compact_context', True), adaptive_appeals=body.get('adaptive_appeals', True),
+            rule_engine=self.rule_engine
+        )
+        steps = {'DOCTOR_APPEAL': "DOCTOR_APPEAL_GENERATOR", 'INSURANCE_COUNTER': "INSURANCE_COUNTER_APPEAL"}
+        return {
+            'claim': agent_contracts.parsed("BUILDER_AGENT", result['generated_claim']),
+            'insurance_rebuttal': agent_contracts.parsed("INSURANCE_AGENT_WITH_POLICY", result['insurance_rebuttal']),
+            'judge_decision': agent_contracts.parsed("AI_JUDGE_DECISION", result['judge_decision']),
+            'final_decision': result['final_decision'],
+            'appeal_history': [
+                {**entry, 'content': agent_contracts.parsed(steps[entry['type']], entry['content'])}
+                for entry in result['appeal_history']
+            ],
+            'appeal_stop_reason': result['appeal_stop_reason'],
+            'pre_screen': result['pre_screen'],
+        }
+
+    # -----------------------------------------------------------------------
+
+    def _cancel(self, backend):
+        """Cancel the timed-out request's running queries (fire and forget)"""
+        session = getattr(backend, "session", None)
+        if session is not None and hasattr(session, "cancel_all"):
+            asyncio.get_running_loop().run_in_executor(None, session.cancel_all)
+
+    async def _run(self, handler, body):
+        backend = await self.pool.acquire()
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, handler, self._backend(backend), body)
+        # The session goes back only when the thread is done with it, even after a timeout
+        future.add_done_callback(lambda _: self.pool.release(backend))
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), self.request_timeout)
+        except asyncio.TimeoutError:
+            self._cancel(backend)
+            future.add_done_callback(lambda f: f.exception())  # consumed; the client already has its 504
+            raise ApiError(504, f"Request did not finish within {self.request_timeout:g}s")
+
+    async def handle(self, method, path, body=b""):
+        """Answer one request; returns (status, payload, headers)"""
+        path = path.split("?", 1)[0].rstrip("/") or "/"
+        started = time.perf_counter()
+        self.metrics.in_flight += 1
+        status, payload, headers = 200, None, {}
+        try:
+            payload = await self._dispatch(method, path, body)
+        except ApiError as e:
+            status, headers = e.status, e.headers
+            payload = {'error': e.message, **({'details': e.details} if e.details else {})}
+        except agent_contracts.ContractViolation as e:
+            status, payload = 502, {'error': str(e), 'details': e.errors}
+        except Exception as e:
+            logger.exception("Unhandled error for %s %s", method, path)
+            status, payload = 500, {'error': f"{type(e).__name__}: {e}"}
+        finally:
+            self.metrics.in_flight -= 1
+        route = path if path in self.routes or path in ("/health", "/metrics") else "other"
+        self.metrics.record(route, status, time.perf_counter() - started)
+        return status, payload, headers
+
+    async def _dispatch(self, method, path, body):
+        if path == "/health":
+            if method != "GET":
+                raise ApiError(405, "Use GET")
+            if self.pool.saturated:
+                raise _overloaded("Session pool saturated")
+            return {'status': 'ok', 'pool': self.pool.stats()}
+        if path == "/metrics":
+            if method != "GET":
+                raise ApiError(405, "Use GET")
+            routing = self.router.summary() if self.router is not None else None
+            return {**self.metrics.snapshot(), 'pool': self.pool.stats(), 'model_routing': routing}
+        if path not in self.routes:
+            raise ApiError(404, f"No route for {path}")
+        if method != "POST":
+            raise ApiError(405, "Use POST")
+        try:
+            request = json.loads(body or b"{}")
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            raise ApiError(400, "Request body must be JSON")
+        if not isinstance(request, dict):
+            raise ApiError(400, "Request body must be a JSON object")
+        handler, required = self.routes[path]
+        _require(request, *required)
+        return await self._run(handler, request)
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.pool.close()
+
+
+# ---------------------------------------------------------------------------
+# HTTP/1.1 transport
+# ---------------------------------------------------------------------------
+
+async def _write_response(writer, status, payload, headers, keep_alive):
+    data = json.dumps(payload, default=str).encode()
+    head = [
+        f"HTTP/1.1 {status} {HTTPStatus(status).phrase}",
+        "Content-Type: application/json",
+        f"Content-Length: {len(data)}",
+        f"Connection: {'keep-alive' if keep_alive else 'close'}",
+        *(f"{name}: {value}" for name, value in headers.items()),
+    ]
+    writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + data)
+    await writer.drain()
+
+
+async def handle_connection(api, reader, writer):
+    """Serve requests on one connection until the client closes it or goes idle"""
+    try:
+        while True:
+            try:
+                head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEPALIVE_TIMEOUT_SECONDS)
+            except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                return
+            except asyncio.LimitOverrunError:
+                await _write_response(writer, 431, {'error': "Request headers too large"}, {}, False)
+                return
+            lines = head.decode("latin-1").split("\r\n")
+            try:
+                method, target, version = lines[0].split(" ", 2)
+            except ValueError:
+                await _write_response(writer, 400, {'error': "Malformed request line"}, {}, False)
+                return
+            headers = {}
+            for line in lines[1:]:
+                if ":" in line:
+                    name, value = line.split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+            connection = headers.get("connection", "").lower()
+            keep_alive = connection == "keep-alive" if version == "HTTP/1.0" else connection != "close"
+            try:
+                length = int(headers.get("content-length", 0))
+            except ValueError:
+                length = -1
+            if length < 0 or length > MAX_BODY_BYTES:
+                await _write_response(writer, 413 if length > 0 else 400, {'error': "Invalid or too large body"}, {}, False)
+                return
+            body = await reader.readexactly(length) if length else b""
+            status, payload, extra = await api.handle(method.upper(), target, body)
+            await _write_response(writer, status, payload, extra, keep_alive)
+            if not keep_alive:
+                return
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(api, host=DEFAULT_HOST, port=DEFAULT_PORT, warm_sessions=0):
+    """Run the API until cancelled"""
+    if warm_sessions:
+        await api.pool.warm(warm_sessions)
+    server = await asyncio.start_server(lambda r, w: handle_connection(api, r, w), host, port, backlog=1024)
+    logger.info("Claims API listening on http://%s:%s (pool size %s)", host, port, api.pool.size)
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP API for the claims agents")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--config-file", default="config.toml")
+    parser.add_argument("--connection", default="healthcare_claims_demo")
+    parser.add_argument("--pool-size", type=int, default=DEFAULT_POOL_SIZE,
+                        help="Snowflake sessions in the pool, i.e. requests served at the same time")
+    parser.add_argument("--warm-sessions", type=int, default=1,
+                        help="Sessions opened at startup instead of on first use")
+    parser.add_argument("--max-queue", type=int, default=DEFAULT_MAX_QUEUE,
+                        help="Requests allowed to wait for a session before new ones get 503")
+    parser.add_argument("--acquire-timeout", type=float, default=DEFAULT_ACQUIRE_TIMEOUT_SECONDS,
+                        help="Seconds a request waits for a free session before it gets 503")
+    parser.add_argument("--request-timeout", type=float, default=DEFAULT_REQUEST_TIMEOUT_SECONDS,
+                        help="Seconds before a running request gets 504 and its queries are cancelled")
+    parser.add_argument("--retries", type=int, default=orchestration.DEFAULT_RETRIES,
+                        help="Retries with exponential backoff for each failed Cortex call")
+    parser.add_argument("--stub-backend", action="store_true",
+                        help="Answer agent steps from the offline stub (canned JSON); no Snowflake connection")
+    parser.add_argument("--stub-latency", type=float, default=DEFAULT_STUB_LATENCY_SECONDS,
+                        help="Seconds per simulated agent call with --stub-backend")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Bypass LLM_RESPONSE_CACHE and call Cortex for every agent step")
+    parser.add_argument("--no-telemetry", action="store_true",
+                        help="Do not log per-call timing and sizes to AGENT_INTERACTIONS")
+    parser.add_argument("--no-prescreen", action="store_true",
+                        help="Send every orchestrated claim to the Insurance Agent and Judge")
+    parser.add_argument("--no-model-routing", action="store_true",
+                        help="Run every agent step on its SQL function's model instead of the registry's per-step routes")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    control_session = cache = telemetry = rule_engine = router = None
+    if args.stub_backend:
+        factory = lambda: StubBackend(latency_seconds=args.stub_latency, jitter=0.1)
+        router = None if args.no_model_routing else ModelRouter.defaults()
+    else:
+        from agent_telemetry import AgentTelemetry
+        from llm_cache import LLMResponseCache
+        from policy_rules import PolicyRuleEngine
+        # One extra session for the shared cache, telemetry writer and rule load
+        control_session = orchestration.create_session(args.config_file, args.connection)
+        cache = None if args.no_cache else LLMResponseCache(control_session)
+        telemetry = None if args.no_telemetry else AgentTelemetry(control_session)
+        rule_engine = None if args.no_prescreen else PolicyRuleEngine.load(control_session)
+        router = None if args.no_model_routing else ModelRouter.load(control_session)
+        factory = lambda: CortexBackend(orchestration.create_session(args.config_file, args.connection))
+
+    async def run():
+        pool = SessionPool(factory, size=args.pool_size, max_queue=args.max_queue,
+                           acquire_timeout=args.acquire_timeout)
+        api = ClaimsApi(pool, request_timeout=args.request_timeout, retries=args.retries,
+                        cache=cache, rule_engine=rule_engine, telemetry=telemetry, router=router)
+        try:
+            await serve(api, args.host, args.port, warm_sessions=args.warm_sessions)
+        finally:
+            api.close()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        logger.info("Claims API stopped")
+    finally:
+        if telemetry is not None:
+            telemetry.close()
+        if control_session is not None:
+            control_session.close()
+
+
+if __name__ == "__main__":
+    main()
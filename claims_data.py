@@ -0,0 +1,176 @@
+"""
+Data access layer for patient/procedure lookups and system statistics.
+
+Search runs server-side (prefix match, one page at a time) so the app never pulls
+the whole member file into a widget. Full patient/procedure records are fetched
+per ID and cached with a TTL, so the selection widgets and the "Data in Use"
+panels share one lookup instead of re-querying on every Streamlit rerun.
+"""
+import json
+import threading
+import time
+
+from claims_orchestration import AGENT_SCHEMA
+
+PATIENTS_TABLE = f"{AGENT_SCHEMA}.PATIENTS"
+PROCEDURES_TABLE = f"{AGENT_SCHEMA}.COMMON_PROCEDURES"
+POLICY_DOCUMENTS_TABLE = f"{AGENT_SCHEMA}.CIGNA_POLICY_DOCUMENTS"
+
+DEFAULT_PAGE_SIZE = 20
+DETAIL_TTL_SECONDS = 300
+SEARCH_TTL_SECONDS = 60
+STATS_TTL_SECONDS = 600
+
+
+class TTLCache:
+    """Thread-safe dict whose entries expire after ttl_seconds"""
+
+    def __init__(self, ttl_seconds):
+        self.ttl_seconds = ttl_seconds
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, stored_at = entry
+            if time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                return None
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+
+def _prefix_filter(columns, search_text):
+    """(WHERE clause, bind params) matching the search text as a case-insensitive prefix of any column"""
+    search_text = (search_text or "").strip().upper()
+    if not search_text:
+        return "TRUE", []
+    return " OR ".join(f"STARTSWITH(UPPER({column}), ?)" for column in columns), [search_text] * len(columns)
+
+
+class ClaimsDataStore:
+    """Paged search, per-ID detail cache and cached system statistics"""
+
+    def __init__(self, session, page_size=DEFAULT_PAGE_SIZE, detail_ttl_seconds=DETAIL_TTL_SECONDS,
+                 search_ttl_seconds=SEARCH_TTL_SECONDS, stats_ttl_seconds=STATS_TTL_SECONDS):
+        self.session = session
+        self.page_size = page_size
+        self._details = TTLCache(detail_ttl_seconds)
+        self._searches = TTLCache(search_ttl_seconds)
+        self._stats = TTLCache(stats_ttl_seconds)
+
+    def _search(self, kind, query_template, params, search_text, page):
+        key = (kind, (search_text or "").strip().upper(), page)
+        cached = self._searches.get(key)
+        if cached is not None:
+            return cached
+        # One extra row tells us whether there is a next page without a COUNT(*)
+        rows = self.session.sql(query_template.format(
+            limit=self.page_size + 1, offset=page * self.page_size
+        ), params=params).collect()
+        results = [row.as_dict() for row in rows[:self.page_size]]
+        page_result = (results, len(rows) > self.page_size)
+        self._searches.put(key, page_result)
+        return page_result
+
+    def search_patients(self, search_text="", page=0):
+        """Return (patients, has_more) for one page of patients matching ID or name prefix"""
+        where, params = _prefix_filter(
+            ["PATIENT_ID", "FIRST_NAME", "LAST_NAME", "FIRST_NAME || ' ' || LAST_NAME"], search_text
+        )
+        return self._search("patients", f"""
+            SELECT PATIENT_ID, FIRST_NAME || ' ' || LAST_NAME as PATIENT_NAME, POLICY_NUMBER
+            FROM {PATIENTS_TABLE}
+            WHERE {where}
+            ORDER BY PATIENT_ID
+            LIMIT {{limit}} OFFSET {{offset}}
+        """, params, search_text, page)
+
+    def search_procedures(self, search_text="", page=0):
+        """Return (procedures, has_more) for one page of procedures matching code or name prefix"""
+        where, params = _prefix_filter(["PROCEDURE_CODE", "PROCEDURE_NAME"], search_text)
+        return self._search("procedures", f"""
+            SELECT PROCEDURE_CODE, PROCEDURE_NAME
+            FROM {PROCEDURES_TABLE}
+            WHERE {where}
+            ORDER BY PROCEDURE_CODE
+            LIMIT {{limit}} OFFSET {{offset}}
+        """, params, search_text, page)
+
+    def _detail(self, kind, table, id_column, record_id):
+        key = (kind, record_id)
+        cached = self._details.get(key)
+        if cached is not None:
+            return cached
+        rows = self.session.sql(
+            f"SELECT * FROM {table} WHERE {id_column} = ? LIMIT 1", params=[record_id]
+        ).collect()
+        record = rows[0].as_dict() if rows else None
+        if record is not None:
+            self._details.put(key, record)
+        return record
+
+    def get_patient(self, patient_id):
+        """Full PATIENTS row for one patient, or None"""
+        return self._detail("patient", PATIENTS_TABLE, "PATIENT_ID", patient_id)
+
+    def get_procedure(self, procedure_code):
+        """Full COMMON_PROCEDURES row for one procedure, or None"""
+        return self._detail("procedure", PROCEDURES_TABLE, "PROCEDURE_CODE", procedure_code)
+
+    def system_statistics(self):
+        """Counts and chart breakdowns for the System Statistics panel, from one query"""
+        cached = self._stats.get("system")
+        if cached is not None:
+            return cached
+        row = self.session.sql(f"""
+            SELECT
+                (SELECT COUNT(*) FROM {PATIENTS_TABLE}) as PATIENT_COUNT,
+                (SELECT COUNT(*) FROM {PROCEDURES_TABLE}) as PROCEDURE_COUNT,
+                (SELECT COUNT(*) FROM {POLICY_DOCUMENTS_TABLE}) as POLICY_COUNT,
+                (SELECT OBJECT_AGG(PLAN_GROUP, PATIENTS::VARIANT) FROM (
+                    SELECT COALESCE(GROUP_NUMBER, 'UNKNOWN') as PLAN_GROUP, COUNT(*) as PATIENTS
+                    FROM {PATIENTS_TABLE} GROUP BY 1
+                )) as PATIENTS_BY_GROUP,
+                (SELECT OBJECT_AGG(SPECIALTY, PROCEDURES::VARIANT) FROM (
+                    SELECT COALESCE(MEDICAL_SPECIALTY, 'Other') as SPECIALTY, COUNT(*) as PROCEDURES
+                    FROM {PROCEDURES_TABLE} GROUP BY 1
+                )) as PROCEDURES_BY_SPECIALTY
+        """).collect()[0]
+        stats = {
+            'patients': row['PATIENT_COUNT'],
+            'procedures': row['PROCEDURE_COUNT'],
+            'policies': row['POLICY_COUNT'],
+            'patients_by_group': _as_dict(row['PATIENTS_BY_GROUP']),
+            'procedures_by_specialty': _as_dict(row['PROCEDURES_BY_SPECIALTY']),
+        }
+        self._stats.put("system", stats)
+        return stats
+
+    def invalidate(self):
+        """Drop all cached searches, detail records and statistics"""
+        self._details.invalidate()
+        self._searches.invalidate()
+        self._stats.invalidate()
+
+
+def _as_dict(value):
+    """Snowpark returns OBJECT columns as JSON text"""
+    if value is None:
+        return {}
+    if isinstance(value, str):
+        return json.loads(value)
+    return dict(value)
@@ -0,0 +1,547 @@
+"""
+Dual-agent orchestration steps shared by the Streamlit app and the batch worker.
+
+Each step runs one agent: Builder Agent -> Insurance Agent -> AI Judge -> Appeals
+(doctor appeal + insurance counter-appeal per round). Steps go through a
+CompletionBackend (completion_backends.py), so the same flow runs against the
+CLAIMS_DEMO agent functions in Snowflake or against the offline stub; passing a
+Snowpark session means Cortex. Appeal rounds are independent of each other, so
+they are submitted together as async jobs.
+
+Every response is checked against its step's output contract (agent_contracts.py)
+before it is returned or cached; a response that cannot be repaired is re-asked
+once for that step only, with a correction prompt.
+"""
+import json
+import time
+import tomllib
+from concurrent.futures import FIRST_COMPLETED, wait
+
+import agent_contracts
+
+AGENT_SCHEMA = "CLAIMS_DEMO.PUBLIC"
+APPEAL_ROUNDS = 3
+# Poll interval for appeal jobs that are not thread futures (Snowpark async queries, routed calls)
+APPEAL_POLL_SECONDS = 0.05
+
+# Cortex model each agent SQL function calls when no model is passed: the model
+# in the response cache key unless the step is routed (model_router.py)
+AGENT_MODELS = {
+    "BUILDER_AGENT": "snowflake-arctic",
+    "BUILDER_AGENT_OPTIMIZE": "snowflake-arctic",
+    "INSURANCE_AGENT_WITH_POLICY": "snowflake-arctic",
+    "AI_JUDGE_DECISION": "snowflake-arctic",
+    "DOCTOR_APPEAL_GENERATOR": "snowflake-arctic",
+    "INSURANCE_COUNTER_APPEAL": "snowflake-arctic",
+}
+
+# Retry settings for transient Cortex / warehouse failures
+DEFAULT_RETRIES = 2
+RETRY_BASE_DELAY_SECONDS = 1.0
+# Corrected re-asks for a response that breaks its output contract
+CONTRACT_RETRIES = 1
+
+
+def sql_literal(value):
+    """Render a Python value as a SQL literal for the agent function calls"""
+    if value is None:
+        return "NULL"
+    if isinstance(value, (int, float)):
+        return str(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def with_retry(fn, retries=DEFAULT_RETRIES, base_delay=RETRY_BASE_DELAY_SECONDS):
+    """Call fn(), retrying with exponential backoff on failure"""
+    attempt = 0
+    while True:
+        try:
+            return fn()
+        except Exception:
+            if attempt >= retries:
+                raise
+            time.sleep(base_delay * (2 ** attempt))
+            attempt += 1
+
+
+def as_backend(backend):
+    """Return backend as a CompletionBackend; a Snowpark session becomes a CortexBackend"""
+    if hasattr(backend, "complete"):
+        return backend
+    from completion_backends import CortexBackend
+    return CortexBackend(backend)
+
+
+def conforming_response(backend, function_name, args, response):
+    """Validated (and if needed repaired) text of a fresh response.
+
+    A response that breaks its contract is re-asked up to CONTRACT_RETRIES times
+    with a correction prompt; only this step is repeated. Raises
+    agent_contracts.ContractViolation if it still does not conform.
+    """
+    if function_name not in agent_contracts.CONTRACTS:
+        return response
+    output = agent_contracts.check_output(function_name, response)
+    for _ in range(CONTRACT_RETRIES):
+        if output.valid:
+            break
+        correction = agent_contracts.correction_prompt(function_name, output)
+        output = agent_contracts.check_output(
+            function_name, backend.complete_with_correction(function_name, args, correction)
+        )
+    return output.require().text
+
+
+def cached_response(backend, function_name, args, cache):
+    """A cached response that still meets the step's contract, or None"""
+    if cache is None:
+        return None
+    model = backend.model_for(function_name)
+    cached = cache.get(function_name, model, args)
+    if cached is None or not agent_contracts.check_output(function_name, cached).valid:
+        return None
+    backend.on_cache_hit(function_name, args, cached, model=model)
+    return cached
+
+
+def call_agent(backend, function_name, args, retries=0, cache=None):
+    """Run one agent step synchronously and return its text output.
+
+    With a response cache (see llm_cache.py), identical calls are answered from
+    the cache and fresh responses are stored for next time. Only responses that
+    meet the step's output contract are returned or cached.
+    """
+    backend = as_backend(backend)
+    cached = cached_response(backend, function_name, args, cache)
+    if cached is not None:
+        return cached
+    response = with_retry(lambda: backend.complete(function_name, args), retries=retries)
+    response = conforming_response(backend, function_name, args, response)
+    if cache is not None:
+        cache.put(function_name, backend.model_for(function_name), args, response)
+    return response
+
+
+class AgentJob:
+    """An agent call running as a backend async job, or already answered from the cache"""
+
+    def __init__(self, function_name, args, job=None, response=None, cache=None, backend=None):
+        self.function_name = function_name
+        self.args = args
+        self.job = job
+        self.response = response
+        self.cache = cache
+        self.backend = backend
+
+    def is_done(self):
+        return self.job is None or self.job.is_done()
+
+    def result(self):
+        if self.job is not None and self.response is None:
+            self.response = conforming_response(self.backend, self.function_name, self.args, self.job.result())
+            if self.cache is not None:
+                self.cache.put(self.function_name, self.backend.model_for(self.function_name), self.args, self.response)
+        return self.response
+
+
+def submit_agent(backend, function_name, args, cache=None):
+    """Submit one agent step as an async job (skipped on a cache hit)"""
+    backend = as_backend(backend)
+    cached = cached_response(backend, function_name, args, cache)
+    if cached is not None:
+        return AgentJob(function_name, args, response=cached)
+    job = backend.submit(function_name, args)
+    return AgentJob(function_name, args, job=job, cache=cache, backend=backend)
+
+
+# ---------------------------------------------------------------------------
+# Workflow steps
+# ---------------------------------------------------------------------------
+
+def generate_claim(backend, patient_id, procedure_code, clinical_notes, retries=0, cache=None):
+    """Step 1: Builder Agent generates the claim JSON"""
+    return call_agent(backend, "BUILDER_AGENT", [patient_id, procedure_code, clinical_notes], retries, cache)
+
+
+def optimize_claim(backend, original_claim, insurance_rebuttal, patient_id, procedure_code, retries=0, cache=None):
+    """Builder Agent rewrites a claim to answer an insurance rebuttal (BUILDER_AGENT_OPTIMIZE, notebook 06)"""
+    return call_agent(
+        backend, "BUILDER_AGENT_OPTIMIZE", [original_claim, insurance_rebuttal, patient_id, procedure_code], retries, cache
+    )
+
+
+def analyze_claim(backend, generated_claim, procedure_code, retries=0, cache=None):
+    """Step 2: Insurance Agent reviews the claim against Cigna policy"""
+    return call_agent(backend, "INSURANCE_AGENT_WITH_POLICY", [generated_claim, procedure_code], retries, cache)
+
+
+def judge_claim(backend, generated_claim, insurance_rebuttal, patient_id, procedure_code, retries=0, cache=None):
+    """Step 3: AI Judge arbitrates between the two agents"""
+    return call_agent(
+        backend, "AI_JUDGE_DECISION",
+        [generated_claim, insurance_rebuttal, patient_id, procedure_code], retries, cache
+    )
+
+
+def doctor_appeal_args(generated_claim, insurance_rebuttal, judge_decision, round_num):
+    return [generated_claim, insurance_rebuttal, judge_decision, round_num]
+
+
+def insurance_counter_args(doctor_appeal, insurance_rebuttal, round_num):
+    return [doctor_appeal, insurance_rebuttal, round_num]
+
+
+def file_appeal(backend, generated_claim, insurance_rebuttal, judge_decision, round_num, retries=0, cache=None):
+    """Step 4a: Doctor files an appeal for one round"""
+    return call_agent(
+        backend, "DOCTOR_APPEAL_GENERATOR",
+        doctor_appeal_args(generated_claim, insurance_rebuttal, judge_decision, round_num), retries, cache
+    )
+
+
+def counter_appeal(backend, doctor_appeal, insurance_rebuttal, round_num, retries=0, cache=None):
+    """Step 4b: Insurance responds to one round's appeal"""
+    return call_agent(
+        backend, "INSURANCE_COUNTER_APPEAL",
+        insurance_counter_args(doctor_appeal, insurance_rebuttal, round_num), retries, cache
+    )
+
+
+def _job_future(job):
+    """The concurrent.futures.Future behind a (wrapped) job, or None if it has none"""
+    while job is not None:
+        if getattr(job, "future", None) is not None:
+            return job.future
+        job = getattr(job, "job", None)
+    return None
+
+
+def wait_for_any(jobs, timeout=APPEAL_POLL_SECONDS):
+    """Block until one of the jobs finishes: on their futures when every job runs on a
+    thread, otherwise for one poll interval"""
+    futures = [_job_future(job) for job in jobs]
+    if futures and all(future is not None for future in futures):
+        wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+    else:
+        time.sleep(timeout)
+
+
+def _job_result(job, resubmit, retries):
+    """Read an async job's output, falling back to a synchronous retry on failure"""
+    try:
+        return job.result()
+    except Exception:
+        if retries <= 0:
+            raise
+        return with_retry(resubmit, retries=retries - 1)
+
+
+def run_appeals_sequential(backend, generated_claim, insurance_rebuttal, judge_decision,
+                           on_appeal=None, on_counter=None, retries=0, cache=None, convergence=None):
+    """Run the appeal rounds one call at a time, stopping early once convergence says so"""
+    doctor_appeals = {}
+    insurance_counters = {}
+    for round_num in range(1, APPEAL_ROUNDS + 1):
+        doctor_appeals[round_num] = file_appeal(
+            backend, generated_claim, insurance_rebuttal, judge_decision, round_num, retries, cache
+        )
+        if on_appeal:
+            on_appeal(round_num, doctor_appeals[round_num])
+        insurance_counters[round_num] = counter_appeal(
+            backend, doctor_appeals[round_num], insurance_rebuttal, round_num, retries, cache
+        )
+        if on_counter:
+            on_counter(round_num, insurance_counters[round_num])
+        if convergence is not None and convergence.should_stop(round_num, insurance_counters[round_num]):
+            break
+    return doctor_appeals, insurance_counters
+
+
+def run_appeals_concurrently(backend, generated_claim, insurance_rebuttal, judge_decision,
+                             on_appeal=None, on_counter=None, retries=0, cache=None, convergence=None,
+                             known_appeals=None, known_counters=None, on_wait=None):
+    """Run all appeal rounds as async jobs (Snowpark async queries on Cortex).
+
+    Doctor appeals only depend on the claim, rebuttal and judge decision, so all
+    rounds are submitted at once. Each counter-appeal is submitted as soon as its
+    own doctor appeal finishes, pipelining the rounds instead of running them
+    back to back. Callbacks fire on the calling thread as each job completes.
+
+    With a convergence tracker (AppealConvergence) rounds are adaptive instead:
+    a round's doctor appeal is only submitted once the previous counter-appeal
+    says the dispute has not settled, so a claim that settles in round one makes
+    exactly two appeal calls.
+
+    known_appeals / known_counters ({round: output}) are outputs from an earlier,
+    interrupted run (workflow_jobs.py); those calls are not made again, and they
+    are replayed through the callbacks and the convergence tracker in round order.
+    on_wait() is called each time the loop waits for a job to finish.
+    """
+    known_appeals = known_appeals or {}
+    known_counters = known_counters or {}
+
+    def submit_appeal(round_num):
+        args = doctor_appeal_args(generated_claim, insurance_rebuttal, judge_decision, round_num)
+        if round_num in known_appeals:
+            return AgentJob("DOCTOR_APPEAL_GENERATOR", args, response=known_appeals[round_num])
+        return submit_agent(backend, "DOCTOR_APPEAL_GENERATOR", args, cache)
+
+    def submit_counter(round_num):
+        args = insurance_counter_args(doctor_appeals[round_num], insurance_rebuttal, round_num)
+        if round_num in known_counters:
+            return AgentJob("INSURANCE_COUNTER_APPEAL", args, response=known_counters[round_num])
+        return submit_agent(backend, "INSURANCE_COUNTER_APPEAL", args, cache)
+
+    first_rounds = 1 if convergence is not None else APPEAL_ROUNDS
+    appeal_jobs = {round_num: submit_appeal(round_num) for round_num in range(1, first_rounds + 1)}
+    counter_jobs = {}
+    doctor_appeals = {}
+    insurance_counters = {}
+
+    while appeal_jobs or counter_jobs:
+        progressed = False
+        for round_num, job in sorted(appeal_jobs.items()):
+            if job.is_done():
+                progressed = True
+                doctor_appeals[round_num] = _job_result(
+                    job,
+                    lambda r=round_num: file_appeal(backend, generated_claim, insurance_rebuttal, judge_decision, r, cache=cache),
+                    retries
+                )
+                del appeal_jobs[round_num]
+                counter_jobs[round_num] = submit_counter(round_num)
+                if on_appeal:
+                    on_appeal(round_num, doctor_appeals[round_num])
+        for round_num, job in list(counter_jobs.items()):
+            if job.is_done():
+                progressed = True
+                insurance_counters[round_num] = _job_result(
+                    job,
+                    lambda r=round_num: counter_appeal(backend, doctor_appeals[r], insurance_rebuttal, r, cache=cache),
+                    retries
+                )
+                del counter_jobs[round_num]
+                if on_counter:
+                    on_counter(round_num, insurance_counters[round_num])
+                if convergence is not None:
+                    settled = convergence.should_stop(round_num, insurance_counters[round_num])
+                    if not settled and round_num < APPEAL_ROUNDS:
+                        appeal_jobs[round_num + 1] = submit_appeal(round_num + 1)
+        # A newly submitted appeal may already be done (cache hit or a persisted round)
+        if not progressed:
+            if on_wait:
+                on_wait()
+            wait_for_any(list(appeal_jobs.values()) + list(counter_jobs.values()))
+
+    return doctor_appeals, insurance_counters
+
+
+def appeal_history_from(doctor_appeals, insurance_counters):
+    """Flatten appeal outputs into the round-ordered history the app displays"""
+    history = []
+    for round_num in sorted(doctor_appeals):
+        history.append({'round': round_num, 'type': 'DOCTOR_APPEAL', 'content': doctor_appeals[round_num]})
+        if round_num in insurance_counters:
+            history.append({'round': round_num, 'type': 'INSURANCE_COUNTER', 'content': insurance_counters[round_num]})
+    return history
+
+
+def parse_final_decision(judge_decision):
+    """Return the judge's final_decision in upper case, or None if it is not valid JSON"""
+    judge = agent_contracts.parsed("AI_JUDGE_DECISION", judge_decision)
+    if judge is None:
+        return None
+    return str(judge.get('final_decision', 'UNKNOWN')).upper()
+
+
+def parse_strength_score(insurance_rebuttal):
+    """Return the rebuttal's strength_score as a float, or None"""
+    rebuttal = agent_contracts.parsed("INSURANCE_AGENT_WITH_POLICY", insurance_rebuttal)
+    try:
+        return float(rebuttal.get('strength_score'))
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+# ---------------------------------------------------------------------------
+# Appeal convergence
+# ---------------------------------------------------------------------------
+
+def evaluate_convergence(current_strength, previous_strength, iteration_count, max_iterations,
+                         high_strength=0.8, acceptable_strength=0.6):
+    """Python mirror of the EVALUATE_CONVERGENCE UDF (notebook 06), with the thresholds as parameters"""
+    if current_strength is not None and current_strength >= high_strength:
+        return 'CONVERGED_HIGH_STRENGTH'
+    if current_strength is not None and current_strength >= acceptable_strength and iteration_count >= 2:
+        return 'CONVERGED_ACCEPTABLE'
+    if iteration_count >= max_iterations:
+        return 'MAX_ITERATIONS_REACHED'
+    if current_strength is not None and previous_strength is not None and current_strength <= previous_strength:
+        return 'NO_IMPROVEMENT'
+    return 'CONTINUE_OPTIMIZATION'
+
+
+class AppealConvergence:
+    """Decides after each counter-appeal whether further appeal rounds are worth running.
+
+    Rules, checked in order on the counter-appeal's JSON:
+      - INSURER_CONCEDED: position_change is in concede_positions or
+        final_recommendation is in concede_recommendations
+      - the EVALUATE_CONVERGENCE statuses on new_strength_score: high strength,
+        acceptable strength from round 2, max rounds, or no improvement over the
+        previous round (round 1 compares against the original rebuttal's score)
+
+    Each round's status is kept in rounds; stop_reason is set when a rule fires.
+    A counter-appeal that does not parse never stops the loop on its own.
+    """
+
+    def __init__(self, initial_strength=None, max_rounds=APPEAL_ROUNDS, high_strength=0.8,
+                 acceptable_strength=0.6, concede_positions=("REVERSED",),
+                 concede_recommendations=("APPROVE",), stop_on_no_improvement=True):
+        self.previous_strength = initial_strength
+        self.max_rounds = max_rounds
+        self.high_strength = high_strength
+        self.acceptable_strength = acceptable_strength
+        self.concede_positions = {value.upper() for value in concede_positions}
+        self.concede_recommendations = {value.upper() for value in concede_recommendations}
+        self.stop_on_no_improvement = stop_on_no_improvement
+        self.rounds = []
+        self.stop_reason = None
+
+    def status_for(self, round_num, insurance_counter):
+        counter = agent_contracts.parsed("INSURANCE_COUNTER_APPEAL", insurance_counter)
+        if counter is None:
+            return 'UNPARSEABLE_COUNTER', None, None, None
+        position = str(counter.get('position_change') or '').upper()
+        recommendation = str(counter.get('final_recommendation') or '').upper()
+        try:
+            strength = float(counter.get('new_strength_score'))
+        except (TypeError, ValueError):
+            strength = None
+
+        if position in self.concede_positions or recommendation in self.concede_recommendations:
+            status = 'INSURER_CONCEDED'
+        else:
+            status = evaluate_convergence(
+                strength, self.previous_strength, round_num, self.max_rounds,
+                self.high_strength, self.acceptable_strength
+            )
+            if status == 'NO_IMPROVEMENT' and not self.stop_on_no_improvement:
+                status = 'CONTINUE_OPTIMIZATION'
+        return status, position or None, strength, recommendation or None
+
+    def should_stop(self, round_num, insurance_counter):
+        """Record this round's outcome and return True if no further rounds should run"""
+        status, position, strength, recommendation = self.status_for(round_num, insurance_counter)
+        self.rounds.append({
+            'round': round_num,
+            'position_change': position,
+            'new_strength_score': strength,
+            'final_recommendation': recommendation,
+            'status': status,
+        })
+        if strength is not None:
+            self.previous_strength = strength
+        if status in ('CONTINUE_OPTIMIZATION', 'UNPARSEABLE_COUNTER'):
+            if round_num >= self.max_rounds:
+                self.stop_reason = 'MAX_ITERATIONS_REACHED'
+                return True
+            return False
+        self.stop_reason = status
+        return True
+
+
+def run_orchestration(backend, patient_id, procedure_code, clinical_notes,
+                      concurrent_appeals=True, retries=DEFAULT_RETRIES, cache=None, compact_context=True,
+                      adaptive_appeals=True, rule_engine=None):
+    """Run Builder -> Insurance -> Judge -> Appeals for one claim request and return all outputs.
+
+    With compact_context, appeal rounds get a ContextDigest (context_compaction.py)
+    instead of the full claim, rebuttal and judge decision; context_savings then
+    lists the estimated prompt tokens saved per round. With adaptive_appeals, the
+    appeal loop stops as soon as AppealConvergence says the dispute has settled;
+    appeal_stop_reason and appeal_rounds record why. With a rule_engine
+    (policy_rules.py), clear-cut outcomes skip the Insurance Agent, Judge and
+    appeals, and other claims reach the agents with the triggered rules attached;
+    pre_screen records the outcome.
+    """
+    backend = as_backend(backend)
+    generated_claim = generate_claim(backend, patient_id, procedure_code, clinical_notes, retries, cache)
+    screen = rule_engine.screen(procedure_code, clinical_notes, generated_claim) if rule_engine is not None else None
+    if screen is not None and screen.decided:
+        insurance_rebuttal = screen.insurance_rebuttal()
+        judge_decision = screen.judge_decision()
+    else:
+        reviewed_claim = screen.annotate(generated_claim) if screen is not None else generated_claim
+        insurance_rebuttal = analyze_claim(backend, reviewed_claim, procedure_code, retries, cache)
+        judge_decision = judge_claim(backend, reviewed_claim, insurance_rebuttal, patient_id, procedure_code, retries, cache)
+    final_decision = parse_final_decision(judge_decision)
+
+    appeal_history = []
+    context_savings = []
+    convergence = None
+    if final_decision == 'DENIED' and not (screen is not None and screen.decided):
+        appeal_inputs = (generated_claim, insurance_rebuttal, judge_decision)
+        digest = None
+        if compact_context:
+            from context_compaction import ContextDigest
+            digest = ContextDigest.build(backend, generated_claim, insurance_rebuttal, judge_decision, procedure_code)
+            appeal_inputs = digest.appeal_inputs()
+        if adaptive_appeals:
+            convergence = AppealConvergence(initial_strength=parse_strength_score(insurance_rebuttal))
+        run_appeals = run_appeals_concurrently if concurrent_appeals else run_appeals_sequential
+        doctor_appeals, insurance_counters = run_appeals(
+            backend, *appeal_inputs, retries=retries, cache=cache, convergence=convergence
+        )
+        appeal_history = appeal_history_from(doctor_appeals, insurance_counters)
+        if digest is not None:
+            context_savings = digest.token_savings(doctor_appeals)
+
+    return {
+        'generated_claim': generated_claim,
+        'insurance_rebuttal': insurance_rebuttal,
+        'judge_decision': judge_decision,
+        'final_decision': final_decision or 'UNPARSEABLE',
+        'appeal_history': appeal_history,
+        'appeal_stop_reason': convergence.stop_reason if convergence is not None else None,
+        'appeal_rounds': convergence.rounds if convergence is not None else [],
+        'context_savings': context_savings,
+        'pre_screen': screen.as_dict() if screen is not None else None,
+    }
+
+
+def run_optimization_iteration(session, session_id, patient_id, procedure_code, clinical_notes,
+                               iteration_number=1, previous_claim=None, previous_rebuttal=None,
+                               previous_strength=None, max_iterations=3):
+    """Run one persisted optimization iteration via RUN_OPTIMIZATION_ITERATION (notebook 06).
+
+    The procedure makes exactly one Builder and one Insurance call, derives the
+    score, convergence status and recommendation from that single rebuttal, and
+    writes one OPTIMIZATION_SESSIONS row. Optimization iterations send a compact
+    rebuttal digest; context_tokens_saved in the result estimates the savings.
+    """
+    result = session.call(
+        f"{AGENT_SCHEMA}.RUN_OPTIMIZATION_ITERATION",
+        session_id, patient_id, procedure_code, clinical_notes, iteration_number,
+        previous_claim, previous_rebuttal, previous_strength, max_iterations
+    )
+    return json.loads(result) if isinstance(result, str) else result
+
+
+# ---------------------------------------------------------------------------
+# Headless session helpers
+# ---------------------------------------------------------------------------
+
+def load_connection_config(config_file="config.toml", connection="healthcare_claims_demo"):
+    """Read a Snowflake CLI connection from config.toml as Snowpark session parameters"""
+    with open(config_file, "rb") as fh:
+        params = dict(tomllib.load(fh)["connections"][connection])
+    if "private_key_path" in params:
+        params["private_key_file"] = params.pop("private_key_path")
+    return params
+
+
+def create_session(config_file="config.toml", connection="healthcare_claims_demo"):
+    """Create a Snowpark session from the same config.toml used by the setup notebooks"""
+    from snowflake.snowpark import Session
+    return Session.builder.configs(load_connection_config(config_file, connection)).create()
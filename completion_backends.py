@@ -0,0 +1,308 @@
+"""
+LLM completion backends for the agent steps.
+
+The orchestration in claims_orchestration.py only talks to a CompletionBackend:
+one method per way of running an agent step (blocking, async, streaming), keyed
+by the agent function name and its arguments. CortexBackend runs the CLAIMS_DEMO
+agent functions in Snowflake; StubBackend replays canned JSON with configurable
+injected latency so the whole loop can be run, profiled and benchmarked offline
+(see benchmark.py).
+"""
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from agent_sql import AgentStatements
+from claims_orchestration import AGENT_MODELS
+
+CANNED_RESPONSES = {
+    "BUILDER_AGENT": {
+        "claim_header": {"claim_id": "CLM-2024-001", "patient_id": "PAT_001", "insurance_provider": "Cigna"},
+        "patient_info": {"first_name": "John", "last_name": "Smith"},
+        "claim_details": {"procedure_codes": ["85025"], "diagnosis_codes": ["E11.9"]},
+        "billing_info": {"total_charges": 75.00},
+    },
+    "BUILDER_AGENT_OPTIMIZE": {
+        "claim_header": {"claim_id": "CLM-2024-001", "patient_id": "PAT_001", "insurance_provider": "Cigna"},
+        "patient_info": {"first_name": "John", "last_name": "Smith"},
+        "claim_details": {
+            "procedure_codes": ["85025"], "diagnosis_codes": ["E11.9", "R53.83"],
+            "medical_necessity_statement": "Diagnostic CBC for new fatigue and suspected anemia in a type 2 diabetic.",
+        },
+        "billing_info": {"total_charges": 75.00},
+    },
+    "INSURANCE_AGENT_WITH_POLICY": {
+        "rebuttal_summary": "Diagnostic CBC lacks documented indication beyond routine monitoring.",
+        "denial_reasons": ["Frequency limit for preventive CBC reached", "Diagnosis code does not establish medical necessity"],
+        "strength_score": 0.45,
+        "policy_citations": ["SECTION 4.1 - LABORATORY SERVICES: Frequency Limits"],
+    },
+    "AI_JUDGE_DECISION": {
+        "final_decision": "DENIED",
+        "reasoning": "Documentation does not yet justify exceeding the preventive frequency limit.",
+        "key_factors": ["Frequency limit", "Medical necessity documentation"],
+        "confidence": 0.7,
+    },
+    "DOCTOR_APPEAL_GENERATOR": {
+        "appeal_summary": "CBC is diagnostic, ordered for diabetes monitoring with new symptoms.",
+        "medical_justification": "Type 2 diabetes with fatigue and suspected anemia requires a diagnostic CBC.",
+        "additional_evidence": ["Physician order with E11.9 and R53.83", "Prior HbA1c results"],
+    },
+    "INSURANCE_COUNTER_APPEAL": {
+        "counter_response": "Diagnostic indication documented; frequency limit does not apply to diagnostic testing.",
+        "position_change": "REVERSED",
+        "new_strength_score": 0.85,
+        "final_recommendation": "APPROVE",
+    },
+}
+
+# Typical Cortex completion times per step, used as the stub's default latency
+STUB_LATENCY_SECONDS = {
+    "BUILDER_AGENT": 4.0,
+    "BUILDER_AGENT_OPTIMIZE": 5.0,
+    "INSURANCE_AGENT_WITH_POLICY": 5.0,
+    "AI_JUDGE_DECISION": 4.0,
+    "DOCTOR_APPEAL_GENERATOR": 5.0,
+    "INSURANCE_COUNTER_APPEAL": 4.0,
+}
+
+
+class CompletionBackend:
+    """Interface for running agent steps.
+
+    complete() is the only method a backend must implement. submit() and stream()
+    default to running complete() on a worker thread and yielding its result in
+    one chunk. session is the Snowpark session for database lookups (policy
+    context), or None for offline backends.
+    """
+
+    name = "backend"
+    session = None
+    _executor = None
+    _executor_lock = threading.Lock()
+
+    def complete(self, function_name, args):
+        """Run one agent step and return its text output"""
+        raise NotImplementedError
+
+    def _run_async(self, call, *args):
+        with CompletionBackend._executor_lock:
+            if CompletionBackend._executor is None:
+                CompletionBackend._executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="agent")
+        return FutureJob(CompletionBackend._executor.submit(call, *args))
+
+    def submit(self, function_name, args):
+        """Start one agent step; returns a job with is_done() and result()"""
+        return self._run_async(self.complete, function_name, args)
+
+    def stream(self, function_name, args):
+        """Yield the step's output in chunks as it is generated"""
+        yield self.complete(function_name, args)
+
+    def model_for(self, function_name):
+        """The model this backend runs the step on by default"""
+        return AGENT_MODELS.get(function_name)
+
+    def complete_model(self, function_name, args, model):
+        """complete() on a specific model (see model_router.py). Backends that cannot
+        choose the model run the step as is."""
+        return self.complete(function_name, args)
+
+    def submit_model(self, function_name, args, model):
+        """submit() on a specific model"""
+        if model == self.model_for(function_name):
+            return self.submit(function_name, args)
+        return self._run_async(self.complete_model, function_name, args, model)
+
+    def stream_model(self, function_name, args, model):
+        """stream() on a specific model"""
+        return self.stream(function_name, args)
+
+    def complete_with_correction(self, function_name, args, correction, model=None):
+        """Re-run one step whose previous output broke its contract; correction is
+        appended to the step's prompt. Backends that cannot change the prompt re-run as is."""
+        return self.complete_model(function_name, args, model) if model else self.complete(function_name, args)
+
+    def on_cache_hit(self, function_name, args, response, model=None):
+        """Called when a step is answered from the response cache instead of this backend;
+        model is the model the cached response was stored under"""
+
+
+class FutureJob:
+    """Adapts a concurrent.futures.Future to the is_done()/result() job protocol"""
+
+    def __init__(self, future):
+        self.future = future
+
+    def is_done(self):
+        return self.future.done()
+
+    def result(self):
+        return self.future.result()
+
+    def cancel(self):
+        self.future.cancel()
+
+
+class ObservedJob:
+    """Wraps a job and calls on_finish(response, error, elapsed_seconds) once, the first
+    time it is seen finished (is_done() returning True or result() returning/raising)"""
+
+    def __init__(self, job, on_finish, started=None):
+        self.job = job
+        self.on_finish = on_finish
+        self.started = started if started is not None else time.perf_counter()
+        self.finished_at = None
+        self.reported = False
+
+    def is_done(self):
+        done = self.job.is_done()
+        if done and self.finished_at is None:
+            self.finished_at = time.perf_counter()
+        return done
+
+    def result(self):
+        try:
+            response = self.job.result()
+        except Exception as e:
+            self._report(None, e)
+            raise
+        self._report(response, None)
+        return response
+
+    def _report(self, response, error):
+        if self.reported:
+            return
+        self.reported = True
+        finished_at = self.finished_at or time.perf_counter()
+        self.on_finish(response, error, finished_at - self.started)
+
+    def cancel(self):
+        if hasattr(self.job, "cancel"):
+            self.job.cancel()
+
+
+class CortexJob:
+    """A Snowpark async query for one agent function call"""
+
+    def __init__(self, async_job, alias):
+        self.async_job = async_job
+        self.alias = alias
+
+    def is_done(self):
+        return self.async_job.is_done()
+
+    def result(self):
+        return self.async_job.result()[0][self.alias]
+
+    def cancel(self):
+        self.async_job.cancel()
+
+
+class CortexBackend(CompletionBackend):
+    """Runs the CLAIMS_DEMO agent functions (SNOWFLAKE.CORTEX.COMPLETE) in Snowflake.
+
+    Calls go through agent_sql.AgentStatements (bind parameters, one statement
+    shape per function); statement_timings() reports compile vs. execute time
+    for the calls made through this backend.
+    """
+
+    name = "cortex"
+
+    def __init__(self, session):
+        self.session = session
+        self.statements = AgentStatements(session)
+
+    def complete(self, function_name, args):
+        return self.statements.run(function_name, args)
+
+    def submit(self, function_name, args):
+        return CortexJob(self.statements.submit(function_name, args), self.statements.alias)
+
+    def statement_timings(self, since=None):
+        return self.statements.timings(since)
+
+    # Each agent function has an overload taking the model as its last argument, so a
+    # step routed to another model still runs the function's own prompt
+    def complete_model(self, function_name, args, model):
+        if model == self.model_for(function_name):
+            return self.complete(function_name, args)
+        return self.statements.run_model(function_name, args, model)
+
+    def submit_model(self, function_name, args, model):
+        if model == self.model_for(function_name):
+            return self.submit(function_name, args)
+        return CortexJob(self.statements.submit_model(function_name, args, model), self.statements.alias)
+
+    def complete_with_correction(self, function_name, args, correction, model=None):
+        # The function's prompt (FN_PROMPT) with the correction appended goes to COMPLETE directly
+        prompt = self.statements.prompt(function_name, args)
+        return self.statements.complete_prompt(function_name, model or AGENT_MODELS[function_name],
+                                               f"{prompt}\n\n{correction}")
+
+    def stream(self, function_name, args):
+        return self.stream_model(function_name, args, AGENT_MODELS[function_name])
+
+    def stream_model(self, function_name, args, model):
+        # The SQL functions only return finished completions, so streaming fetches the
+        # function's prompt (FN_PROMPT) and sends it to the streaming Complete API
+        from snowflake.cortex import Complete
+        prompt = self.statements.prompt(function_name, args)
+        return Complete(model, prompt, session=self.session, stream=True)
+
+
+class StubBackend(CompletionBackend):
+    """Deterministic offline backend that replays canned JSON responses.
+
+    latency_seconds is a number or a per-function dict (defaults to typical Cortex
+    timings); jitter adds +/- that fraction of random variation from a seeded RNG,
+    so runs with the same seed sleep for the same sequence of durations.
+    """
+
+    name = "stub"
+
+    def __init__(self, responses=None, latency_seconds=None, jitter=0.0, seed=0,
+                 chunk_size=12, first_token_fraction=0.1):
+        self.responses = {
+            name: body if isinstance(body, str) else json.dumps(body)
+            for name, body in (responses or CANNED_RESPONSES).items()
+        }
+        self.latency_seconds = STUB_LATENCY_SECONDS if latency_seconds is None else latency_seconds
+        self.jitter = jitter
+        self.chunk_size = chunk_size
+        self.first_token_fraction = first_token_fraction
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def latency_for(self, function_name):
+        if isinstance(self.latency_seconds, dict):
+            base = self.latency_seconds.get(function_name, 0.0)
+        else:
+            base = self.latency_seconds
+        if not self.jitter:
+            return base
+        with self._lock:
+            factor = 1 + self._random.uniform(-self.jitter, self.jitter)
+        return max(0.0, base * factor)
+
+    def response_for(self, function_name):
+        if function_name not in self.responses:
+            raise ValueError(f"StubBackend has no canned response for {function_name}")
+        return self.responses[function_name]
+
+    def complete(self, function_name, args):
+        time.sleep(self.latency_for(function_name))
+        return self.response_for(function_name)
+
+    def stream(self, function_name, args):
+        text = self.response_for(function_name)
+        latency = self.latency_for(function_name)
+        chunks = [text[start:start + self.chunk_size] for start in range(0, len(text), self.chunk_size)]
+        time.sleep(latency * self.first_token_fraction)
+        chunk_delay = latency * (1 - self.first_token_fraction) / max(len(chunks) - 1, 1)
+        for index, chunk in enumerate(chunks):
+            if index:
+                time.sleep(chunk_delay)
+            yield chunk
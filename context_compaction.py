@@ -0,0 +1,132 @@
+"""
+Context compaction for the appeal rounds.
+
+Every appeal call used to re-send the full generated claim, the full insurance
+rebuttal and the full judge decision, and every counter-appeal the full
+rebuttal again. ContextDigest is built once per claim after the judge step and
+keeps only what the appeal agents argue about: key claim fields, the denial
+reasons and policy citations, the judge's decision and key factors, and the one
+policy section that governs the procedure (POLICY_CODE_INDEX rank 1). Appeal
+calls then receive the digest plus their per-round delta (the doctor appeal a
+counter-appeal answers), so prompt size stays flat across rounds.
+
+token_savings() estimates, per round, the prompt tokens the digest saved
+compared to sending the full context.
+"""
+import json
+
+from agent_prompts import build_prompt, estimate_tokens, policy_section
+
+MAX_POLICY_CHARS = 1500
+MAX_SUMMARY_CHARS = 400
+
+CLAIM_HEADER_FIELDS = ["claim_id", "patient_id", "insurance_provider"]
+CLAIM_DETAIL_FIELDS = ["procedure_codes", "diagnosis_codes", "medical_necessity", "clinical_justification"]
+
+
+def _parse(text):
+    try:
+        value = json.loads(text) if isinstance(text, str) else text
+    except (json.JSONDecodeError, TypeError):
+        return None
+    return value if isinstance(value, dict) else None
+
+
+def _truncate(text, limit):
+    text = " ".join(str(text).split())
+    return text if len(text) <= limit else text[:limit - 3].rstrip() + "..."
+
+
+def _compact_json(value):
+    return json.dumps(value, separators=(",", ":"))
+
+
+def claim_digest(generated_claim):
+    """Key claim fields only: header IDs, codes, necessity text and total charges"""
+    claim = _parse(generated_claim)
+    if claim is None:
+        return {'claim_text': _truncate(generated_claim or "", MAX_SUMMARY_CHARS)}
+    header = claim.get('claim_header') or {}
+    details = claim.get('claim_details') or {}
+    billing = claim.get('billing_info') or {}
+    digest = {field: header[field] for field in CLAIM_HEADER_FIELDS if header.get(field)}
+    for field in CLAIM_DETAIL_FIELDS:
+        value = details.get(field)
+        if value:
+            digest[field] = _truncate(value, MAX_SUMMARY_CHARS) if isinstance(value, str) else value
+    if billing.get('total_charges') is not None:
+        digest['total_charges'] = billing['total_charges']
+    return digest
+
+
+def rebuttal_digest(insurance_rebuttal, policy_text=""):
+    """Denial reasons, policy citations and score, plus the governing policy section"""
+    rebuttal = _parse(insurance_rebuttal)
+    if rebuttal is None:
+        digest = {'rebuttal_text': _truncate(insurance_rebuttal or "", MAX_SUMMARY_CHARS)}
+    else:
+        digest = {
+            'rebuttal_summary': _truncate(rebuttal.get('rebuttal_summary', ""), MAX_SUMMARY_CHARS),
+            'denial_reasons': rebuttal.get('denial_reasons') or [],
+            'policy_citations': rebuttal.get('policy_citations') or [],
+            'strength_score': rebuttal.get('strength_score'),
+        }
+    if policy_text:
+        digest['relevant_policy'] = _truncate(policy_text, MAX_POLICY_CHARS)
+    return digest
+
+
+def judge_digest(judge_decision):
+    """Decision, key factors and a shortened reasoning"""
+    judge = _parse(judge_decision)
+    if judge is None:
+        return {'judge_text': _truncate(judge_decision or "", MAX_SUMMARY_CHARS)}
+    return {
+        'final_decision': judge.get('final_decision'),
+        'key_factors': judge.get('key_factors') or [],
+        'reasoning': _truncate(judge.get('reasoning', ""), MAX_SUMMARY_CHARS),
+    }
+
+
+class ContextDigest:
+    """Compact appeal context for one claim, built once after the judge step"""
+
+    def __init__(self, generated_claim, insurance_rebuttal, judge_decision, policy_text=""):
+        self.full_claim = generated_claim
+        self.full_rebuttal = insurance_rebuttal
+        self.full_judge = judge_decision
+        self.claim = _compact_json(claim_digest(generated_claim))
+        self.rebuttal = _compact_json(rebuttal_digest(insurance_rebuttal, policy_text))
+        self.judge = _compact_json(judge_digest(judge_decision))
+
+    @classmethod
+    def build(cls, backend, generated_claim, insurance_rebuttal, judge_decision, procedure_code):
+        """Digest with the procedure's policy section when the backend has a session"""
+        session = getattr(backend, "session", None)
+        return cls(generated_claim, insurance_rebuttal, judge_decision, policy_section(session, procedure_code))
+
+    def appeal_inputs(self):
+        """(claim, rebuttal, judge decision) to pass to the appeal rounds"""
+        return self.claim, self.rebuttal, self.judge
+
+    def token_savings(self, doctor_appeals):
+        """Per-round estimated prompt tokens with full context vs. the digest"""
+        rounds = []
+        for round_num in sorted(doctor_appeals):
+            doctor_appeal = doctor_appeals[round_num]
+            full = estimate_tokens(
+                len(build_prompt("DOCTOR_APPEAL_GENERATOR", [self.full_claim, self.full_rebuttal, self.full_judge, round_num]))
+                + len(build_prompt("INSURANCE_COUNTER_APPEAL", [doctor_appeal, self.full_rebuttal, round_num]))
+            )
+            compact = estimate_tokens(
+                len(build_prompt("DOCTOR_APPEAL_GENERATOR", [self.claim, self.rebuttal, self.judge, round_num]))
+                + len(build_prompt("INSURANCE_COUNTER_APPEAL", [doctor_appeal, self.rebuttal, round_num]))
+            )
+            rounds.append({
+                'round': round_num,
+                'full_prompt_tokens': full,
+                'compact_prompt_tokens': compact,
+                'saved_tokens': full - compact,
+                'saved_pct': (full - compact) / full if full else 0.0,
+            })
+        return rounds
@@ -12,6 +12,20 @@ CREATE STAGE IF NOT EXISTS CLAIMS_DEMO.PUBLIC.STREAMLIT_STAGE;
 
 -- 3. Upload files to stage (run these commands in SnowSQL or upload via UI)
 -- PUT file://streamlit_app.py @CLAIMS_DEMO.PUBLIC.STREAMLIT_STAGE overwrite=true;
+-- PUT file://claims_orchestration.py @CLAIMS_DEMO.PUBLIC.STREAMLIT_STAGE overwrite=true;
+-- PUT file://llm_cache.py @CLAIMS_DEMO.PUBLIC.STREAMLIT_STAGE overwrite=true;
+-- PUT file://claims_data.py @CLAIMS_DEMO.PUBLIC.STREAMLIT_STAGE overwrite=true;
+-- PUT file://agent_prompts.py @CLAIMS_DEMO.PUBLIC.STREAMLIT_STAGE overwrite=true;
+-- PUT file://agent_streaming.py @CLAIMS_DEMO.PUBLIC.STREAMLIT_STAGE overwrite=true;
+-- PUT file://completion_backends.py @CLAIMS_DEMO.PUBLIC.STREAMLIT_STAGE overwrite=true;
+-- PUT file://agent_telemetry.py @CLAIMS_DEMO.PUBLIC.STREAMLIT_STAGE overwrite=true;
+-- PUT file://context_compaction.py @CLAIMS_DEMO.PUBLIC.STREAMLIT_STAGE overwrite=true;
+-- PUT file://workflow_jobs.py @CLAIMS_DEMO.PUBLIC.STREAMLIT_STAGE overwrite=true;
+-- PUT file://policy_rules.py @CLAIMS_DEMO.PUBLIC.STREAMLIT_STAGE overwrite=true;
+-- PUT file://agent_sql.py @CLAIMS_DEMO.PUBLIC.STREAMLIT_STAGE overwrite=true;
+-- PUT file://agent_contracts.py @CLAIMS_DEMO.PUBLIC.STREAMLIT_STAGE overwrite=true;
+-- PUT file://model_router.py @CLAIMS_DEMO.PUBLIC.STREAMLIT_STAGE overwrite=true;
+-- PUT file://pages/1_Agent_Latency.py @CLAIMS_DEMO.PUBLIC.STREAMLIT_STAGE/pages/ overwrite=true;
 -- PUT file://requirements.txt @CLAIMS_DEMO.PUBLIC.STREAMLIT_STAGE overwrite=true;
 -- PUT file://environment.yml @CLAIMS_DEMO.PUBLIC.STREAMLIT_STAGE overwrite=true;
 
@@ -0,0 +1,180 @@
+"""
+Persistent response cache for the Cortex agent functions.
+
+Responses are keyed on (function, model, normalized-prompt hash) and stored in
+CLAIMS_DEMO.PUBLIC.LLM_RESPONSE_CACHE (see notebook 06), so resubmitted claims,
+Streamlit reruns and repeated procedure/notes templates skip SNOWFLAKE.CORTEX.COMPLETE
+entirely. A small in-process LRU sits in front of the table so repeat requests in
+the same app/worker process don't need a round trip at all.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+CACHE_TABLE = "CLAIMS_DEMO.PUBLIC.LLM_RESPONSE_CACHE"
+EVICT_PROCEDURE = "CLAIMS_DEMO.PUBLIC.EVICT_LLM_RESPONSE_CACHE"
+
+DEFAULT_TTL_SECONDS = 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_LOCAL_ENTRIES = 256
+DEFAULT_EVICT_EVERY = 100
+
+
+def normalize_prompt(args):
+    """Canonical text for an agent call's inputs.
+
+    JSON arguments are re-serialized with sorted keys and free text has its
+    whitespace collapsed, so formatting-only differences hit the same entry.
+    """
+    normalized = []
+    for arg in args:
+        if isinstance(arg, str):
+            try:
+                arg = json.dumps(json.loads(arg), sort_keys=True, separators=(",", ":"))
+            except (json.JSONDecodeError, TypeError):
+                arg = " ".join(arg.split())
+        normalized.append(arg)
+    return json.dumps(normalized, separators=(",", ":"))
+
+
+def prompt_hash(args):
+    return hashlib.sha256(normalize_prompt(args).encode("utf-8")).hexdigest()
+
+
+def cache_key(function_name, model_name, args):
+    return hashlib.sha256(
+        f"{function_name}|{model_name}|{prompt_hash(args)}".encode("utf-8")
+    ).hexdigest()
+
+
+class LLMResponseCache:
+    """Table-backed LLM response cache with TTL, LRU eviction and hit/miss counters"""
+
+    def __init__(self, session, ttl_seconds=DEFAULT_TTL_SECONDS, max_entries=DEFAULT_MAX_ENTRIES,
+                 local_entries=DEFAULT_LOCAL_ENTRIES, evict_every=DEFAULT_EVICT_EVERY, enabled=True):
+        self.session = session
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.local_entries = local_entries
+        self.evict_every = evict_every
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._writes_since_evict = 0
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+
+    # -- local LRU ---------------------------------------------------------
+
+    def _local_get(self, key):
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is None:
+                return None
+            response, stored_at = entry
+            if time.monotonic() - stored_at > self.ttl_seconds:
+                del self._local[key]
+                return None
+            self._local.move_to_end(key)
+            return response
+
+    def _local_put(self, key, response):
+        with self._lock:
+            self._local[key] = (response, time.monotonic())
+            self._local.move_to_end(key)
+            while len(self._local) > self.local_entries:
+                self._local.popitem(last=False)
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    # -- public API --------------------------------------------------------
+
+    def get(self, function_name, model_name, args, bypass=False):
+        """Return the cached response for this call, or None on a miss"""
+        if not self.enabled or bypass:
+            return None
+        key = cache_key(function_name, model_name, args)
+
+        response = self._local_get(key)
+        if response is not None:
+            self._count(hit=True)
+            return response
+
+        rows = self.session.sql(f"""
+            SELECT RESPONSE FROM {CACHE_TABLE}
+            WHERE CACHE_KEY = ?
+              AND CREATED_AT >= DATEADD(second, -{int(self.ttl_seconds)}, CURRENT_TIMESTAMP())
+        """, params=[key]).collect()
+        if not rows:
+            self._count(hit=False)
+            return None
+
+        response = rows[0]['RESPONSE']
+        self._count(hit=True)
+        self._local_put(key, response)
+        # Recency update for LRU eviction; nothing waits on it
+        self.session.sql(f"""
+            UPDATE {CACHE_TABLE}
+            SET LAST_ACCESSED = CURRENT_TIMESTAMP(), HIT_COUNT = HIT_COUNT + 1
+            WHERE CACHE_KEY = ?
+        """, params=[key]).collect_nowait()
+        return response
+
+    def put(self, function_name, model_name, args, response, bypass=False):
+        """Store a successful response"""
+        if not self.enabled or bypass or not response:
+            return
+        key = cache_key(function_name, model_name, args)
+        self._local_put(key, response)
+        self.session.sql(f"""
+            MERGE INTO {CACHE_TABLE} c
+            USING (SELECT ? as CACHE_KEY, ? as FUNCTION_NAME, ? as MODEL_NAME, ? as PROMPT_HASH, ? as RESPONSE) s
+                ON c.CACHE_KEY = s.CACHE_KEY
+            WHEN MATCHED THEN UPDATE SET
+                RESPONSE = s.RESPONSE,
+                CREATED_AT = CURRENT_TIMESTAMP(),
+                LAST_ACCESSED = CURRENT_TIMESTAMP()
+            WHEN NOT MATCHED THEN INSERT
+                (CACHE_KEY, FUNCTION_NAME, MODEL_NAME, PROMPT_HASH, RESPONSE, CREATED_AT, LAST_ACCESSED, HIT_COUNT)
+            VALUES (
+                s.CACHE_KEY, s.FUNCTION_NAME, s.MODEL_NAME, s.PROMPT_HASH, s.RESPONSE,
+                CURRENT_TIMESTAMP(), CURRENT_TIMESTAMP(), 0
+            )
+        """, params=[key, function_name, model_name, prompt_hash(args), response]).collect()
+
+        with self._lock:
+            self._writes_since_evict += 1
+            evict_now = self._writes_since_evict >= self.evict_every
+            if evict_now:
+                self._writes_since_evict = 0
+        if evict_now:
+            self.evict(wait=False)
+
+    def evict(self, wait=True):
+        """Drop expired entries and trim the table to max_entries by least recent access"""
+        query = self.session.sql(
+            f"CALL {EVICT_PROCEDURE}({int(self.max_entries)}, {int(self.ttl_seconds)})"
+        )
+        return query.collect() if wait else query.collect_nowait()
+
+    def clear_local(self):
+        with self._lock:
+            self._local.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'local_entries': len(self._local),
+            }
@@ -0,0 +1,258 @@
+"""
+Per-step model routing with latency budgets.
+
+ModelRouter reads a route per agent step from CORTEX_AGENTS_REGISTRY
+(FUNCTION_NAME, MODEL_NAME, FALLBACK_MODEL, LATENCY_BUDGET_MS; notebook 06,
+Step 13). Steps missing from the registry use DEFAULT_ROUTES, the same tiers as
+the registry seed: a small model for counter-appeal drafting, a stronger one for
+the judge, arctic for the rest, each with a faster fallback. (The SQL-only
+GENERATE_PROVIDER_RECOMMENDATION function is never called from Python; it reads
+its registry row itself.)
+
+RoutedBackend wraps a CompletionBackend and runs each step on its routed model
+(CompletionBackend.submit_model). A route to a different model calls the SQL
+function's overload with the model as its last argument, so every model gets
+the same prompt (the function's FN_PROMPT). A route with a fallback model and a
+latency budget races the fallback once the budget is used up and takes
+whichever answers first; the other call is cancelled. Each call's chosen model, latency and whether the
+fallback was used is logged and kept in ModelRouter.calls (and in
+AGENT_INTERACTIONS.MODEL_NAME when telemetry is on).
+"""
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+
+from claims_orchestration import AGENT_SCHEMA
+from completion_backends import CompletionBackend
+
+REGISTRY_TABLE = f"{AGENT_SCHEMA}.CORTEX_AGENTS_REGISTRY"
+ROUTE_POLL_SECONDS = 0.05
+DEFAULT_LOG_SIZE = 2000
+
+# function name: (model, fallback model, latency budget ms); mirrors the registry seed in notebook 06.
+# Small models for the drafting steps, a stronger one for the judge, a faster fallback everywhere
+DEFAULT_ROUTES = {
+    "BUILDER_AGENT": ("snowflake-arctic", "llama3.1-8b", 8000),
+    "BUILDER_AGENT_OPTIMIZE": ("snowflake-arctic", "llama3.1-8b", 10000),
+    "INSURANCE_AGENT_WITH_POLICY": ("snowflake-arctic", "llama3.1-8b", 8000),
+    "AI_JUDGE_DECISION": ("mistral-large2", "snowflake-arctic", 12000),
+    "DOCTOR_APPEAL_GENERATOR": ("snowflake-arctic", "llama3.1-8b", 8000),
+    "INSURANCE_COUNTER_APPEAL": ("llama3.1-8b", "mistral-7b", 4000),
+}
+
+logger = logging.getLogger("model_router")
+
+
+class ModelRoute:
+    """Model, fallback model and latency budget for one agent step"""
+
+    def __init__(self, function_name, model, fallback_model=None, latency_budget_ms=None):
+        self.function_name = function_name
+        self.model = model
+        self.fallback_model = fallback_model
+        self.latency_budget_ms = latency_budget_ms
+
+    @property
+    def hedged(self):
+        """True when a slow call is raced against the fallback model"""
+        return bool(self.fallback_model and self.fallback_model != self.model and self.latency_budget_ms)
+
+    def as_dict(self):
+        return {
+            'function_name': self.function_name,
+            'model': self.model,
+            'fallback_model': self.fallback_model,
+            'latency_budget_ms': self.latency_budget_ms,
+        }
+
+
+class ModelRouter:
+    """Routes per agent function, plus a log of every routed call"""
+
+    def __init__(self, routes, log_size=DEFAULT_LOG_SIZE):
+        self.routes = {route.function_name: route for route in routes}
+        self.calls = deque(maxlen=log_size)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def defaults(cls):
+        return cls([ModelRoute(name, *route) for name, route in DEFAULT_ROUTES.items()])
+
+    @classmethod
+    def load(cls, session):
+        """Routes from the active registry rows (one small query), defaults for the rest"""
+        rows = session.sql(f"""
+            SELECT FUNCTION_NAME, MODEL_NAME, FALLBACK_MODEL, LATENCY_BUDGET_MS
+            FROM {REGISTRY_TABLE}
+            WHERE STATUS = 'ACTIVE' AND FUNCTION_NAME IS NOT NULL AND MODEL_NAME IS NOT NULL
+            QUALIFY ROW_NUMBER() OVER (PARTITION BY FUNCTION_NAME ORDER BY CREATED_DATE DESC) = 1
+        """).collect()
+        routes = {name: ModelRoute(name, *route) for name, route in DEFAULT_ROUTES.items()}
+        for row in rows:
+            routes[row['FUNCTION_NAME']] = ModelRoute(
+                row['FUNCTION_NAME'], row['MODEL_NAME'], row['FALLBACK_MODEL'], row['LATENCY_BUDGET_MS']
+            )
+        return cls(routes.values())
+
+    def route_for(self, function_name):
+        return self.routes.get(function_name)
+
+    def record(self, route, model, elapsed_seconds, fell_back=False, error=None):
+        call = {
+            'function_name': route.function_name,
+            'model': model,
+            'routed_model': route.model,
+            'fell_back': fell_back,
+            'latency_ms': round(elapsed_seconds * 1000, 1),
+            'latency_budget_ms': route.latency_budget_ms,
+            'status': 'ERROR' if error is not None else 'SUCCESS',
+            'started': time.perf_counter() - elapsed_seconds,
+        }
+        with self._lock:
+            self.calls.append(call)
+        logger.info(
+            "%s -> %s in %.0f ms%s%s%s", route.function_name, model, call['latency_ms'],
+            f" (budget {route.latency_budget_ms} ms)" if route.latency_budget_ms else "",
+            f", fell back from {route.model}" if fell_back else "",
+            f", failed: {error}" if error is not None else ""
+        )
+        return call
+
+    def recent_calls(self, since=None):
+        """Logged calls, optionally only those started at or after a perf_counter() mark"""
+        with self._lock:
+            calls = list(self.calls)
+        return [call for call in calls if since is None or call['started'] >= since]
+
+    def summary(self, since=None):
+        """Per step and model: calls, fallbacks, p50/p95 latency and calls over budget"""
+        from benchmark import percentile  # not on the Streamlit stage; the app only uses recent_calls()
+        groups = defaultdict(list)
+        for call in self.recent_calls(since):
+            groups[(call['function_name'], call['model'])].append(call)
+        return [
+            {
+                'function_name': function_name,
+                'model': model,
+                'calls': len(calls),
+                'fallbacks': sum(call['fell_back'] for call in calls),
+                'p50_ms': percentile([call['latency_ms'] for call in calls], 50),
+                'p95_ms': percentile([call['latency_ms'] for call in calls], 95),
+                'over_budget': sum(
+                    1 for call in calls
+                    if call['latency_budget_ms'] and call['latency_ms'] > call['latency_budget_ms']
+                ),
+            }
+            for (function_name, model), calls in sorted(groups.items())
+        ]
+
+
+class RoutedJob:
+    """One routed agent call: the routed model, raced against the fallback once over budget"""
+
+    def __init__(self, router, backend, function_name, args, route):
+        self.router = router
+        self.backend = backend
+        self.function_name = function_name
+        self.args = args
+        self.route = route
+        self.started = time.perf_counter()
+        self.jobs = [(route.model, backend.submit_model(function_name, args, route.model))]
+        self.winner = None
+        self.reported = False
+
+    def _over_budget(self):
+        return (time.perf_counter() - self.started) * 1000 > self.route.latency_budget_ms
+
+    def is_done(self):
+        if self.winner is not None:
+            return True
+        for model, job in self.jobs:
+            if job.is_done():
+                self.winner = (model, job)
+                return True
+        if len(self.jobs) == 1 and self.route.hedged and self._over_budget():
+            fallback = self.route.fallback_model
+            self.jobs.append((fallback, self.backend.submit_model(self.function_name, self.args, fallback)))
+        return False
+
+    def result(self):
+        while not self.is_done():
+            time.sleep(ROUTE_POLL_SECONDS)
+        model, job = self.winner
+        for _, other in self.jobs:
+            if other is not job and hasattr(other, "cancel"):
+                other.cancel()
+        try:
+            response = job.result()
+        except Exception as e:
+            self._report(model, e)
+            raise
+        self._report(model, None)
+        return response
+
+    def _report(self, model, error):
+        if self.reported:
+            return
+        self.reported = True
+        self.router.record(self.route, model, time.perf_counter() - self.started,
+                           fell_back=model != self.route.model, error=error)
+
+
+class RoutedBackend(CompletionBackend):
+    """CompletionBackend wrapper that runs each agent step on its routed model"""
+
+    def __init__(self, backend, router):
+        self.backend = backend
+        self.router = router
+        self.name = getattr(backend, "name", "backend")
+        self.session = getattr(backend, "session", None)
+
+    def model_for(self, function_name):
+        route = self.router.route_for(function_name)
+        return route.model if route is not None else self.backend.model_for(function_name)
+
+    def submit(self, function_name, args):
+        route = self.router.route_for(function_name)
+        if route is None:
+            return self.backend.submit(function_name, args)
+        return RoutedJob(self.router, self.backend, function_name, args, route)
+
+    def complete(self, function_name, args):
+        route = self.router.route_for(function_name)
+        if route is None:
+            return self.backend.complete(function_name, args)
+        if route.hedged:
+            return RoutedJob(self.router, self.backend, function_name, args, route).result()
+        # No fallback to race: a plain blocking call, no polling
+        started = time.perf_counter()
+        try:
+            response = self.backend.complete_model(function_name, args, route.model)
+        except Exception as e:
+            self.router.record(route, route.model, time.perf_counter() - started, error=e)
+            raise
+        self.router.record(route, route.model, time.perf_counter() - started)
+        return response
+
+    def stream(self, function_name, args):
+        # Tokens are already on screen once a stream starts, so streams are routed but never raced
+        route = self.router.route_for(function_name)
+        if route is None:
+            yield from self.backend.stream(function_name, args)
+            return
+        started = time.perf_counter()
+        try:
+            yield from self.backend.stream_model(function_name, args, route.model)
+        except Exception as e:
+            self.router.record(route, route.model, time.perf_counter() - started, error=e)
+            raise
+        self.router.record(route, route.model, time.perf_counter() - started)
+
+    def complete_with_correction(self, function_name, args, correction, model=None):
+        return self.backend.complete_with_correction(function_name, args, correction,
+                                                     model=model or self.model_for(function_name))
+
+    def on_cache_hit(self, function_name, args, response, model=None):
+        self.backend.on_cache_hit(function_name, args, response, model=model or self.model_for(function_name))
+
@@ -0,0 +1,119 @@
+import streamlit as st
+import plotly.express as px
+from snowflake.snowpark.context import get_active_session
+
+import agent_sql
+import agent_telemetry
+
+session = get_active_session()
+
+st.set_page_config(
+    page_title="Agent Latency",
+    page_icon="📈",
+    layout="wide"
+)
+
+st.title("📈 Agent Latency & Reliability")
+st.markdown("Per-step timing, token estimates and failure rates for every agent call, from `AGENT_INTERACTIONS`.")
+
+WINDOWS = {"Last hour": 1, "Last 24 hours": 24, "Last 7 days": 24 * 7, "Last 30 days": 24 * 30}
+window_label = st.selectbox("Time window:", list(WINDOWS), index=1)
+hours = WINDOWS[window_label]
+
+
+@st.cache_data(ttl=60)
+def load_dashboard(hours):
+    return (
+        agent_telemetry.step_latency_summary(session, hours),
+        agent_telemetry.latency_over_time(session, hours),
+        agent_telemetry.slowest_calls(session, hours),
+    )
+
+
+@st.cache_data(ttl=60)
+def load_statement_timings(hours):
+    return agent_sql.compile_execute_summary(session, hours)
+
+
+if st.button("🔄 Refresh"):
+    load_dashboard.clear()
+    load_statement_timings.clear()
+
+summary, over_time, slowest = load_dashboard(hours)
+
+if summary.empty:
+    st.info("No agent calls recorded in this window yet. Run a claim with **Record agent telemetry** enabled.")
+    st.stop()
+
+total_calls = int(summary['CALLS'].sum())
+metric_cols = st.columns(4)
+with metric_cols[0]:
+    st.metric("🤖 Agent Calls", f"{total_calls:,}")
+with metric_cols[1]:
+    st.metric("⏱️ Slowest Step (p95)", summary.loc[summary['P95_MS'].idxmax(), 'AGENT_TYPE'],
+              f"{summary['P95_MS'].max() / 1000:.1f}s", delta_color="off")
+with metric_cols[2]:
+    failure_rate = (summary['FAILURE_RATE'] * summary['CALLS']).sum() / total_calls
+    st.metric("❌ Failure Rate", f"{failure_rate:.1%}")
+with metric_cols[3]:
+    cache_rate = (summary['CACHE_HIT_RATE'] * summary['CALLS']).sum() / total_calls
+    st.metric("💾 Cache Hit Rate", f"{cache_rate:.1%}")
+
+st.markdown("---")
+st.subheader("⏱️ Latency by Step")
+chart_cols = st.columns(2)
+with chart_cols[0]:
+    percentiles = summary.melt(id_vars='AGENT_TYPE', value_vars=['P50_MS', 'P95_MS', 'P99_MS'],
+                               var_name='Percentile', value_name='Milliseconds')
+    fig_latency = px.bar(percentiles, x='AGENT_TYPE', y='Milliseconds', color='Percentile', barmode='group',
+                         title="Latency Percentiles (Cortex calls, cache hits excluded)")
+    st.plotly_chart(fig_latency, use_container_width=True)
+with chart_cols[1]:
+    fig_share = px.pie(summary, values='TOTAL_SECONDS', names='AGENT_TYPE', title="Share of Total Agent Time")
+    st.plotly_chart(fig_share, use_container_width=True)
+
+st.dataframe(
+    summary.rename(columns={
+        'AGENT_TYPE': 'Step', 'CALLS': 'Calls', 'P50_MS': 'p50 (ms)', 'P95_MS': 'p95 (ms)', 'P99_MS': 'p99 (ms)',
+        'TOTAL_SECONDS': 'Total (s)', 'SHARE_OF_TIME': 'Share of Time', 'CORTEX_TOKENS': 'Est. Cortex Tokens',
+        'CACHE_HIT_RATE': 'Cache Hit Rate', 'FAILURE_RATE': 'Failure Rate',
+    }),
+    use_container_width=True,
+    hide_index=True
+)
+
+st.markdown("---")
+st.subheader("📉 Over Time")
+time_cols = st.columns(2)
+with time_cols[0]:
+    fig_p95 = px.line(over_time, x='HOUR', y='P95_MS', color='AGENT_TYPE', markers=True, title="Hourly p95 Latency (ms)")
+    st.plotly_chart(fig_p95, use_container_width=True)
+with time_cols[1]:
+    fig_failures = px.line(over_time, x='HOUR', y='FAILURE_RATE', color='AGENT_TYPE', markers=True, title="Hourly Failure Rate")
+    fig_failures.update_yaxes(tickformat=".0%")
+    st.plotly_chart(fig_failures, use_container_width=True)
+
+st.markdown("---")
+st.subheader("🐢 Slowest Calls")
+st.dataframe(slowest, use_container_width=True, hide_index=True)
+
+st.markdown("---")
+st.subheader("🧩 Compile vs. Execute")
+st.markdown("Warehouse-side split of each bound agent statement (tagged `CLAIMS_AGENT|<function>|<call>`), from query history.")
+statements = load_statement_timings(hours)
+if statements.empty:
+    st.info("No tagged agent statements in this window.")
+else:
+    fig_split = px.bar(statements.melt(id_vars='FUNCTION_NAME', value_vars=['AVG_COMPILE_MS', 'AVG_EXECUTE_MS'],
+                                       var_name='Phase', value_name='Milliseconds'),
+                       x='FUNCTION_NAME', y='Milliseconds', color='Phase', title="Average Compile vs. Execute (ms)")
+    st.plotly_chart(fig_split, use_container_width=True)
+    st.dataframe(
+        statements.rename(columns={
+            'FUNCTION_NAME': 'Function', 'CALLS': 'Calls', 'STATEMENT_SHAPES': 'Distinct SQL Texts',
+            'AVG_COMPILE_MS': 'Avg Compile (ms)', 'P95_COMPILE_MS': 'p95 Compile (ms)',
+            'AVG_EXECUTE_MS': 'Avg Execute (ms)', 'P95_EXECUTE_MS': 'p95 Execute (ms)', 'COMPILE_SHARE': 'Compile Share',
+        }),
+        use_container_width=True,
+        hide_index=True
+    )
@@ -1,9 +1,23 @@
 import streamlit as st
-import json
 import plotly.express as px
 import plotly.graph_objects as go
 from snowflake.snowpark.context import get_active_session
 
+import time
+import uuid
+
+import agent_contracts
+import agent_streaming
+import claims_orchestration as orchestration
+from agent_telemetry import AgentTelemetry, InstrumentedBackend
+from model_router import ModelRouter, RoutedBackend
+from context_compaction import ContextDigest
+from completion_backends import CortexBackend, StubBackend
+from claims_data import ClaimsDataStore
+from llm_cache import LLMResponseCache
+from policy_rules import PolicyRuleEngine
+from workflow_jobs import BackgroundJobRunner, WorkflowJobStore, result_from_steps
+
 # Get the active Snowflake session for Streamlit in Snowflake
 session = get_active_session()
 
@@ -33,6 +47,124 @@ st.sidebar.markdown("""
 8. **Final Decision**
 """)
 
+st.sidebar.markdown("---")
+st.sidebar.title("⚙️ Execution Settings")
+backend_choice = st.sidebar.radio(
+    "LLM backend:",
+    ["Snowflake Cortex", "Offline demo (canned responses)"],
+    help="The offline demo replays canned agent responses with simulated latency, without calling Cortex"
+)
+offline_demo = backend_choice != "Snowflake Cortex"
+agent_backend = StubBackend(latency_seconds=1.0) if offline_demo else CortexBackend(session)
+run_in_background = st.sidebar.checkbox(
+    "🧵 Run as resumable background job",
+    value=True,
+    help="Run the workflow on a background worker and persist every completed step to OPTIMIZATION_SESSIONS. The page polls progress, and an interrupted run resumes from its last completed step. Appeal rounds use the concurrent pipeline when it is enabled, each round persisted as it finishes. With streaming enabled, the run happens in the foreground so tokens can be shown live."
+)
+concurrent_appeals = st.sidebar.checkbox(
+    "⚡ Concurrent appeals pipeline",
+    value=True,
+    help="Submit all doctor appeals at once and start each insurance counter-appeal as soon as its own appeal is ready. With early stopping on, rounds run as async jobs one after another."
+)
+use_response_cache = st.sidebar.checkbox(
+    "💾 Use LLM response cache",
+    value=not offline_demo,
+    disabled=offline_demo,
+    help="Answer identical agent calls from LLM_RESPONSE_CACHE instead of calling Cortex again. Uncheck to bypass the cache and force fresh responses."
+)
+adaptive_appeals = st.sidebar.checkbox(
+    "🛑 Stop appeals once settled",
+    value=True,
+    help="Check each insurance counter-appeal and skip the remaining rounds when the insurer concedes, the claim strength crosses the threshold, or a round brings no improvement"
+)
+compact_context = st.sidebar.checkbox(
+    "🗜️ Compact appeal context",
+    value=True,
+    help="Send appeal rounds a digest of the claim, denial reasons, policy citations and relevant policy section instead of the full agent outputs"
+)
+
+use_prescreen = st.sidebar.checkbox(
+    "🧮 Rule-based pre-screen",
+    value=True,
+    help="Check the claim against CIGNA_POLICY_RULES before the Insurance Agent and Judge. Clear-cut denials (e.g. missing prior authorization) are decided without LLM calls; other claims reach the agents with the triggered rules attached."
+)
+use_model_routing = st.sidebar.checkbox(
+    "🧭 Per-step model routing",
+    value=True,
+    help="Run each agent step on the model configured for it in CORTEX_AGENTS_REGISTRY (small models for drafting steps, a stronger one for the judge) and, for routes with a fallback model, race the fallback when a call exceeds its latency budget"
+)
+stream_output = st.sidebar.checkbox(
+    "📡 Stream agent output",
+    value=False,
+    help="Render each agent's response token by token as it is generated. Appeal rounds are streamed one after another."
+)
+record_telemetry = st.sidebar.checkbox(
+    "📈 Record agent telemetry",
+    value=not offline_demo,
+    disabled=offline_demo,
+    help="Log timing, size, cache and error data for every agent call to AGENT_INTERACTIONS (see the Agent Latency page)"
+)
+# One response cache per app process, shared across reruns and users
+@st.cache_resource
+def get_response_cache():
+    return LLMResponseCache(session)
+
+response_cache = get_response_cache() if use_response_cache and not offline_demo else None
+if response_cache is not None:
+    cache_stats = response_cache.stats()
+    st.sidebar.caption(
+        f"Cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses "
+        f"({cache_stats['hit_rate']:.0%} hit rate)"
+    )
+
+# One telemetry writer per app process; rows are flushed to AGENT_INTERACTIONS in the background
+@st.cache_resource
+def get_telemetry():
+    return AgentTelemetry(session)
+
+telemetry = get_telemetry() if record_telemetry and not offline_demo else None
+
+# Policy rules compiled once per app process; reloaded every 10 minutes to pick up rule changes
+@st.cache_resource(ttl=600)
+def get_rule_engine():
+    return PolicyRuleEngine.load(session)
+
+rule_engine = get_rule_engine() if use_prescreen else None
+
+# Model routes loaded once per app process; reloaded every 10 minutes to pick up registry changes
+@st.cache_resource(ttl=600)
+def get_model_router(offline):
+    return ModelRouter.defaults() if offline else ModelRouter.load(session)
+
+model_router = get_model_router(offline_demo) if use_model_routing else None
+
+# One job runner per app process; jobs keep running across reruns and page refreshes
+@st.cache_resource
+def get_job_runner():
+    return BackgroundJobRunner(WorkflowJobStore(session))
+
+job_runner = get_job_runner()
+JOB_POLL_SECONDS = 1.0
+
+
+def routed(backend):
+    """backend on per-step models when routing is enabled"""
+    return RoutedBackend(backend, model_router) if model_router is not None else backend
+
+
+def job_backend(job_session_id):
+    """The backend a background job runs with, logged under the job's session ID. Left
+    unrouted: run_job routes it if the job's own settings turned routing on"""
+    if telemetry is None:
+        return agent_backend
+    return InstrumentedBackend(agent_backend, telemetry, session_id=job_session_id)
+
+
+def submit_job(job_session_id):
+    """Start or resume a background job; its settings, not this run's toggles, pick the pre-screen and routing"""
+    job_runner.submit(job_session_id, job_backend(job_session_id), cache=response_cache,
+                      rule_engine=rule_engine, router=model_router)
+
 # Initialize session state
 if 'workflow_step' not in st.session_state:
     st.session_state.workflow_step = 1
@@ -48,36 +180,76 @@ if 'final_decision' not in st.session_state:
     st.session_state.final_decision = None
 if 'appeal_history' not in st.session_state:
     st.session_state.appeal_history = []
+if 'context_savings' not in st.session_state:
+    st.session_state.context_savings = []
+if 'appeal_stop_reason' not in st.session_state:
+    st.session_state.appeal_stop_reason = None
+if 'pre_screen' not in st.session_state:
+    st.session_state.pre_screen = None
+if 'statement_timings' not in st.session_state:
+    st.session_state.statement_timings = []
+if 'model_routing' not in st.session_state:
+    st.session_state.model_routing = []
+if 'active_job' not in st.session_state:
+    # The job ID is kept in the URL so a page refresh picks the running job back up
+    st.session_state.active_job = st.experimental_get_query_params().get('job', [None])[0]
 
-# Helper function to load patients
-@st.cache_data
-def load_patients():
-    """Load all Cigna patients from database"""
-    query = "SELECT PATIENT_ID, FIRST_NAME, LAST_NAME, MEDICAL_HISTORY_SUMMARY, INSURANCE_PROVIDER, POLICY_NUMBER FROM CLAIMS_DEMO.PUBLIC.PATIENTS ORDER BY PATIENT_ID"
-    result = session.sql(query).collect()
-    return [(row['PATIENT_ID'], f"{row['FIRST_NAME']} {row['LAST_NAME']}", row['MEDICAL_HISTORY_SUMMARY'], row['POLICY_NUMBER']) 
-            for row in result]
-
-# Helper function to load procedures  
-@st.cache_data
-def load_procedures():
-    """Load common medical procedures"""
-    query = "SELECT PROCEDURE_CODE, PROCEDURE_NAME, CIGNA_COVERAGE_NOTES FROM CLAIMS_DEMO.PUBLIC.COMMON_PROCEDURES ORDER BY PROCEDURE_CODE"
-    result = session.sql(query).collect()
-    return [(row['PROCEDURE_CODE'], row['PROCEDURE_NAME'], row['CIGNA_COVERAGE_NOTES']) for row in result]
+# Data access layer: server-side search plus TTL-cached detail records and statistics,
+# shared across reruns and users
+@st.cache_resource
+def get_data_store():
+    return ClaimsDataStore(session)
+
+data_store = get_data_store()
+if st.sidebar.button("🔄 Refresh patient & procedure data", help="Clear cached searches, records and statistics"):
+    data_store.invalidate()
+
+def paged_selectbox(label, kind, search_fn, format_option, help_text):
+    """Typeahead search box + one page of server-side results + prev/next paging"""
+    page_key = f"{kind}_page"
+    search_key = f"{kind}_search"
+    if page_key not in st.session_state:
+        st.session_state[page_key] = 0
+    
+    search_text = st.text_input(f"🔍 Search {kind}:", key=search_key, placeholder="Type an ID or the start of a name...")
+    if st.session_state.get(f"{search_key}_last") != search_text:
+        # New search text starts again from the first page
+        st.session_state[f"{search_key}_last"] = search_text
+        st.session_state[page_key] = 0
+    
+    results, has_more = search_fn(search_text, st.session_state[page_key])
+    
+    prev_col, page_col, next_col = st.columns([1, 2, 1])
+    with prev_col:
+        if st.button("◀ Previous", key=f"{kind}_prev", disabled=st.session_state[page_key] == 0):
+            st.session_state[page_key] -= 1
+            st.experimental_rerun()
+    with page_col:
+        st.caption(f"Page {st.session_state[page_key] + 1}" + (" (more available)" if has_more else ""))
+    with next_col:
+        if st.button("Next ▶", key=f"{kind}_next", disabled=not has_more):
+            st.session_state[page_key] += 1
+            st.experimental_rerun()
+    
+    if not results:
+        st.info(f"No {kind} match your search")
+        return None
+    return st.selectbox(label, options=[format_option(row) for row in results], help=help_text)
 
 # System Statistics
 st.header("📊 System Statistics")
 
+system_stats = data_store.system_statistics()
+
 # System Statistics with charts
 stat_col1, stat_col2, stat_col3, stat_col4 = st.columns(4)
 
 with stat_col1:
-    st.metric("👥 Patients", "5", help="Cigna members available")
+    st.metric("👥 Patients", f"{system_stats['patients']:,}", help="Cigna members available")
 with stat_col2:
-    st.metric("🏥 Procedures", "8", help="Common procedures loaded")
+    st.metric("🏥 Procedures", f"{system_stats['procedures']:,}", help="Common procedures loaded")
 with stat_col3:
-    st.metric("📋 Policies", "3", help="Cigna policy documents")
+    st.metric("📋 Policies", f"{system_stats['policies']:,}", help="Cigna policy documents")
 with stat_col4:
     st.metric("🤖 AI Agents", "3", help="Builder + Insurance + Judge")
 
@@ -92,17 +264,17 @@ stats_col1, stats_col2 = st.columns(2)
 with stats_col1:
     # Patient distribution chart
     patient_data = pd.DataFrame({
-        'Insurance_Type': ['Cigna Premium', 'Cigna Basic', 'Cigna Plus'],
-        'Count': [2, 2, 1]
+        'Plan_Group': list(system_stats['patients_by_group'].keys()),
+        'Count': list(system_stats['patients_by_group'].values())
     })
-    fig_patients = px.pie(patient_data, values='Count', names='Insurance_Type', title="Patient Insurance Distribution")
+    fig_patients = px.pie(patient_data, values='Count', names='Plan_Group', title="Patient Insurance Distribution")
     st.plotly_chart(fig_patients, use_container_width=True)
 
 with stats_col2:
     # Procedure categories chart
     proc_data = pd.DataFrame({
-        'Category': ['Laboratory', 'Cardiology', 'Emergency', 'Diagnostic'],
-        'Count': [3, 2, 2, 1]
+        'Category': list(system_stats['procedures_by_specialty'].keys()),
+        'Count': list(system_stats['procedures_by_specialty'].values())
     })
     fig_procedures = px.bar(proc_data, x='Category', y='Count', title="Procedures by Category")
     st.plotly_chart(fig_procedures, use_container_width=True)
@@ -115,46 +287,45 @@ st.header("🏥 Provider Claim Workflow")
 # Step 1: Select Patient
 st.subheader("1. 👤 Select Patient")
 
-patients = load_patients()
-patient_options = [f"{pid} - {name} (Policy: {policy})" for pid, name, history, policy in patients]
-
-selected_patient = st.selectbox(
+selected_patient = paged_selectbox(
     "Choose Cigna Patient:",
-    options=patient_options,
-    help="Select a patient from the Cigna member database"
+    "patients",
+    data_store.search_patients,
+    lambda p: f"{p['PATIENT_ID']} - {p['PATIENT_NAME']} (Policy: {p['POLICY_NUMBER']})",
+    "Select a patient from the Cigna member database"
 )
 
 if selected_patient:
     patient_id = selected_patient.split(' - ')[0]
-    patient_info = next(p for p in patients if p[0] == patient_id)
+    patient_info = data_store.get_patient(patient_id) or {}
     
     with st.expander("📋 Patient Medical History"):
-        st.write(f"**Patient ID:** {patient_info[0]}")
-        st.write(f"**Name:** {patient_info[1]}")
-        st.write(f"**Policy Number:** {patient_info[3]}")
-        st.write(f"**Medical History:** {patient_info[2]}")
+        st.write(f"**Patient ID:** {patient_id}")
+        st.write(f"**Name:** {patient_info.get('FIRST_NAME')} {patient_info.get('LAST_NAME')}")
+        st.write(f"**Policy Number:** {patient_info.get('POLICY_NUMBER')}")
+        st.write(f"**Medical History:** {patient_info.get('MEDICAL_HISTORY_SUMMARY')}")
 
 # Step 2: Select Procedure
+selected_procedure = None
 if selected_patient:
     st.subheader("2. 🏥 Select Procedure")
     
-    procedures = load_procedures()
-    procedure_options = [f"{code} - {name}" for code, name, notes in procedures]
-    
-    selected_procedure = st.selectbox(
+    selected_procedure = paged_selectbox(
         "Choose Medical Procedure:",
-        options=procedure_options,
-        help="Select the medical procedure for this claim"
+        "procedures",
+        data_store.search_procedures,
+        lambda p: f"{p['PROCEDURE_CODE']} - {p['PROCEDURE_NAME']}",
+        "Select the medical procedure for this claim"
     )
     
     if selected_procedure:
         procedure_code = selected_procedure.split(' - ')[0]
-        procedure_info = next(p for p in procedures if p[0] == procedure_code)
+        procedure_info = data_store.get_procedure(procedure_code) or {}
         
         with st.expander("📝 Cigna Coverage Information"):
-            st.write(f"**Procedure Code:** {procedure_info[0]}")
-            st.write(f"**Procedure Name:** {procedure_info[1]}")
-            st.write(f"**Cigna Coverage Notes:** {procedure_info[2]}")
+            st.write(f"**Procedure Code:** {procedure_code}")
+            st.write(f"**Procedure Name:** {procedure_info.get('PROCEDURE_NAME')}")
+            st.write(f"**Cigna Coverage Notes:** {procedure_info.get('CIGNA_COVERAGE_NOTES')}")
 
 # Step 3: Clinical Notes
 if selected_patient and selected_procedure:
@@ -170,7 +341,19 @@ if selected_patient and selected_procedure:
     # Dual-Agent Orchestration Button
     st.markdown("---")
     if st.button("🔄 Run Dual-Agent Orchestration Loop", type="primary", use_container_width=True):
-        if clinical_notes.strip():
+        if clinical_notes.strip() and run_in_background and not stream_output:
+            # Persist the job, hand it to a worker thread and poll its progress below
+            job_session_id = job_runner.store.create_job(
+                patient_id, procedure_code, clinical_notes,
+                settings={'compact_context': compact_context, 'adaptive_appeals': adaptive_appeals,
+                          'concurrent_appeals': concurrent_appeals, 'offline_demo': offline_demo,
+                          'prescreen': use_prescreen, 'model_routing': use_model_routing}
+            )
+            submit_job(job_session_id)
+            st.session_state.active_job = job_session_id
+            st.experimental_set_query_params(job=job_session_id)
+            st.experimental_rerun()
+        elif clinical_notes.strip():
             # Run the complete orchestration loop
             with st.spinner("🤖 Running Dual-Agent Orchestration Loop..."):
                 try:
@@ -192,24 +375,41 @@ if selected_patient and selected_procedure:
                     workflow_metric.metric("Workflow Step", "4", "of 8")
                     claim_metric.metric("Claim Status", "❌ Pending")
                     insurance_metric.metric("Insurance Review", "❌ Pending")
-                    appeals_metric.metric("Appeals", "Round 0/3")
+                    appeals_metric.metric("Appeals", f"Round 0/{orchestration.APPEAL_ROUNDS}")
                     
                     st.markdown("---")
                     progress_container = st.container()
+                    if stream_output:
+                        st.subheader("💬 Live Agent Conversations")
+                        live_conversation = st.container()
+                    
+                    # Every agent call in this run is logged under one session ID
+                    run_started = time.perf_counter()
+                    run_backend = agent_backend
+                    if telemetry is not None:
+                        run_backend = InstrumentedBackend(agent_backend, telemetry, session_id=f"UI_{uuid.uuid4().hex[:12]}")
+                    run_backend = routed(run_backend)
+
+                    def agent_step(function_name, args, title, run_blocking):
+                        """Run one agent call, streaming it into the live conversation panel when enabled"""
+                        if not stream_output:
+                            return run_blocking()
+                        with live_conversation:
+                            with st.expander(title, expanded=True):
+                                token_placeholder = st.empty()
+                        return agent_streaming.stream_agent(
+                            run_backend, function_name, args,
+                            on_token=lambda text: token_placeholder.code(text, language='json'),
+                            cache=response_cache
+                        )
                     # Step 1: Builder Agent - Generate Claim
                     with progress_container:
                         st.info("Step 1: 🤖 Builder Agent generating claim...")
                     
-                    builder_query = f"""
-                    SELECT CLAIMS_DEMO.PUBLIC.BUILDER_AGENT(
-                        '{patient_id}',
-                        '{procedure_code}',
-                        '{clinical_notes.replace("'", "''")}'
-                    ) as GENERATED_CLAIM
-                    """
-                    
-                    builder_result = session.sql(builder_query).collect()
-                    generated_claim = builder_result[0]['GENERATED_CLAIM']
+                    generated_claim = agent_step(
+                        "BUILDER_AGENT", [patient_id, procedure_code, clinical_notes], "🤖 Builder Agent Response",
+                        lambda: orchestration.generate_claim(run_backend, patient_id, procedure_code, clinical_notes, cache=response_cache)
+                    )
                     st.session_state.generated_claim = generated_claim
                     st.session_state.workflow_step = 5
                     
@@ -217,19 +417,28 @@ if selected_patient and selected_procedure:
                     workflow_metric.metric("Workflow Step", "5", "of 8")
                     claim_metric.metric("Claim Status", "✅ Generated")
                     
-                    # Step 2: Insurance Agent - Analyze Claim
-                    with progress_container:
-                        st.info("Step 2: 🛡️ Insurance Agent analyzing claim...")
-                    
-                    insurance_query = f"""
-                    SELECT CLAIMS_DEMO.PUBLIC.INSURANCE_AGENT_WITH_POLICY(
-                        '{generated_claim.replace("'", "''")}',
-                        '{procedure_code}'
-                    ) as INSURANCE_REBUTTAL
-                    """
+                    # Policy pre-screen: decide clear-cut claims locally, attach triggered rules otherwise
+                    screen = rule_engine.screen(procedure_code, clinical_notes, generated_claim) if rule_engine is not None else None
+                    st.session_state.pre_screen = screen.as_dict() if screen is not None else None
+                    reviewed_claim = screen.annotate(generated_claim) if screen is not None else generated_claim
+                    if screen is not None:
+                        with progress_container:
+                            if screen.decided:
+                                st.info(f"🧮 Policy pre-screen decided the claim ({screen.outcome}) - Insurance Agent and Judge skipped")
+                            elif screen.findings:
+                                st.info(f"🧮 Policy pre-screen flagged {len(screen.findings)} issue(s) for the agents to review")
                     
-                    insurance_result = session.sql(insurance_query).collect()
-                    insurance_rebuttal = insurance_result[0]['INSURANCE_REBUTTAL']
+                    # Step 2: Insurance Agent - Analyze Claim
+                    if screen is not None and screen.decided:
+                        insurance_rebuttal = screen.insurance_rebuttal()
+                    else:
+                        with progress_container:
+                            st.info("Step 2: 🛡️ Insurance Agent analyzing claim...")
+                        
+                        insurance_rebuttal = agent_step(
+                            "INSURANCE_AGENT_WITH_POLICY", [reviewed_claim, procedure_code], "🛡️ Insurance Agent Response",
+                            lambda: orchestration.analyze_claim(run_backend, reviewed_claim, procedure_code, cache=response_cache)
+                        )
                     st.session_state.insurance_rebuttal = insurance_rebuttal
                     st.session_state.workflow_step = 6
                     
@@ -238,20 +447,16 @@ if selected_patient and selected_procedure:
                     insurance_metric.metric("Insurance Review", "✅ Analyzed")
                     
                     # Step 3: AI Judge - Make Decision
-                    with progress_container:
-                        st.info("Step 3: ⚖️ AI Judge making decision...")
-                    
-                    judge_query = f"""
-                    SELECT CLAIMS_DEMO.PUBLIC.AI_JUDGE_DECISION(
-                        '{generated_claim.replace("'", "''")}',
-                        '{insurance_rebuttal.replace("'", "''")}',
-                        '{patient_id}',
-                        '{procedure_code}'
-                    ) as JUDGE_DECISION
-                    """
-                    
-                    judge_result = session.sql(judge_query).collect()
-                    judge_decision = judge_result[0]['JUDGE_DECISION']
+                    if screen is not None and screen.decided:
+                        judge_decision = screen.judge_decision()
+                    else:
+                        with progress_container:
+                            st.info("Step 3: ⚖️ AI Judge making decision...")
+                        
+                        judge_decision = agent_step(
+                            "AI_JUDGE_DECISION", [reviewed_claim, insurance_rebuttal, patient_id, procedure_code], "⚖️ AI Judge Decision",
+                            lambda: orchestration.judge_claim(run_backend, reviewed_claim, insurance_rebuttal, patient_id, procedure_code, cache=response_cache)
+                        )
                     st.session_state.judge_decision = judge_decision
                     st.session_state.workflow_step = 7
                     
@@ -260,65 +465,94 @@ if selected_patient and selected_procedure:
                     
                     # Parse judge decision to check if denied
                     try:
-                        judge_json = json.loads(judge_decision)
+                        judge_json = agent_contracts.check_output("AI_JUDGE_DECISION", judge_decision).require().data
                         final_decision = judge_json.get('final_decision', 'UNKNOWN').upper()
                         st.session_state.final_decision = final_decision
                         
-                        # Step 4: Appeals Process (if denied)
-                        if final_decision == 'DENIED':
+                        # Step 4: Appeals Process (if denied by the agents; rule denials are fixed by resubmission)
+                        if final_decision == 'DENIED' and not (screen is not None and screen.decided):
                             with progress_container:
                                 st.info("Claim denied - Starting appeals process...")
                             st.session_state.appeals_round = 0
                             st.session_state.appeal_history = []
+                            st.session_state.context_savings = []
+                            st.session_state.appeal_stop_reason = None
+                            convergence = None
+                            if adaptive_appeals:
+                                convergence = orchestration.AppealConvergence(
+                                    initial_strength=orchestration.parse_strength_score(insurance_rebuttal)
+                                )
+                            
+                            # Build the compact appeal context once; every round reuses it
+                            digest = None
+                            appeal_claim, appeal_rebuttal, appeal_judge = generated_claim, insurance_rebuttal, judge_decision
+                            if compact_context:
+                                digest = ContextDigest.build(
+                                    run_backend, generated_claim, insurance_rebuttal, judge_decision, procedure_code
+                                )
+                                appeal_claim, appeal_rebuttal, appeal_judge = digest.appeal_inputs()
                         
-                            # Run appeals loop (max 3 rounds)
-                            for round_num in range(1, 4):  # 3 rounds max
-                                # Doctor Appeal
+                            completed = {'appeals': 0, 'counters': 0}
+                            
+                            def on_appeal(round_num, doctor_appeal):
+                                completed['appeals'] += 1
                                 with progress_container:
-                                    st.info(f"Step 4.{round_num}a: 📋 Doctor filing appeal round {round_num}...")
-                                
-                                appeal_query = f"""
-                                SELECT CLAIMS_DEMO.PUBLIC.DOCTOR_APPEAL_GENERATOR(
-                                    '{generated_claim.replace("'", "''")}',
-                                    '{insurance_rebuttal.replace("'", "''")}',
-                                    '{judge_decision.replace("'", "''")}',
-                                    {round_num}
-                                ) as DOCTOR_APPEAL
-                                """
-                                
-                                appeal_result = session.sql(appeal_query).collect()
-                                doctor_appeal = appeal_result[0]['DOCTOR_APPEAL']
-                                
-                                st.session_state.appeals_round = round_num
-                                st.session_state.appeal_history.append({
-                                    'round': round_num,
-                                    'type': 'DOCTOR_APPEAL',
-                                    'content': doctor_appeal
-                                })
-                                
-                                # Update dashboard
-                                appeals_metric.metric("Appeals", f"Round {round_num}/3")
-                                
-                                # Insurance Counter-Appeal
+                                    st.info(f"Step 4.{round_num}a: 📋 Doctor appeal round {round_num} filed - insurance counter-appeal started...")
+                                appeals_metric.metric("Appeals", f"Filed {completed['appeals']}/{orchestration.APPEAL_ROUNDS}", f"{completed['counters']} answered")
+                            
+                            def on_counter(round_num, insurance_counter):
+                                completed['counters'] += 1
                                 with progress_container:
-                                    st.info(f"Step 4.{round_num}b: 🛡️ Insurance counter-appeal round {round_num}...")
-                                
-                                counter_query = f"""
-                                SELECT CLAIMS_DEMO.PUBLIC.INSURANCE_COUNTER_APPEAL(
-                                    '{doctor_appeal.replace("'", "''")}',
-                                    '{insurance_rebuttal.replace("'", "''")}',
-                                    {round_num}
-                                ) as INSURANCE_COUNTER
-                                """
-                                
-                                counter_result = session.sql(counter_query).collect()
-                                insurance_counter = counter_result[0]['INSURANCE_COUNTER']
+                                    st.info(f"Step 4.{round_num}b: 🛡️ Insurance counter-appeal round {round_num} received")
+                                appeals_metric.metric("Appeals", f"Round {completed['counters']}/{orchestration.APPEAL_ROUNDS}", f"{completed['appeals']} filed")
+                            
+                            if stream_output:
+                                # Stream each round's appeal and counter-appeal as it is generated
+                                doctor_appeals, insurance_counters = {}, {}
+                                for round_num in range(1, orchestration.APPEAL_ROUNDS + 1):
+                                    doctor_appeals[round_num] = agent_step(
+                                        "DOCTOR_APPEAL_GENERATOR",
+                                        orchestration.doctor_appeal_args(appeal_claim, appeal_rebuttal, appeal_judge, round_num),
+                                        f"📋 Doctor Appeal - Round {round_num}", None
+                                    )
+                                    on_appeal(round_num, doctor_appeals[round_num])
+                                    insurance_counters[round_num] = agent_step(
+                                        "INSURANCE_COUNTER_APPEAL",
+                                        orchestration.insurance_counter_args(doctor_appeals[round_num], appeal_rebuttal, round_num),
+                                        f"🛡️ Insurance Counter-Appeal - Round {round_num}", None
+                                    )
+                                    on_counter(round_num, insurance_counters[round_num])
+                                    if convergence is not None and convergence.should_stop(round_num, insurance_counters[round_num]):
+                                        break
+                            else:
+                                if concurrent_appeals:
+                                    # All appeal rounds run as a pipelined set of async jobs
+                                    with progress_container:
+                                        if convergence is not None:
+                                            st.info(f"Step 4: 📋 Filing appeal rounds (up to {orchestration.APPEAL_ROUNDS}) until the dispute settles...")
+                                        else:
+                                            st.info(f"Step 4: 📋 Filing {orchestration.APPEAL_ROUNDS} appeal rounds concurrently...")
+                                    run_appeals = orchestration.run_appeals_concurrently
+                                else:
+                                    # Run appeals loop (max 3 rounds) one call at a time
+                                    run_appeals = orchestration.run_appeals_sequential
                                 
-                                st.session_state.appeal_history.append({
-                                    'round': round_num,
-                                    'type': 'INSURANCE_COUNTER',
-                                    'content': insurance_counter
-                                })
+                                doctor_appeals, insurance_counters = run_appeals(
+                                    run_backend, appeal_claim, appeal_rebuttal, appeal_judge,
+                                    on_appeal=on_appeal, on_counter=on_counter, cache=response_cache,
+                                    convergence=convergence
+                                )
+                            
+                            # Record history in round order regardless of completion order
+                            st.session_state.appeal_history = orchestration.appeal_history_from(doctor_appeals, insurance_counters)
+                            st.session_state.appeals_round = len(doctor_appeals)
+                            if convergence is not None:
+                                st.session_state.appeal_stop_reason = convergence.stop_reason
+                                if len(doctor_appeals) < orchestration.APPEAL_ROUNDS:
+                                    with progress_container:
+                                        st.info(f"🛑 Appeals stopped after round {len(doctor_appeals)}: {convergence.stop_reason}")
+                            if digest is not None:
+                                st.session_state.context_savings = digest.token_savings(doctor_appeals)
                         
                         # Update final dashboard
                         workflow_metric.metric("Workflow Step", "8", "of 8")
@@ -327,16 +561,74 @@ if selected_patient and selected_procedure:
                             st.success("✅ Dual-Agent Orchestration Complete!")
                         
                         st.session_state.workflow_step = 8
+                        if hasattr(agent_backend, 'statement_timings'):
+                            try:
+                                st.session_state.statement_timings = agent_backend.statement_timings(since=run_started)
+                            except Exception:
+                                st.session_state.statement_timings = []
+                        st.session_state.model_routing = model_router.recent_calls(since=run_started) if model_router else []
                         st.experimental_rerun()
                         
-                    except json.JSONDecodeError:
-                        st.error("Error parsing judge decision")
+                    except agent_contracts.ContractViolation as e:
+                        st.error(f"Judge decision failed validation: {e}")
                         
                 except Exception as e:
                     st.error(f"Error in orchestration: {str(e)}")
         else:
             st.error("Please enter clinical notes before starting orchestration")
 
+# Background job progress: poll the persisted step rows until the job finishes
+poll_job = False
+if st.session_state.active_job:
+    job_session_id = st.session_state.active_job
+    job = job_runner.store.job_status(job_session_id)
+    if job is None:
+        st.session_state.active_job = None
+        st.experimental_set_query_params()
+    else:
+        # Completed steps fill the results section below as they land
+        job_result = result_from_steps(job['STEPS'], job)
+        st.session_state.generated_claim = job_result['generated_claim']
+        st.session_state.insurance_rebuttal = job_result['insurance_rebuttal']
+        st.session_state.judge_decision = job_result['judge_decision']
+        st.session_state.final_decision = job_result['final_decision']
+        st.session_state.appeal_history = job_result['appeal_history']
+        st.session_state.appeals_round = max([entry['round'] for entry in job_result['appeal_history']], default=0)
+        st.session_state.workflow_step = min(4 + len(job['STEPS']), 7)
+
+        st.markdown("---")
+        st.subheader("🧵 Background Job")
+        job_cols = st.columns(3)
+        with job_cols[0]:
+            st.metric("Job", job['STEP_STATUS'])
+        with job_cols[1]:
+            st.metric("Completed Steps", len(job['STEPS']))
+        with job_cols[2]:
+            st.metric("Appeals", f"Round {st.session_state.appeals_round}/{orchestration.APPEAL_ROUNDS}")
+        st.caption(f"Session `{job_session_id}` - completed: {', '.join(job['STEPS']) or 'none yet'}")
+
+        if job['STEP_STATUS'] == 'COMPLETED':
+            st.session_state.appeal_stop_reason = job_result['appeal_stop_reason']
+            st.session_state.pre_screen = job_result['pre_screen']
+            st.session_state.context_savings = job_result['context_savings']
+            st.session_state.workflow_step = 8
+            st.session_state.active_job = None
+            st.experimental_set_query_params()
+            st.experimental_rerun()
+        elif job['STEP_STATUS'] == 'FAILED':
+            st.error(f"Job failed after {len(job['STEPS'])} completed steps: {job['LAST_ERROR']}")
+            if st.button("▶️ Resume from last completed step", type="primary"):
+                submit_job(job_session_id)
+                st.experimental_rerun()
+        else:
+            if not job_runner.is_active(job_session_id) and (job['STEP_STATUS'] == 'PENDING' or job['STALE']):
+                # No worker owns the job any more (app restart or worker crash): pick it up where it stopped
+                st.info("Resuming interrupted job from its last completed step...")
+                submit_job(job_session_id)
+            else:
+                st.info("🤖 Agents are working - this page updates as each step completes.")
+            poll_job = True
+
 # Orchestration results are displayed in the Live Agent Conversations section below
 
 # Workflow Insights & Supporting Data
@@ -360,6 +652,16 @@ if st.session_state.workflow_step >= 3:
                 st.markdown("**Input:** Generated claim + Policy documents")
                 st.code(st.session_state.insurance_rebuttal, language='json')
                 
+        if st.session_state.pre_screen:
+            pre_screen = st.session_state.pre_screen
+            with st.expander(f"🧮 Policy Pre-Screen: {pre_screen['outcome']}", expanded=pre_screen['outcome'] != 'REVIEW'):
+                st.caption(f"Rules for {pre_screen['procedure_code']}: {', '.join(pre_screen['rule_ids']) or 'none indexed'}")
+                for finding in pre_screen['findings']:
+                    icon = "❌" if finding['clear_cut'] else "⚠️"
+                    st.write(f"{icon} **{finding['denial_reason_id']} {finding['denial_category'] or ''}** - {finding['detail']}")
+                if not pre_screen['findings']:
+                    st.write("✅ No policy rule issues found")
+        
         if st.session_state.judge_decision:
             with st.expander("⚖️ AI Judge Decision", expanded=True):
                 st.markdown("**Input:** Both agent outputs + Context")
@@ -368,12 +670,17 @@ if st.session_state.workflow_step >= 3:
         # Appeals Conversation History (moved here from appeals section)
         if st.session_state.appeal_history:
             st.subheader("💬 Appeals Conversation History")
+            if st.session_state.appeal_stop_reason:
+                st.caption(
+                    f"Appeals stopped after round {st.session_state.appeals_round} of {orchestration.APPEAL_ROUNDS}: "
+                    f"**{st.session_state.appeal_stop_reason}**"
+                )
             for appeal in st.session_state.appeal_history:
                 if appeal['type'] == 'DOCTOR_APPEAL':
                     with st.expander(f"📋 Doctor Appeal - Round {appeal['round']}", expanded=True):
                         st.markdown("**Input:** Original claim + Insurance analysis + Judge decision")
-                        try:
-                            appeal_json = json.loads(appeal['content'])
+                        appeal_json = agent_contracts.parsed("DOCTOR_APPEAL_GENERATOR", appeal['content'])
+                        if appeal_json is not None:
                             st.markdown(f"**Appeal Summary:** {appeal_json.get('appeal_summary', 'N/A')}")
                             st.markdown(f"**Medical Justification:** {appeal_json.get('medical_justification', 'N/A')}")
                             evidence = appeal_json.get('additional_evidence', [])
@@ -382,21 +689,64 @@ if st.session_state.workflow_step >= 3:
                                 for item in evidence:
                                     st.markdown(f"• {item}")
                             st.code(appeal['content'], language='json')
-                        except:
+                        else:
                             st.text(appeal['content'])
                             
                 elif appeal['type'] == 'INSURANCE_COUNTER':
                     with st.expander(f"🛡️ Insurance Counter-Appeal - Round {appeal['round']}", expanded=True):
                         st.markdown("**Input:** Doctor appeal + Original analysis")
-                        try:
-                            counter_json = json.loads(appeal['content'])
+                        counter_json = agent_contracts.parsed("INSURANCE_COUNTER_APPEAL", appeal['content'])
+                        if counter_json is not None:
                             st.markdown(f"**Counter Response:** {counter_json.get('counter_response', 'N/A')}")
                             st.markdown(f"**Position:** {counter_json.get('position_change', 'N/A')}")
                             st.markdown(f"**New Strength Score:** {counter_json.get('new_strength_score', 'N/A')}")
                             st.markdown(f"**Final Recommendation:** {counter_json.get('final_recommendation', 'N/A')}")
                             st.code(appeal['content'], language='json')
-                        except:
+                        else:
                             st.text(appeal['content'])
+        
+        if st.session_state.context_savings:
+            with st.expander("🗜️ Appeal Context Compaction", expanded=False):
+                savings = st.session_state.context_savings
+                total_full = sum(r['full_prompt_tokens'] for r in savings)
+                total_saved = sum(r['saved_tokens'] for r in savings)
+                st.markdown(
+                    f"Appeal rounds received a compact digest instead of the full claim, rebuttal and judge decision: "
+                    f"**~{total_saved:,} prompt tokens saved** ({total_saved / total_full:.0%} of {total_full:,})"
+                    if total_full else "No appeal prompts were sent."
+                )
+                st.dataframe(pd.DataFrame(savings).rename(columns={
+                    'round': 'Round', 'full_prompt_tokens': 'Full Context (est. tokens)',
+                    'compact_prompt_tokens': 'Digest (est. tokens)', 'saved_tokens': 'Saved', 'saved_pct': 'Saved %'
+                }), use_container_width=True)
+        
+        if st.session_state.statement_timings:
+            with st.expander("⏱️ Agent Statement Timings", expanded=False):
+                timings = pd.DataFrame(st.session_state.statement_timings)
+                if 'compile_ms' in timings:
+                    st.markdown(
+                        f"Compile **{timings['compile_ms'].sum():,.0f} ms** vs. execute "
+                        f"**{timings['execute_ms'].sum():,.0f} ms** across {len(timings)} bound agent statements"
+                    )
+                columns = ['function_name', 'compile_ms', 'queued_ms', 'execute_ms', 'total_ms', 'wall_ms', 'query_id']
+                st.dataframe(timings[[c for c in columns if c in timings]].rename(columns={
+                    'function_name': 'Function', 'compile_ms': 'Compile (ms)', 'queued_ms': 'Queued (ms)',
+                    'execute_ms': 'Execute (ms)', 'total_ms': 'Total (ms)', 'wall_ms': 'Client Wall (ms)', 'query_id': 'Query ID'
+                }), use_container_width=True)
+        
+        if st.session_state.model_routing:
+            with st.expander("🧭 Model Routing", expanded=False):
+                routing = pd.DataFrame(st.session_state.model_routing)
+                fallbacks = int(routing['fell_back'].sum())
+                st.markdown(
+                    f"**{len(routing)}** routed agent calls, **{fallbacks}** answered by the fallback model "
+                    f"after exceeding their latency budget"
+                )
+                columns = ['function_name', 'model', 'routed_model', 'fell_back', 'latency_ms', 'latency_budget_ms', 'status']
+                st.dataframe(routing[columns].rename(columns={
+                    'function_name': 'Function', 'model': 'Model Used', 'routed_model': 'Routed Model',
+                    'fell_back': 'Fallback', 'latency_ms': 'Latency (ms)', 'latency_budget_ms': 'Budget (ms)', 'status': 'Status'
+                }), use_container_width=True)
     
     with col2:
         st.subheader("📊 Live Data Sources")
@@ -418,10 +768,8 @@ if st.session_state.workflow_step >= 3:
             patient_id = selected_patient.split(' - ')[0]
             with st.expander("👤 Patient Data in Use"):
                 try:
-                    patient_query = f"SELECT * FROM CLAIMS_DEMO.PUBLIC.PATIENTS WHERE PATIENT_ID = '{patient_id}'"
-                    patient_result = session.sql(patient_query).collect()
-                    if patient_result:
-                        patient_data = dict(patient_result[0])
+                    patient_data = data_store.get_patient(patient_id)
+                    if patient_data:
                         for key, value in patient_data.items():
                             st.write(f"**{key}:** {value}")
                     else:
@@ -434,10 +782,8 @@ if st.session_state.workflow_step >= 3:
             procedure_code = selected_procedure.split(' - ')[0]
             with st.expander("🏥 Procedure Data in Use"):
                 try:
-                    proc_query = f"SELECT * FROM CLAIMS_DEMO.PUBLIC.COMMON_PROCEDURES WHERE PROCEDURE_CODE = '{procedure_code}'"
-                    proc_result = session.sql(proc_query).collect()
-                    if proc_result:
-                        proc_data = dict(proc_result[0])
+                    proc_data = data_store.get_procedure(procedure_code)
+                    if proc_data:
                         for key, value in proc_data.items():
                             st.write(f"**{key}:** {value}")
                     else:
@@ -448,8 +794,8 @@ if st.session_state.workflow_step >= 3:
     # Show dynamic scoring analysis
     if st.session_state.insurance_rebuttal:
         st.subheader("🔍 Scoring Analysis")
-        try:
-            rebuttal_json = json.loads(st.session_state.insurance_rebuttal)
+        rebuttal_json = agent_contracts.parsed("INSURANCE_AGENT_WITH_POLICY", st.session_state.insurance_rebuttal)
+        if rebuttal_json is not None:
             strength_score = rebuttal_json.get('strength_score', 0)
             
             # Check why score might be low
@@ -468,7 +814,7 @@ if st.session_state.workflow_step >= 3:
             for reason in rebuttal_json.get('denial_reasons', []):
                 st.write(f"❌ {reason}")
                 
-        except json.JSONDecodeError:
+        else:
             st.error("Could not parse insurance analysis")
 
 # Reset workflow button (moved to bottom)
@@ -482,4 +828,16 @@ if st.session_state.workflow_step > 1:
         st.session_state.appeals_round = 0
         st.session_state.final_decision = None
         st.session_state.appeal_history = []
+        st.session_state.context_savings = []
+        st.session_state.appeal_stop_reason = None
+        st.session_state.pre_screen = None
+        st.session_state.statement_timings = []
+        st.session_state.model_routing = []
+        st.session_state.active_job = None
+        st.experimental_set_query_params()
         st.experimental_rerun()
+
+# Poll again once the page (including partial results) has rendered
+if poll_job:
+    time.sleep(JOB_POLL_SECONDS)
+    st.experimental_rerun()
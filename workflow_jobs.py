@@ -0,0 +1,396 @@
+"""
+Resumable background orchestration jobs.
+
+A job is the Builder -> Insurance -> Judge -> Appeals workflow for one claim,
+persisted as a state machine in CLAIMS_DEMO.PUBLIC.OPTIMIZATION_SESSIONS keyed by
+SESSION_ID:
+
+  - one header row (WORKFLOW_STEP = 'JOB') holding the inputs and settings, the
+    job status (STEP_STATUS: PENDING, RUNNING, COMPLETED, FAILED) and, once
+    finished, the same summary columns the batch worker writes
+  - one row per completed step (BUILDER, PRE_SCREEN, INSURANCE, JUDGE,
+    DOCTOR_APPEAL_<n>, INSURANCE_COUNTER_<n>) with the agent output (or the
+    pre-screen outcome) in STEP_OUTPUT
+
+Every statement has one fixed SQL text per method with all values (agent
+outputs included) passed as bind parameters, as in agent_sql.py.
+
+Jobs run on a BackgroundJobRunner worker thread, so the Streamlit script only
+polls job_status(). When a job is interrupted (app restart, worker crash) it is
+claimed again once its heartbeat is stale, and run_job() skips every step that
+already has a row, so finished LLM work is never paid for twice. The pre-screen
+and model-routing choices are part of the job's settings, and the pre-screen
+outcome is persisted as a step, so a resumed job continues on the branch it
+started on whatever the resuming caller has enabled.
+"""
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import claims_orchestration as orchestration
+from claims_orchestration import AGENT_SCHEMA
+from model_router import ModelRouter, RoutedBackend
+from policy_rules import PolicyRuleEngine, PreScreen
+
+SESSIONS_TABLE = f"{AGENT_SCHEMA}.OPTIMIZATION_SESSIONS"
+JOB_STEP = 'JOB'
+PRE_SCREEN_STEP = 'PRE_SCREEN'
+STALE_AFTER_SECONDS = 180
+# How often a job refreshes its heartbeat while it waits on appeal calls; well under STALE_AFTER_SECONDS
+HEARTBEAT_SECONDS = 30
+DEFAULT_JOB_WORKERS = 4
+# Agent outputs are bound, never inlined: a quoted literal would unescape the \" and \n inside their JSON.
+# The text is bound twice, once for each side of the COALESCE.
+JSON_OR_TEXT = "COALESCE(TRY_PARSE_JSON(?), TO_VARIANT(?))"
+
+
+def new_session_id():
+    return f"JOB_{uuid.uuid4().hex[:16].upper()}"
+
+
+def appeal_step(round_num):
+    return f"DOCTOR_APPEAL_{round_num}"
+
+
+def counter_step(round_num):
+    return f"INSURANCE_COUNTER_{round_num}"
+
+
+def _as_text(value):
+    """VARIANT columns come back as JSON text; string outputs are JSON-quoted strings"""
+    if value is None:
+        return None
+    try:
+        parsed = json.loads(value)
+    except (json.JSONDecodeError, TypeError):
+        return value
+    return parsed if isinstance(parsed, str) else json.dumps(parsed)
+
+
+class WorkflowJobStore:
+    """Reads and writes job header and step rows in OPTIMIZATION_SESSIONS"""
+
+    def __init__(self, session, stale_after_seconds=STALE_AFTER_SECONDS):
+        self.session = session
+        self.stale_after_seconds = stale_after_seconds
+
+    def create_job(self, patient_id, procedure_code, clinical_notes, settings=None, session_id=None):
+        """Insert a PENDING job header and return its session ID"""
+        session_id = session_id or new_session_id()
+        self.session.sql(f"""
+            INSERT INTO {SESSIONS_TABLE}
+                (SESSION_ID, PATIENT_ID, PROCEDURE_CODE, CLINICAL_NOTES, ITERATION_NUMBER,
+                 WORKFLOW_STEP, STEP_NUMBER, STEP_STATUS, STEP_OUTPUT)
+            SELECT ?, ?, ?, ?, 1, '{JOB_STEP}', 0, 'PENDING', PARSE_JSON(?)
+        """, params=[session_id, patient_id, procedure_code, clinical_notes, json.dumps(settings or {})]).collect()
+        return session_id
+
+    def claim_job(self, session_id):
+        """Mark the job RUNNING if it is pending, failed or stale; True if this caller owns it now"""
+        result = self.session.sql(f"""
+            UPDATE {SESSIONS_TABLE}
+            SET STEP_STATUS = 'RUNNING', LAST_ERROR = NULL, LAST_UPDATED = CURRENT_TIMESTAMP()
+            WHERE SESSION_ID = ? AND WORKFLOW_STEP = '{JOB_STEP}'
+              AND (STEP_STATUS IN ('PENDING', 'FAILED')
+                   OR (STEP_STATUS = 'RUNNING'
+                       AND LAST_UPDATED < DATEADD(second, ?, CURRENT_TIMESTAMP())))
+        """, params=[session_id, -int(self.stale_after_seconds)]).collect()
+        return bool(result and result[0][0])
+
+    def load_job(self, session_id):
+        """The job header as a dict (inputs, settings, status), or None"""
+        rows = self.session.sql(f"""
+            SELECT SESSION_ID, PATIENT_ID, PROCEDURE_CODE, CLINICAL_NOTES, STEP_STATUS, STEP_OUTPUT,
+                   LAST_ERROR, FINAL_RECOMMENDATION, APPEAL_STOP_REASON,
+                   DATEDIFF(second, LAST_UPDATED, CURRENT_TIMESTAMP()) as SECONDS_SINCE_UPDATE
+            FROM {SESSIONS_TABLE}
+            WHERE SESSION_ID = ? AND WORKFLOW_STEP = '{JOB_STEP}'
+            LIMIT 1
+        """, params=[session_id]).collect()
+        if not rows:
+            return None
+        job = rows[0].as_dict()
+        job['SETTINGS'] = json.loads(job.pop('STEP_OUTPUT') or '{}')
+        job['STALE'] = (job['STEP_STATUS'] == 'RUNNING'
+                        and (job['SECONDS_SINCE_UPDATE'] or 0) > self.stale_after_seconds)
+        return job
+
+    def completed_steps(self, session_id):
+        """{step name: output text} for every step already persisted"""
+        rows = self.session.sql(f"""
+            SELECT WORKFLOW_STEP, STEP_OUTPUT
+            FROM {SESSIONS_TABLE}
+            WHERE SESSION_ID = ? AND WORKFLOW_STEP <> '{JOB_STEP}'
+              AND STEP_STATUS = 'COMPLETED'
+            QUALIFY ROW_NUMBER() OVER (PARTITION BY WORKFLOW_STEP ORDER BY LAST_UPDATED DESC) = 1
+        """, params=[session_id]).collect()
+        return {row['WORKFLOW_STEP']: _as_text(row['STEP_OUTPUT']) for row in rows}
+
+    def save_step(self, job, step_name, step_number, output):
+        """Persist one completed step and refresh the job heartbeat"""
+        session_id = job['SESSION_ID']
+        self.session.sql(f"""
+            INSERT INTO {SESSIONS_TABLE}
+                (SESSION_ID, PATIENT_ID, PROCEDURE_CODE, CLINICAL_NOTES, ITERATION_NUMBER,
+                 WORKFLOW_STEP, STEP_NUMBER, STEP_STATUS, STEP_OUTPUT)
+            SELECT ?, ?, ?, ?, 1, ?, ?, 'COMPLETED', {JSON_OR_TEXT}
+        """, params=[session_id, job['PATIENT_ID'], job['PROCEDURE_CODE'], job['CLINICAL_NOTES'],
+                     step_name, int(step_number), output, output]).collect()
+        self.heartbeat(session_id)
+
+    def heartbeat(self, session_id):
+        self.session.sql(f"""
+            UPDATE {SESSIONS_TABLE} SET LAST_UPDATED = CURRENT_TIMESTAMP()
+            WHERE SESSION_ID = ? AND WORKFLOW_STEP = '{JOB_STEP}'
+        """, params=[session_id]).collect()
+
+    def complete_job(self, session_id, result):
+        """Mark the job COMPLETED and fill the header's summary columns"""
+        generated_claim = result['generated_claim']
+        insurance_rebuttal = result['insurance_rebuttal']
+        judge_decision = result['judge_decision']
+        self.session.sql(f"""
+            UPDATE {SESSIONS_TABLE}
+            SET STEP_STATUS = 'COMPLETED',
+                OPTIMIZATION_STATUS = 'COMPLETED',
+                BUILDER_CLAIM = {JSON_OR_TEXT},
+                INSURANCE_REBUTTAL = {JSON_OR_TEXT},
+                STRENGTH_SCORE = ?,
+                JUDGE_DECISION = {JSON_OR_TEXT},
+                FINAL_RECOMMENDATION = ?,
+                APPEAL_HISTORY = PARSE_JSON(?),
+                APPEAL_STOP_REASON = ?,
+                STEP_OUTPUT = OBJECT_INSERT(
+                    OBJECT_INSERT(STEP_OUTPUT, 'context_savings', PARSE_JSON(?), TRUE),
+                    'pre_screen', PARSE_JSON(?), TRUE),
+                LAST_UPDATED = CURRENT_TIMESTAMP()
+            WHERE SESSION_ID = ? AND WORKFLOW_STEP = '{JOB_STEP}'
+        """, params=[
+            generated_claim, generated_claim,
+            insurance_rebuttal, insurance_rebuttal,
+            orchestration.parse_strength_score(insurance_rebuttal),
+            judge_decision, judge_decision,
+            result['final_decision'],
+            json.dumps(result['appeal_history']),
+            result['appeal_stop_reason'],
+            json.dumps(result['context_savings']),
+            json.dumps(result.get('pre_screen')),
+            session_id,
+        ]).collect()
+
+    def fail_job(self, session_id, error):
+        self.session.sql(f"""
+            UPDATE {SESSIONS_TABLE}
+            SET STEP_STATUS = 'FAILED', LAST_ERROR = ?, LAST_UPDATED = CURRENT_TIMESTAMP()
+            WHERE SESSION_ID = ? AND WORKFLOW_STEP = '{JOB_STEP}'
+        """, params=[str(error)[:4000], session_id]).collect()
+
+    def job_status(self, session_id):
+        """Header plus completed steps, for the UI to poll"""
+        job = self.load_job(session_id)
+        if job is None:
+            return None
+        job['STEPS'] = self.completed_steps(session_id)
+        return job
+
+
+def result_from_steps(steps, job=None):
+    """Rebuild run_orchestration-shaped output from persisted step outputs"""
+    doctor_appeals, insurance_counters = {}, {}
+    for round_num in range(1, orchestration.APPEAL_ROUNDS + 1):
+        if appeal_step(round_num) in steps:
+            doctor_appeals[round_num] = steps[appeal_step(round_num)]
+        if counter_step(round_num) in steps:
+            insurance_counters[round_num] = steps[counter_step(round_num)]
+    judge_decision = steps.get('JUDGE')
+    settings = (job or {}).get('SETTINGS', {})
+    return {
+        'generated_claim': steps.get('BUILDER'),
+        'insurance_rebuttal': steps.get('INSURANCE'),
+        'judge_decision': judge_decision,
+        'final_decision': (orchestration.parse_final_decision(judge_decision) or 'UNPARSEABLE') if judge_decision else None,
+        'appeal_history': orchestration.appeal_history_from(doctor_appeals, insurance_counters),
+        'appeal_stop_reason': (job or {}).get('APPEAL_STOP_REASON'),
+        'context_savings': settings.get('context_savings', []),
+        'pre_screen': settings.get('pre_screen'),
+    }
+
+
+def run_appeals_pipelined(store, job, steps, backend, claim_input, rebuttal_input, judge_input,
+                          retries, cache, convergence):
+    """Appeal rounds on the concurrent pipeline, persisting each appeal and counter-appeal as it finishes"""
+    def persisted(step_name):
+        return {
+            round_num: steps[step_name(round_num)]
+            for round_num in range(1, orchestration.APPEAL_ROUNDS + 1) if step_name(round_num) in steps
+        }
+
+    def persist(step_name, first_step_number):
+        def on_finish(round_num, output):
+            if step_name(round_num) not in steps:
+                steps[step_name(round_num)] = output
+                store.save_step(job, step_name(round_num), first_step_number + 2 * round_num, output)
+        return on_finish
+
+    last_heartbeat = time.monotonic()
+
+    def keep_alive():
+        # Long appeal phases would otherwise go without a write and look stale to other workers
+        nonlocal last_heartbeat
+        if time.monotonic() - last_heartbeat >= HEARTBEAT_SECONDS:
+            last_heartbeat = time.monotonic()
+            store.heartbeat(job['SESSION_ID'])
+
+    doctor_appeals, _ = orchestration.run_appeals_concurrently(
+        backend, claim_input, rebuttal_input, judge_input,
+        on_appeal=persist(appeal_step, 2), on_counter=persist(counter_step, 3),
+        retries=retries, cache=cache, convergence=convergence,
+        known_appeals=persisted(appeal_step), known_counters=persisted(counter_step), on_wait=keep_alive
+    )
+    return doctor_appeals
+
+
+def run_appeals_in_steps(step, backend, claim_input, rebuttal_input, judge_input, retries, cache, convergence):
+    """Appeal rounds one call at a time, each call run through run_job's step() so it is persisted"""
+    doctor_appeals = {}
+    for round_num in range(1, orchestration.APPEAL_ROUNDS + 1):
+        doctor_appeals[round_num] = step(appeal_step(round_num), 2 + 2 * round_num, lambda r=round_num: orchestration.file_appeal(
+            backend, claim_input, rebuttal_input, judge_input, r, retries, cache))
+        counter = step(counter_step(round_num), 3 + 2 * round_num, lambda r=round_num: orchestration.counter_appeal(
+            backend, doctor_appeals[r], rebuttal_input, r, retries, cache))
+        # Replaying persisted rounds through the tracker gives the same decision as the first run
+        if convergence is not None and convergence.should_stop(round_num, counter):
+            break
+    return doctor_appeals
+
+
+def job_rule_engine(store, settings, rule_engine=None):
+    """The rule engine for a job whose settings turn the pre-screen on, else None"""
+    if not settings.get('prescreen', rule_engine is not None):
+        return None
+    return rule_engine or PolicyRuleEngine.load(store.session)
+
+
+def job_backend(store, settings, backend, router=None):
+    """backend on per-step models when the job's settings turn model routing on"""
+    if not settings.get('model_routing', router is not None):
+        return backend
+    if router is None:
+        router = ModelRouter.defaults() if settings.get('offline_demo') else ModelRouter.load(store.session)
+    return RoutedBackend(backend, router)
+
+
+def run_job(store, backend, session_id, cache=None, retries=orchestration.DEFAULT_RETRIES, rule_engine=None,
+            router=None):
+    """Run (or resume) one job to completion; steps with a persisted row are not re-run.
+
+    backend is the unrouted backend. The job's settings decide whether it is
+    routed (router, loaded from the registry if not given) and whether the
+    policy pre-screen runs after the Builder step (rule_engine, loaded if not
+    given), so a resumed job is configured as it was created; jobs created
+    without those settings follow the arguments. The screen outcome is persisted
+    as the PRE_SCREEN step and reused on resume.
+
+    Appeal rounds run as the concurrent pipeline (run_appeals_concurrently) unless
+    the job's settings turn concurrent_appeals off; either way each doctor appeal
+    and counter-appeal is persisted as soon as it finishes, and a resumed job
+    hands the persisted ones back to the pipeline instead of calling the agents
+    again. Returns the run_orchestration-shaped result, or None if another
+    worker owns the job.
+    """
+    if not store.claim_job(session_id):
+        return None
+    job = store.load_job(session_id)
+    settings = job['SETTINGS']
+    steps = store.completed_steps(session_id)
+    patient_id, procedure_code, clinical_notes = job['PATIENT_ID'], job['PROCEDURE_CODE'], job['CLINICAL_NOTES']
+
+    def step(name, number, run):
+        if name not in steps:
+            steps[name] = run()
+            store.save_step(job, name, number, steps[name])
+        return steps[name]
+
+    try:
+        backend = job_backend(store, settings, backend, router)
+        generated_claim = step('BUILDER', 1, lambda: orchestration.generate_claim(
+            backend, patient_id, procedure_code, clinical_notes, retries, cache))
+        screen = None
+        if PRE_SCREEN_STEP in steps:
+            screen = PreScreen.from_state(json.loads(steps[PRE_SCREEN_STEP]))
+        else:
+            rule_engine = job_rule_engine(store, settings, rule_engine)
+            if rule_engine is not None:
+                screen = rule_engine.screen(procedure_code, clinical_notes, generated_claim)
+                step(PRE_SCREEN_STEP, 1, lambda: json.dumps(screen.state()))
+        if screen is not None and screen.decided:
+            insurance_rebuttal = step('INSURANCE', 2, screen.insurance_rebuttal)
+            judge_decision = step('JUDGE', 3, screen.judge_decision)
+        else:
+            reviewed_claim = screen.annotate(generated_claim) if screen is not None else generated_claim
+            insurance_rebuttal = step('INSURANCE', 2, lambda: orchestration.analyze_claim(
+                backend, reviewed_claim, procedure_code, retries, cache))
+            judge_decision = step('JUDGE', 3, lambda: orchestration.judge_claim(
+                backend, reviewed_claim, insurance_rebuttal, patient_id, procedure_code, retries, cache))
+
+        digest = None
+        convergence = None
+        doctor_appeals = {}
+        if orchestration.parse_final_decision(judge_decision) == 'DENIED' and not (screen is not None and screen.decided):
+            appeal_inputs = (generated_claim, insurance_rebuttal, judge_decision)
+            if settings.get('compact_context', True):
+                from context_compaction import ContextDigest
+                digest = ContextDigest.build(backend, generated_claim, insurance_rebuttal, judge_decision, procedure_code)
+                appeal_inputs = digest.appeal_inputs()
+            if settings.get('adaptive_appeals', True):
+                convergence = orchestration.AppealConvergence(
+                    initial_strength=orchestration.parse_strength_score(insurance_rebuttal)
+                )
+            claim_input, rebuttal_input, judge_input = appeal_inputs
+            if settings.get('concurrent_appeals', True):
+                doctor_appeals = run_appeals_pipelined(
+                    store, job, steps, backend, claim_input, rebuttal_input, judge_input, retries, cache, convergence
+                )
+            else:
+                doctor_appeals = run_appeals_in_steps(
+                    step, backend, claim_input, rebuttal_input, judge_input, retries, cache, convergence
+                )
+
+        job['APPEAL_STOP_REASON'] = convergence.stop_reason if convergence is not None else None
+        result = result_from_steps(steps, job)
+        result['context_savings'] = digest.token_savings(doctor_appeals) if digest is not None else []
+        result['pre_screen'] = screen.as_dict() if screen is not None else None
+        store.complete_job(session_id, result)
+        return result
+    except Exception as e:
+        store.fail_job(session_id, e)
+        raise
+
+
+class BackgroundJobRunner:
+    """Runs jobs on worker threads; one job per session ID at a time within this process"""
+
+    def __init__(self, store, max_workers=DEFAULT_JOB_WORKERS):
+        self.store = store
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="workflow-job")
+        self._active = {}
+        self._lock = threading.Lock()
+
+    def submit(self, session_id, backend, cache=None, rule_engine=None, router=None):
+        """Start or resume a job unless it is already running here; returns its future"""
+        with self._lock:
+            future = self._active.get(session_id)
+            if future is not None and not future.done():
+                return future
+            future = self._executor.submit(
+                run_job, self.store, backend, session_id, cache, rule_engine=rule_engine, router=router
+            )
+            self._active[session_id] = future
+            return future
+
+    def is_active(self, session_id):
+        with self._lock:
+            future = self._active.get(session_id)
+            return future is not None and not future.done()